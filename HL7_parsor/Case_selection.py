@@ -0,0 +1,139 @@
+"""
+    Purpose:
+    Picks the cases of an export to validate. `export_df` hands every imported row, with its
+    `Classification`, to a case selection engine and validates the rows it returns. Every case
+    costs an IMM search for its accession number and a visit of its Disease Incident, so the
+    'set_cover' engine picks as few (accession, incident) pairs as it can while still covering
+    every (ResultedTest, Classification) combination of the export.
+
+    Engines:
+    - 'last_row': the last row of every (ResultedTest, ResultValue) combination, keeping one
+      Numeric and one ERROR example per ResultedTest (the original sampling).
+    - 'set_cover': greedy set cover of the (ResultedTest, Classification) combinations by
+      (accession, incident) pairs; a pair covers the combinations of all of its rows.
+    - any callable taking the classified rows and returning the cases.
+
+    Algorithm (set cover):
+    1. Collect the combinations covered by each (accession, incident) pair.
+    2. Repeatedly take the pair covering the most combinations not covered yet (the later pair
+       in the export on ties); since a pair never covers more as others are taken, the pairs
+       are kept in a heap and only re-counted when they come to the top (lazy greedy).
+    3. Every combination is validated with the last row of the pair that covered it.
+"""
+
+import heapq
+
+import pandas as pd
+
+from typing import Callable, Dict, List, Union
+
+
+ACCESSION = 'DILR_AccessionNumber'
+INCIDENT = 'DILR_IncidentID'
+
+# the combinations the set cover engine validates an example of
+COVER_COLUMNS = ['DILR_ResultedTest', 'Classification']
+
+
+def last_row_cases(df: pd.DataFrame) -> pd.DataFrame:
+    # only looking at last unique result value for each test
+    # This will make sure that the resultValue and resultTest are unique combos
+    unique_results = df.drop_duplicates(subset=['DILR_ResultedTest', 'DILR_ResultValue'], keep='last')
+
+    # We might have multiple numeric values and we would not want to look at every single one so instead we
+    # only look at one example of this classification for each ResultedTest and that is also why we split the
+    # data into two dataframes and recombine them (because we only want one example of ERROR and Numeric)
+    num_error = unique_results[unique_results['Classification'].isin(['ERROR', 'Numeric'])]
+    num_error = num_error.drop_duplicates(subset=['DILR_ResultedTest', 'Classification'], keep='last')
+    categorical_df = unique_results[unique_results['Classification'].isin(['Categorical'])]
+
+    # Combine dataframe
+    return pd.concat([categorical_df, num_error], ignore_index=True)
+
+
+def set_cover_cases(df: pd.DataFrame, cover: List[str] = COVER_COLUMNS) -> pd.DataFrame:
+    """
+    Picks the fewest (accession, incident) pairs, greedily, that cover every combination of the
+    `cover` columns. Rows without an accession number or incident id can not be looked up and
+    are left out.
+
+    Args:
+        df (pandas.DataFrame): The classified rows of the export.
+        cover (list): The columns whose combinations must be covered.
+
+    Returns:
+        pandas.DataFrame: One row per combination, the last row of the pair covering it, in
+        export order.
+    """
+    rows = df.dropna(subset=[ACCESSION, INCIDENT])
+    if rows.empty:
+        return rows.reset_index(drop=True)
+    combinations = rows.groupby(cover, dropna=False, sort=False).ngroup().to_numpy()
+    pairs = rows.groupby([ACCESSION, INCIDENT], sort=False).ngroup().to_numpy()
+
+    # the combinations of every pair, with the position of the last row of each
+    covered_by: Dict[int, Dict[int, int]] = {}
+    for position, (pair, combination) in enumerate(zip(pairs, combinations)):
+        covered_by.setdefault(pair, {})[combination] = position
+
+    uncovered = set(combinations)
+    heap = [(-len(found), -max(found.values()), pair) for pair, found in covered_by.items()]
+    heapq.heapify(heap)
+    chosen = []
+    while uncovered and heap:
+        gain, last, pair = heapq.heappop(heap)
+        new = uncovered.intersection(covered_by[pair])
+        if len(new) < -gain:
+            # covers less than when it was counted, count it again against the rest
+            if new:
+                heapq.heappush(heap, (-len(new), last, pair))
+            continue
+        uncovered -= new
+        chosen.extend(covered_by[pair][combination] for combination in new)
+    return rows.iloc[sorted(chosen)].reset_index(drop=True)
+
+
+CASE_SELECTIONS: Dict[str, Callable[[pd.DataFrame], pd.DataFrame]] = {
+    'last_row': last_row_cases,
+    'set_cover': set_cover_cases,
+}
+
+
+def selection_name(selection: Union[str, Callable]) -> str:
+    return selection if isinstance(selection, str) else selection.__name__
+
+
+def select_cases(df: pd.DataFrame, selection: Union[str, Callable] = 'last_row') -> pd.DataFrame:
+    """
+    Picks the cases of the classified rows of an export with a case selection engine.
+
+    Args:
+        df (pandas.DataFrame): The classified rows of the export.
+        selection: The name of an engine of CASE_SELECTIONS, or an engine.
+
+    Returns:
+        pandas.DataFrame: The cases to validate.
+
+    Raises:
+        ValueError: If there is no engine of that name.
+    """
+    if callable(selection):
+        return selection(df)
+    if selection not in CASE_SELECTIONS:
+        raise ValueError(f'Unknown case selection {selection}, expected one of {", ".join(CASE_SELECTIONS)}')
+    return CASE_SELECTIONS[selection](df)
+
+
+def expected_visits(df: pd.DataFrame) -> Dict[str, int]:
+    """
+    The browser work the cases will take: one IMM search per accession number (the message of
+    an accession is cached for its other tests, see HL7_Cache) and one visit per Disease
+    Incident (its scrape serves all of its tests, see Incident_Cache).
+
+    Returns:
+        dict: 'cases', 'imm_searches', 'incident_visits' and 'visits' (searches plus visits).
+    """
+    imm_searches = df[ACCESSION].nunique()
+    incident_visits = df[INCIDENT].nunique()
+    return {'cases': len(df), 'imm_searches': imm_searches, 'incident_visits': incident_visits,
+            'visits': imm_searches + incident_visits}
@@ -21,26 +21,212 @@
 
 """
 
-import time
 import os
-import pandas as pd
-import re
 import logging
 
+import lxml.html
+
 from IMM import IMM
+from WebCMR_http import WebCMR_Session
+from DI_snapshot import Field_Extractor, save_snapshot, load_snapshot
+from Incident_cache import Incident_Cache
+from HL7_parser import normalize_test
 from SetUp import SetUp
-from selenium.webdriver.common.alert import Alert
 from selenium.webdriver.common.keys import Keys
 from selenium.webdriver.common.by import By
 from selenium.webdriver.support.select import Select
-from selenium.webdriver.support.wait import WebDriverWait
-from selenium.webdriver.support import expected_conditions as EC
-from selenium.common.exceptions import (TimeoutException, 
-                                        NoSuchElementException, 
-                                        ElementClickInterceptedException)
+from selenium.common.exceptions import (NoSuchElementException, 
+                                        ElementClickInterceptedException,
+                                        WebDriverException)
+
+
+def field(key, element_id, *xpaths, kind='value'):
+    'Spec of one Disease Incident field: its id, fallback xpaths and whether it is a text box or a dropdown'
+    return {'key': key, 'id': element_id, 'xpaths': list(xpaths), 'kind': kind}
+
+
+def lab_field(key, name, *xpaths, kind='value'):
+    'Spec of a field of the first row of the lab grid'
+    return field(key, f'_-11_ctl03_dgLabInfo_ctl02_{name}', *xpaths, kind=kind)
+
+
+def cre_xpath(name):
+    'The CRELab prefixed xpath some WebCMR builds use for lab grid fields'
+    return f'//*[@id="CRELab_-11_ctl03_dgLabInfo_ctl02_{name}"]'
+
+
+# Fields of the Demographics tab
+DEMOGRAPHIC_FIELDS = [
+    field('last_name', 'txtLastName', 'Last Name'),
+    field('first_name', 'txtFirstName', 'First Name'),
+    field('dob', 'txtDOB', 'DOB'),
+    field('race', 'txtReportedRace', 'Race'),
+    field('ethnicity', 'cboEthnicity', kind='select'),
+    field('street', 'txtAddress', 'Address'),
+    field('unit', 'txtApartment', 'Apartment'),
+    field('city', 'txtCity', 'City'),
+    field('state', 'txtState', 'State'),
+    field('zip_code', 'txtZipCode', 'Zip'),
+    field('home_phone', 'txtHomePhone', 'Home Telephone'),
+    field('gender', 'cboGender', kind='select'),
+]
+
+# Fields of the first row of the Laboratory tab grid. Fallback xpaths are tried in order,
+# the same order extract_info tries its xpath and field_name.
+LAB_FIELDS = [
+    lab_field('acc_num', 'txtAccNum', cre_xpath('txtAccNum')),
+    lab_field('specimen_collect_date', 'txtSpecCollDate', cre_xpath('txtSpecCollDate')),
+    lab_field('specimen_received_date', 'txtSpecReceDate', cre_xpath('txtSpecReceDate')),
+    lab_field('specimen_source', 'txtSpecimenSourceText', cre_xpath('txtSpecimenSourceText')),
+    # might need to change ids back to put 'L' at the end
+    lab_field('resulted_test', 'txtResultedTest',
+              '//*[@id="_-11_ctl03_dgLabInfo_ctl02_txtResultedTestL"]', cre_xpath('txtResultedOrganism')),
+    lab_field('result', 'txtResult',
+              '//*[@id="_-11_ctl03_dgLabInfo_ctl02_txtResult"]', cre_xpath('txtResult')),
+    lab_field('result_organism', 'txtResultedOrganism',
+              '//*[@id="_-11_ctl03_dgLabInfo_ctl02_txtResultedOrganismL"]', cre_xpath('txtResultedOrganism')),
+    lab_field('units', 'txtUnits'),
+    lab_field('ref_range', 'txtReferencerange'),
+    lab_field('result_date', 'txtResultDate'),
+    lab_field('perform_facility_id', 'txtPerformingFacilityID'),
+    lab_field('ab_flag', 'ddlAbnormalFlag', '//*[@id="_-11_ctl03_dgLabInfo_ctl02_ddlAbnormalFlag"]', kind='select'),
+    lab_field('ob_results', 'ddlObservationResultStat',
+              '/html/body/form/div[2]/div/div/table[2]/tbody/tr[5]/td/table/tbody/tr/td/div/div/table/tbody/tr/td/table/tbody/tr[1]/td/div[1]/table[2]/tbody/tr[10]/td/table/tbody/tr[4]/td[1]/div[1]/select',
+              kind='select'),
+    lab_field('provider_name', 'txtProviderName'),
+    lab_field('provider_number', 'txtProviderCallBack'),
+    lab_field('provider_street', 'txtProviderAddress', cre_xpath('txtProviderAddress')),
+    lab_field('provider_city', 'txtProviderCity', cre_xpath('txtProviderCity')),
+    lab_field('provider_state', 'txtProviderState', cre_xpath('txtProviderState')),
+    lab_field('provider_zip', 'txtFacilityZip', cre_xpath('txtProviderState')),
+    lab_field('facility_name', 'txtFacilityName', cre_xpath('txtFacilityName')),
+    lab_field('facility_street', 'txtFacilityAddress', cre_xpath('txtFacilityName')),
+    lab_field('facility_city', 'txtFacilityCity', cre_xpath('txtFacilityCity')),
+    lab_field('facility_state', 'txtFacilityState', cre_xpath('txtFacilityState')),
+    lab_field('facility_zip', 'txtFacilityZip', cre_xpath('txtFacilityZip')),
+    lab_field('facility_phone', 'txtFacilityPhone', cre_xpath('txtFacilityPhone')),
+]
+
+WEBCMR_INDICIES = [
+    'Name',
+    'DOB',
+    'Race',
+    'Ethnicity',
+    'Demographic Address',
+    'Phone',
+    'Gender',
+    'Accession Number',
+    'Specimen Collected Date',
+    'Specimen Received Date',
+    'Specimen Source',
+    'Resulted Test',
+    'Result',
+    'Resulted Organism',
+    'Units',
+    'Reference Range',
+    'Result Date',
+    'Abnormal Flag',
+    'Observation Results',
+    'Provider Name',
+    'Provider Address',
+    'Provider Number',
+    'Performing Facility ID',
+    'Facility Name',
+    'Facility Address',
+    'Facility Phone'
+]
+
+# Compiled extractors of the tabs, for reading them from a page source snapshot
+TAB_EXTRACTORS = {
+    'demographics': Field_Extractor(DEMOGRAPHIC_FIELDS),
+    'lab': Field_Extractor(LAB_FIELDS),
+}
+
+# Rows of the lab grid are numbered from ctl02 (ctl01 is its header), each row has an
+# accession number box
+LAB_ROW_XPATH = "//*[contains(@id, 'dgLabInfo_ctl') and contains(@id, '_txtAccNum')]"
+
+
+def lab_row_fields(row):
+    'LAB_FIELDS of a row of the lab grid (0 is the first), keyed `<key>.<row>` after the first row'
+    if row == 0:
+        return LAB_FIELDS
+    first, control = 'dgLabInfo_ctl02_', f'dgLabInfo_ctl{row + 2:02d}_'
+    return [dict(spec, key=f"{spec['key']}.{row}", id=spec['id'].replace(first, control),
+                 xpaths=[xpath.replace(first, control) for xpath in spec['xpaths'] if first in xpath])
+            for spec in LAB_FIELDS]
+
+
+def lab_grid_fields(rows):
+    'The field specs of every row of a lab grid of `rows` rows'
+    return [spec for row in range(rows) for spec in lab_row_fields(row)]
+
+
+def lab_grid_rows(values, rows):
+    'Splits the values read with `lab_grid_fields` into one dict of LAB_FIELDS keys per row'
+    return [{spec['key']: values.get(spec['key'] if row == 0 else f"{spec['key']}.{row}") for spec in LAB_FIELDS}
+            for row in range(rows)]
+
+
+# Shown as the Lab tab resulted test when the lab grid has no row for the test of the case
+TEST_NOT_IN_LAB_GRID = 'test not found in lab grid'
+
+
+def lab_row(lab_rows, resultTest=None):
+    'The lab grid row of a resulted test (the first row without one), None when no row has it'
+    if not resultTest:
+        return lab_rows[0]
+    test = normalize_test(str(resultTest))
+    for row in lab_rows:
+        if row.get('resulted_test') and normalize_test(row['resulted_test']) == test:
+            return row
+    return None
+
+
+# Reads every field spec in one round-trip: tries the id, then each fallback xpath, and returns
+# the value of text boxes or the selected option text of dropdowns (null when not found)
+BULK_EXTRACT_JS = """
+var fields = arguments[0], values = {};
+function byXpath(xpath) {
+    try {
+        return document.evaluate(xpath, document, null, XPathResult.FIRST_ORDERED_NODE_TYPE, null).singleNodeValue;
+    } catch (e) {
+        return null;
+    }
+}
+for (var i = 0; i < fields.length; i++) {
+    var field = fields[i], element = document.getElementById(field.id);
+    for (var j = 0; !element && j < field.xpaths.length; j++) {
+        element = byXpath(field.xpaths[j]);
+    }
+    if (!element) {
+        values[field.key] = null;
+    } else if (field.kind === 'select') {
+        var option = element.selectedIndex >= 0 ? element.options[element.selectedIndex] : null;
+        values[field.key] = option ? option.text.replace(/\\s+/g, ' ').trim() : '';
+    } else {
+        values[field.key] = element.value !== undefined ? element.value : element.getAttribute('value');
+    }
+}
+return values;
+"""
 
 class DI_Search(IMM, SetUp): 
 
+    # read each tab with one script run in the browser instead of one call per field
+    bulk_scrape = True
+
+    # read each tab from one copy of its page source with lxml instead (see DI_snapshot), and
+    # keep those copies in the lab folder so the fields can be read again offline
+    snapshot_scrape = False
+    keep_snapshots = False
+
+    # every Disease Incident is scraped once and serves all resulted tests of the incident;
+    # with `persist_incidents` the scrapes are kept in the lab folder for later runs too,
+    # until `incident_ttl` seconds have passed
+    persist_incidents = False
+    incident_ttl = 24 * 3600
+
     def __init__(self, *args, **kwargs):
         super().__init__(*args, **kwargs)
     
@@ -68,18 +254,22 @@ class DI_Search(IMM, SetUp):
         
         # Scraping values from Demographic and Lab tabs off of TST website
         for i in range(len(di_num_list)):
-            webCMR_values, webCMR_indicies = self.webTST_scrape(driver, di_num_list, i)
+            webCMR_values, webCMR_indicies = self.webTST_scrape(driver, di_num_list, i, df['DILR_ResultedTest'].iloc[i])
         
         return driver, df, webCMR_values, webCMR_indicies
 
-    def webTST_scrape(self, driver, di_num_list, i):
+    def webTST_scrape(self, driver, di_num_list, i, resultTest=None):
         """
         This function scrapes data from the Demographic and Lab tabs off the TST website.
+        An incident scraped before (see `incident_cache`) is not opened again.
 
         Args:
             driver (WebDriver): The WebDriver object to use for interacting with the page.
             di_num_list (list): List of Disease Incident numbers.
             i (int): The index of the Disease Incident list to select specific Disease Incident ids.
+            resultTest (str, optional): The resulted test of the case, picks its row of the lab
+                grid (the first row when it is not given). When no row has the test the Lab tab
+                values are left blank and the resulted test reads TEST_NOT_IN_LAB_GRID.
 
         Returns:
             tuple: containing the following
@@ -90,108 +280,61 @@ class DI_Search(IMM, SetUp):
 
         """
         di_num = int(di_num_list[i])
-            
-        # navigating to disease incidents tab
-        logging.info(f'Clicking Disease Incident tab \n DI_num: {di_num}')
-        DI_tab = driver.find_element(By.ID, 'ibtnTabDisInc')
-        DI_tab.click()
-            
-        # Searching for specific disease incident 
-        logging.info("Inputting DiseaseIncidentID and clicking on Results ")
-        di_search_box = 'txtFindDisInc'
-        DI_search = driver.find_element(By.ID, di_search_box)
-        DI_search.send_keys(str(di_num))
-        DI_search.send_keys(Keys.RETURN)
-        di_link = driver.find_element(By.LINK_TEXT, str(di_num))
-        di_link.click()
-            
+        scrape = self.incident_cache.get(di_num)
+        if scrape is not None:
+            logging.info(f'Using the cached Disease Incident \n DI_num: {di_num}')
+        else:
+            scrape = self.scrape_incident(driver, di_num)
+            self.incident_cache.put(di_num, scrape)
+        return self.webCMR_record(scrape['demographics'], lab_row(scrape['lab'], resultTest))
+
+    def scrape_incident(self, driver, di_num):
+        """
+        Opens a Disease Incident and reads its Demographic tab and every row of its lab grid.
+
+        Args:
+            driver (WebDriver): The WebDriver object (or WebCMR_Session) to use.
+            di_num (int): The Disease Incident id.
+
+        Returns:
+            dict: {'demographics': values of DEMOGRAPHIC_FIELDS, 'lab': values of LAB_FIELDS
+            for every row of the lab grid}.
+        """
+        if isinstance(driver, WebCMR_Session):
+            return self.http_scrape(driver, di_num)
+
+        # opening the learned url of the disease incident directly, else searching for it
+        if self.deep_link(driver, 'disease_incident', 'txtLastName', incident=di_num):
+            logging.info(f'Opened Disease Incident by url \n DI_num: {di_num}')
+        else:
+            # a case whose HL7 message was cached did not go home from the IMM first
+            if not driver.find_elements(By.ID, 'ibtnTabDisInc'):
+                self.go_home(driver)
+
+            # navigating to disease incidents tab
+            logging.info(f'Clicking Disease Incident tab \n DI_num: {di_num}')
+            DI_tab = driver.find_element(By.ID, 'ibtnTabDisInc')
+            DI_tab.click()
+                
+            # Searching for specific disease incident 
+            logging.info("Inputting DiseaseIncidentID and clicking on Results ")
+            di_search_box = 'txtFindDisInc'
+            DI_search = driver.find_element(By.ID, di_search_box)
+            DI_search.send_keys(str(di_num))
+            DI_search.send_keys(Keys.RETURN)
+            di_link = driver.find_element(By.LINK_TEXT, str(di_num))
+            di_link.click()
+                
             # to by pass alert about locked case (just need to read stuff)
-        try: 
-            alert = Alert(driver)
-            alert.accept()
-        except:
-            pass
-
-            # grabbing information from boxes of interest 
-            
-            # ----- Demographics tab -----------
-            logging.info("Extracting Data from Demographic Tab")
-            # Name fields
-        last_name = self.extract_info(
-            driver = driver, 
-            element_id='txtLastName',
-            #'/html/body/form/div[2]/div/div/table/tbody/tr/td/table[2]/tbody/tr[3]/td/table/tbody/tr[2]/td[1]/table/tbody/tr[1]/td/div/div[2]/div[1]/input',
-            field_name='Last Name'
-            )
-        first_name = self.extract_info(
-            driver = driver, 
-            element_id='txtFirstName', 
-            #'/html/body/form/div[2]/div/div/table/tbody/tr/td/table[2]/tbody/tr[3]/td/table/tbody/tr[2]/td[1]/table/tbody/tr[1]/td/div/div[2]/div[2]/input',
-            field_name='First Name'
-            )
-        # print(f"FirstName  FIELD: {first_name} \n Data Type: {type(first_name)}")
-        # print(f"LastName  FIELD: {last_name} \n Data Type: {type(last_name)}")
-        name = first_name + ' ' + last_name
-
-        #print(f'Demographic NAME: {name}')
-
-            # DOB
-        dob = self.extract_info(
-            driver=driver, 
-            element_id='txtDOB',
-            field_name='DOB'
-            )
-
-            # Reported Race
-        race = self.extract_info(
-            driver=driver, 
-            element_id='txtReportedRace',
-            field_name='Race'
-            )
-
-            # Ethnicity
-        ethnicity = self.dropDown_extract(driver, 'cboEthnicity')
-
-            # Address
-        street = self.extract_info(
-            driver = driver, 
-            element_id='txtAddress',
-            field_name='Address'
-            )
-        unit = self.extract_info(
-            driver = driver, 
-            element_id='txtApartment',
-            field_name='Apartment'
-            )
-        city = self.extract_info(
-            driver=driver, 
-            element_id='txtCity',
-            field_name='City'
-            )
-        state = self.extract_info(
-            driver = driver, 
-            element_id='txtState',
-            field_name= 'State'
-            )
-        zip_code = self.extract_info(
-            driver = driver, 
-            element_id='txtZipCode',
-            field_name= 'Zip')
-        demographic_address = street + unit + ', ' + city + ', ' + state + ' ' + zip_code
-
-            # Phone number
-        home_phone = self.extract_info(
-            driver = driver, 
-            element_id='txtHomePhone',
-            field_name='Home Telephone')
-            # cell = self.extract_info(driver, 'txtCellPhone')
-
-            # Gender
-        gender = self.dropDown_extract(driver, 'cboGender')
-
-
-            # -------- Lab tab ------------------
-            # Navigate to lab tab 
+            self.accept_alert(driver)
+            self.learn_url(driver, 'disease_incident', incident=di_num)
+
+        # ----- Demographics tab -----------
+        logging.info("Extracting Data from Demographic Tab")
+        demographics = self.tab_values(driver, DEMOGRAPHIC_FIELDS, 'demographics', di_num)
+
+        # -------- Lab tab ------------------
+        # Navigate to lab tab 
         logging.info('Switching to Lab Tab')
         lab_tab_id = 'ctl37_btnSupplementalTabSYS'
         lab_tab = self.multiFind(driver=driver,
@@ -199,266 +342,202 @@ class DI_Search(IMM, SetUp):
                                  xpath='//*[@value="Laboratory Info"]',
                                  field_name='//*[@value="Laboratory"]')
         lab_tab.click()
-        #time.sleep(60)
-        '''
-        # skip if there is not any info on lab tab
-        x = input('Is there info on lab tab (y/n)?...')
-        if x in ('y', 'yes', 'Y', 'Yes'): 
-            x = None
-        elif x in ('n', 'No', 'no', 'N'): 
-            x = None
-            self.nav2IMM(driver)
-            return 'skip'
-        else: pass
-        # end 
-         '''
+
         logging.info('Grabbing information from Lab Tab')
-            # accession number
-        logging.info('getting accession number')
-        acc_num = self.extract_info(
-            driver=driver, 
-            element_id='_-11_ctl03_dgLabInfo_ctl02_txtAccNum', 
-            field_name='//*[@id="CRELab_-11_ctl03_dgLabInfo_ctl02_txtAccNum"]'
-            )
-            # Specimen Collected Date
-        logging.info('getting specimen collected date')
-        specimen_collect_date = self.extract_info(
-            driver = driver,
-            element_id="_-11_ctl03_dgLabInfo_ctl02_txtSpecCollDate",
-            field_name='//*[@id="CRELab_-11_ctl03_dgLabInfo_ctl02_txtSpecCollDate"]'
-            )
-            # Specimen Received Date 
-        logging.info('getting specimen received date')
-        specimen_received_date = self.extract_info(
-            driver=driver,
-            element_id= "_-11_ctl03_dgLabInfo_ctl02_txtSpecReceDate",
-            field_name='//*[@id="CRELab_-11_ctl03_dgLabInfo_ctl02_txtSpecReceDate"]'
-            )
-            # Specimen Source
-        logging.info('getting specimen source')
-        specimen_source = self.extract_info(
-            driver = driver,
-            element_id="_-11_ctl03_dgLabInfo_ctl02_txtSpecimenSourceText",
-            field_name='//*[@id="CRELab_-11_ctl03_dgLabInfo_ctl02_txtSpecimenSourceText"]'
-            )
-            # Resulted Test
-        logging.info('getting resulted test ')
-        resulted_test = self.extract_info(
-            driver = driver,
-            element_id="_-11_ctl03_dgLabInfo_ctl02_txtResultedTest",  # might need to change id back to put 'L' at the end
-            field_name='//*[@id="CRELab_-11_ctl03_dgLabInfo_ctl02_txtResultedOrganism"]', 
-            xpath='//*[@id="_-11_ctl03_dgLabInfo_ctl02_txtResultedTestL"]'
-            )
-            # result
-        logging.info('getting result section')
-        result = self.extract_info(
-            driver = driver,
-            element_id="_-11_ctl03_dgLabInfo_ctl02_txtResult", # might need to change id back to put 'L' at the end
-            field_name='//*[@id="CRELab_-11_ctl03_dgLabInfo_ctl02_txtResult"]',
-            xpath='//*[@id="_-11_ctl03_dgLabInfo_ctl02_txtResult"]'
-            )
-            # resulted organism 
-        logging.info('getting resulted organism')
-        result_organism = self.extract_info(driver, 
-            element_id="_-11_ctl03_dgLabInfo_ctl02_txtResultedOrganism",
-            field_name= '//*[@id="CRELab_-11_ctl03_dgLabInfo_ctl02_txtResultedOrganism"]',
-            xpath= '//*[@id="_-11_ctl03_dgLabInfo_ctl02_txtResultedOrganismL"]'
-            )
-            # units
-        logging.info('getting units info')
-        units = self.extract_info(
-            driver = driver, 
-            element_id='_-11_ctl03_dgLabInfo_ctl02_txtUnits'
-            )
-            # Reference Range
-        logging.info('getting reference range')
-        ref_range = self.extract_info(
-            driver = driver,
-            element_id='_-11_ctl03_dgLabInfo_ctl02_txtReferencerange'
-            )
-            # Result date
-        logging.info('getting result date')
-        result_date = self.extract_info(
-            driver = driver, 
-            element_id='_-11_ctl03_dgLabInfo_ctl02_txtResultDate'
-            )
-            # Performing facility ID, 
-        logging.info('getting performing facility id')
-        perform_facility_id = self.extract_info(
-            driver,
-            element_id='_-11_ctl03_dgLabInfo_ctl02_txtPerformingFacilityID'
-            )
-            # Abnormal Flag
-        logging.info('getting abnormal flag')
-        ab_flag = self.dropDown_extract(
-            driver=driver,
-            select_id='_-11_ctl03_dgLabInfo_ctl02_ddlAbnormalFlag',
-            menu_id='_-11_ctl03_dgLabInfo_ctl02_ddlAbnormalFlag'
-            )
-            # Observation Ressults
-        logging.info('getting observation results.')
-        ob_results = self.dropDown_extract(
-            driver=driver,
-            select_id='_-11_ctl03_dgLabInfo_ctl02_ddlObservationResultStat',
-            menu_id= '/html/body/form/div[2]/div/div/table[2]/tbody/tr[5]/td/table/tbody/tr/td/div/div/table/tbody/tr/td/table/tbody/tr[1]/td/div[1]/table[2]/tbody/tr[10]/td/table/tbody/tr[4]/td[1]/div[1]/select')
-
-            # Provider name
-        logging.info('getting provider name')
-        provider_name = self.extract_info(
-            driver=driver,
-            element_id= '_-11_ctl03_dgLabInfo_ctl02_txtProviderName'
-            )
-            # Order callback number
-        logging.info('getting provider number')
-        provider_number = self.extract_info(
-            driver = driver,
-            element_id='_-11_ctl03_dgLabInfo_ctl02_txtProviderCallBack'
-            )
-            # Provider address 
-        logging.info('getting provider address')
-        list_of_addressIDs = [
-                ['_-11_ctl03_dgLabInfo_ctl02_txtProviderAddress', '//*[@id="CRELab_-11_ctl03_dgLabInfo_ctl02_txtProviderAddress"]'],
-                ['_-11_ctl03_dgLabInfo_ctl02_txtProviderCity', '//*[@id="CRELab_-11_ctl03_dgLabInfo_ctl02_txtProviderCity"]'],
-                ['_-11_ctl03_dgLabInfo_ctl02_txtProviderState','//*[@id="CRELab_-11_ctl03_dgLabInfo_ctl02_txtProviderState"]'],
-                ['_-11_ctl03_dgLabInfo_ctl02_txtFacilityZip', '//*[@id="CRELab_-11_ctl03_dgLabInfo_ctl02_txtProviderState"]']
-                ]
-        provider_address = self.address(driver, list_of_addressIDs)
-
-            # Facility name 
-        logging.info('getting facility name')
-        facility_name = self.extract_info(
-            driver = driver,
-            element_id='_-11_ctl03_dgLabInfo_ctl02_txtFacilityName',
-            field_name='//*[@id="CRELab_-11_ctl03_dgLabInfo_ctl02_txtFacilityName"]')
-            
-            # Facility address
-        logging.info('getting facility address')
-        facility_address_ids = [
-                ['_-11_ctl03_dgLabInfo_ctl02_txtFacilityAddress', '//*[@id="CRELab_-11_ctl03_dgLabInfo_ctl02_txtFacilityName"]'],
-                ['_-11_ctl03_dgLabInfo_ctl02_txtFacilityCity', '//*[@id="CRELab_-11_ctl03_dgLabInfo_ctl02_txtFacilityCity"]'],
-                ['_-11_ctl03_dgLabInfo_ctl02_txtFacilityState', '//*[@id="CRELab_-11_ctl03_dgLabInfo_ctl02_txtFacilityState"]'],
-                ['_-11_ctl03_dgLabInfo_ctl02_txtFacilityZip', '//*[@id="CRELab_-11_ctl03_dgLabInfo_ctl02_txtFacilityZip"]']
-            ]
-        facility_address = self.address(driver, facility_address_ids)
-
-            # Facility phone number
-        logging.info('getting facility phone number')
-        facility_phone = self.extract_info(
-            driver=driver,
-            element_id='_-11_ctl03_dgLabInfo_ctl02_txtFacilityPhone',
-            field_name= '//*[@id="CRELab_-11_ctl03_dgLabInfo_ctl02_txtFacilityPhone"]'
-            )
-            # have to click cancel after I am done with getting information from both tabs
+        rows = self.lab_grid_size(driver)
+        lab = lab_grid_rows(self.tab_values(driver, lab_grid_fields(rows), 'lab', di_num), rows)
+
+        # have to click cancel after I am done with getting information from both tabs
         logging.info('Finished grabbing information from WebCMR website')
         cancel_id = 'btnCancel'
         cancel_btn = driver.find_element(By.ID, cancel_id)
         cancel_btn.click()            
 
-            # storing all of this information in a list 
-            
-        webCMR_values = [
-                name,
-                dob,
-                race,
-                ethnicity,
-                demographic_address,
-                home_phone,
-                gender,
-                acc_num,
-                specimen_collect_date,
-                specimen_received_date,
-                specimen_source, 
-                resulted_test,
-                result,
-                result_organism,
-                units,
-                ref_range,
-                result_date,
-                ab_flag,
-                ob_results,
-                provider_name,
-                provider_address,
-                provider_number,
-                perform_facility_id,
-                facility_name,
-                facility_address,
-                facility_phone
-            ]
-        webCMR_indicies = [
-                'Name',
-                'DOB',
-                'Race',
-                'Ethnicity',
-                'Demographic Address',
-                'Phone',
-                'Gender',
-                'Accession Number',
-                'Specimen Collected Date',
-                'Specimen Received Date',
-                'Specimen Source',
-                'Resulted Test',
-                'Result',
-                'Resulted Organism',
-                'Units',
-                'Reference Range',
-                'Result Date',
-                'Abnormal Flag',
-                'Observation Results',
-                'Provider Name',
-                'Provider Address',
-                'Provider Number',
-                'Performing Facility ID',
-                'Facility Name',
-                'Facility Address',
-                'Facility Phone'
-            ]
-            # test_name, acc_num = df['DILR_ResultedTest'][i], df['DILR_AccessionNumber'][i]
-            
-            # Replace special characters and spaces with "_"
-            # file_name = re.sub(r'[^\w\s]+', '_', f'{test_name}_AccNum_{acc_num}_IncidentID_{di_num}')
-
-            # curr_dir = os.getcwd()
-            # webCMR_df = pd.DataFrame(data=webCMR_values, columns=['TSTWebCMR Data'], index=webCMR_indicies)
-            # webCMR_df.to_excel(f'{curr_dir}/{file_name}.xlsx')
-
             # navigating to IMM menu after DI searches
         _ = self.nav2IMM(driver)
-        return (webCMR_values,webCMR_indicies)
+        return {'demographics': demographics, 'lab': lab}
 
-    def address(self, driver, ids : list):
+    def http_scrape(self, session, di_num):
         """
-        Retrieves the address information and puts them into a string for a given web driver 
-        and a list of web element IDs.
-        
+        `webTST_scrape` over a browserless HTTP session.
+
         Args:
-            driver (object): The driver object used to interact with the web page.
-            ids (list): A list of IDs containing the element ID and field name for each address component.
-        
+            session (WebCMR_Session): The logged in session.
+            di_num (int): The Disease Incident id.
+
         Returns:
-            str: The concatenated address string in the format "street, city, state zip".
+            dict: The demographics and lab grid rows, as returned by `scrape_incident`.
+        """
+        logging.info(f'Opening Disease Incident over HTTP \n DI_num: {di_num}')
+        session.open_incident(di_num, self.learned_url('disease_incident', incident=di_num))
+        demographics = session.read_fields(DEMOGRAPHIC_FIELDS)
+
+        # the lab tab is a postback of the incident page
+        session.postback(button='ctl37_btnSupplementalTabSYS',
+                         button_xpaths=['//*[@value="Laboratory Info"]', '//*[@value="Laboratory"]'])
+        rows = self.lab_grid_size(session)
+        lab = lab_grid_rows(session.read_fields(lab_grid_fields(rows)), rows)
+        return {'demographics': demographics, 'lab': lab}
+
+    def lab_grid_size(self, driver):
+        'The number of rows of the lab grid on the current page (at least one)'
+        if isinstance(driver, WebCMR_Session):
+            return max(1, len(driver.page.xpath(LAB_ROW_XPATH)))
+        try:
+            return max(1, len(driver.find_elements(By.XPATH, LAB_ROW_XPATH)))
+        except WebDriverException as e:
+            logging.info(f'Could not count the lab grid rows, reading the first one: {e}')
+            return 1
+
+    @property
+    def incident_cache(self):
+        'The Disease Incident scrapes of this run, or of the lab folder with `persist_incidents`'
+        if getattr(self, '_incident_cache', None) is None:
+            path = os.path.join(self.lab_dir(), 'incident_cache.sqlite') if self.persist_incidents else None
+            self._incident_cache = Incident_Cache(path, self.incident_ttl)
+        return self._incident_cache
+
+    def tab_values(self, driver, fields, tab=None, di_num=None):
         """
-        prov_st = self.extract_info(
-            driver= driver,
-            element_id=ids[0][0],
-            field_name=ids[0][1]
-            )
-        prov_city = self.extract_info(
-            driver=driver,
-            element_id=ids[1][0],
-            field_name=ids[1][1]
-            )
-        prov_state = self.extract_info(
-            driver=driver,
-            element_id=ids[2][0],
-            field_name=ids[2][1]
-            )
-        prov_zip = self.extract_info(
-            driver = driver,
-            element_id=ids[3][0],
-            field_name=ids[3][1]
-            )
-        provider_address = prov_st + ', ' + prov_city +', ' + prov_state + ' ' + prov_zip
-        return provider_address
+        Reads every field of a Disease Incident tab.
+
+        With `snapshot_scrape` on, the page source is fetched once and the fields are read
+        from it with the compiled extractor of the tab; `keep_snapshots` also saves it.
+        With `bulk_scrape` on, all fields are read by one script run in the browser (one
+        WebDriver round-trip per tab), evaluating the id and xpath fallbacks there. If the
+        script cannot run, or `bulk_scrape` is off, each field is read with `extract_info` /
+        `dropDown_extract`.
+
+        Args:
+            driver (WebDriver): The WebDriver object to use for interacting with the page.
+            fields (list): Field specs, see DEMOGRAPHIC_FIELDS and LAB_FIELDS.
+            tab (str, optional): 'demographics' or 'lab', names the snapshot of the tab.
+            di_num (int, optional): The Disease Incident id, names the snapshot of the tab.
+
+        Returns:
+            dict: The value (or selected option text) of every field keyed by its 'key'.
+            Fields that are not on the page are None.
+        """
+        if self.snapshot_scrape:
+            html = driver.page_source
+            if self.keep_snapshots and tab and di_num is not None:
+                save_snapshot(self.snapshot_folder(), di_num, tab, html)
+            extractor = TAB_EXTRACTORS.get(tab)
+            if extractor is None or extractor.fields != list(fields):
+                extractor = Field_Extractor(fields)
+            return extractor.extract(html)
+
+        if self.bulk_scrape:
+            try:
+                return driver.execute_script(BULK_EXTRACT_JS, fields)
+            except WebDriverException as e:
+                logging.info(f'Bulk extraction failed, reading fields one at a time: {e}')
+
+        values = {}
+        for field in fields:
+            fallbacks = list(field['xpaths'])
+            if field['kind'] == 'select':
+                try:
+                    values[field['key']] = self.dropDown_extract(driver, field['id'], next(iter(fallbacks), None))
+                except NoSuchElementException:
+                    values[field['key']] = None
+            else:
+                values[field['key']] = self.extract_info(
+                    driver=driver,
+                    element_id=field['id'],
+                    xpath=next(iter(fallbacks), None),
+                    field_name=fallbacks[1] if len(fallbacks) > 1 else None
+                    )
+        return values
+
+    def snapshot_folder(self):
+        'The folder of the saved Disease Incident page sources of the lab'
+        return os.path.join(self.lab_dir(), 'DI_snapshots')
+
+    def scrape_snapshot(self, di_num, folder=None, resultTest=None):
+        """
+        `webTST_scrape` from the saved page sources of a Disease Incident, without WebCMR.
+
+        Args:
+            di_num (int): The Disease Incident id.
+            folder (str, optional): The snapshot folder. Defaults to the lab's snapshot folder.
+            resultTest (str, optional): The resulted test picking the row of the lab grid.
+
+        Returns:
+            tuple: (webCMR_values, webCMR_indicies) as returned by `webTST_scrape`.
+        """
+        folder = folder or self.snapshot_folder()
+        demographics = TAB_EXTRACTORS['demographics'].extract(load_snapshot(folder, di_num, 'demographics'))
+        page = lxml.html.fromstring(load_snapshot(folder, di_num, 'lab'))
+        rows = max(1, len(page.xpath(LAB_ROW_XPATH)))
+        lab = lab_grid_rows(Field_Extractor(lab_grid_fields(rows)).extract(page), rows)
+        return self.webCMR_record(demographics, lab_row(lab, resultTest))
+
+    def webCMR_record(self, demographics, lab):
+        """
+        Puts the scraped Demographic and Lab tab fields together in report order.
+
+        Args:
+            demographics (dict): Values of DEMOGRAPHIC_FIELDS from `tab_values`.
+            lab (dict): Values of LAB_FIELDS from `tab_values`, None when the lab grid has no row
+                for the resulted test.
+
+        Returns:
+            tuple: containing the following
+                 - webCMR_values: The values scraped from the Demographic and Lab tabs off the TST website.
+                 - webCMR_indicies: The indices of the values scraped from the TST website.
+        """
+        def text(values, key):
+            value = values.get(key)
+            return '' if value is None else value
+
+        def select(values, key):
+            value = values.get(key)
+            return 'CODE ERROR....element not found but is there' if value is None else value
+
+        def address(values, prefix):
+            return (text(values, f'{prefix}_street') + ', ' + text(values, f'{prefix}_city') + ', '
+                    + text(values, f'{prefix}_state') + ' ' + text(values, f'{prefix}_zip'))
+
+        if lab is None:
+            # blank Lab tab values instead of another test's row, flagged in the resulted test
+            lab = {spec['key']: '' for spec in LAB_FIELDS}
+            lab['resulted_test'] = TEST_NOT_IN_LAB_GRID
+
+        name = text(demographics, 'first_name') + ' ' + text(demographics, 'last_name')
+        demographic_address = (text(demographics, 'street') + text(demographics, 'unit') + ', '
+                               + text(demographics, 'city') + ', ' + text(demographics, 'state') + ' '
+                               + text(demographics, 'zip_code'))
+
+        webCMR_values = [
+                name,
+                text(demographics, 'dob'),
+                text(demographics, 'race'),
+                select(demographics, 'ethnicity'),
+                demographic_address,
+                text(demographics, 'home_phone'),
+                select(demographics, 'gender'),
+                text(lab, 'acc_num'),
+                text(lab, 'specimen_collect_date'),
+                text(lab, 'specimen_received_date'),
+                text(lab, 'specimen_source'), 
+                text(lab, 'resulted_test'),
+                text(lab, 'result'),
+                text(lab, 'result_organism'),
+                text(lab, 'units'),
+                text(lab, 'ref_range'),
+                text(lab, 'result_date'),
+                select(lab, 'ab_flag'),
+                select(lab, 'ob_results'),
+                text(lab, 'provider_name'),
+                address(lab, 'provider'),
+                text(lab, 'provider_number'),
+                text(lab, 'perform_facility_id'),
+                text(lab, 'facility_name'),
+                address(lab, 'facility'),
+                text(lab, 'facility_phone')
+            ]
+        return webCMR_values, list(WEBCMR_INDICIES)
 
     def dropDown_extract(self, driver,  select_id, menu_id=None):
         """
@@ -510,28 +589,13 @@ class DI_Search(IMM, SetUp):
             ElementClickInterceptedException: If an element intercepts the click action during execution.
 
         """
-        
-        wait = WebDriverWait(driver, 1)
         try: 
-            element_btn = wait.until(EC.presence_of_element_located((By.ID, element_id)))
-            value = element_btn.get_attribute('value')
-            return value
-        except TimeoutException:
-
-            if xpath:
-                try: 
-                    element_btn = wait.until(EC.presence_of_element_located((By.XPATH, xpath)))
-                    value = element_btn.get_attribute('value')
-                    return value
-                except: 
-                    pass
-            if field_name:
-                try: 
-                    element_btn = wait.until(EC.presence_of_element_located((By.XPATH, field_name)))
-                    value = element_btn.get_attribute('value')
-                    return value
-                except: 
-                    print(f'Cannot locate desired field:\n {field_name}')
-            
+            element_btn = self.locate(driver, element_id, xpath, field_name, skip_absent=True)
         except ElementClickInterceptedException: 
-            self.alert_handling(driver)
\ No newline at end of file
+            self.alert_handling(driver)
+            return None
+        if element_btn is None:
+            if field_name:
+                print(f'Cannot locate desired field:\n {field_name}')
+            return None
+        return element_btn.get_attribute('value')
\ No newline at end of file
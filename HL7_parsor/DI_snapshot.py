@@ -0,0 +1,108 @@
+"""
+    Purpose:
+    Reads the Disease Incident fields out of a saved copy of a page (`driver.page_source`)
+    instead of asking the browser for every element. The `Field_Extractor` compiles the id and
+    fallback xpaths of the field specs (see DI_Incident.DEMOGRAPHIC_FIELDS) once with lxml, so
+    reading every field of a tab takes milliseconds, and snapshots saved to disk can be parsed
+    again after the field specs are tuned without going back to WebCMR.
+
+    Algorithm:
+    1. Compile, for every field, an xpath for its id and each fallback xpath (invalid xpaths,
+       such as plain field labels, are dropped).
+    2. Parse the page once and take the first element any of a field's xpaths finds.
+    3. Text boxes give their `value`, dropdowns the text of their selected option (the first
+       option when none is marked selected, as the browser shows it).
+    4. Snapshots are stored as `<incident id>_<tab>.html` in a folder.
+"""
+
+import os
+
+import lxml.html
+import lxml.etree
+
+from typing import Dict, Iterable, List, Optional
+
+
+# finds an element by the id passed as $id
+ID_XPATH = lxml.etree.XPath('//*[@id=$id]')
+
+
+class Field_Extractor:
+
+    def __init__(self, fields: Iterable[dict]):
+        """
+        Compiles the xpaths of field specs.
+
+        Parameters:
+            fields (list): Field specs with 'key', 'id', 'xpaths' and 'kind' ('value' or 'select').
+
+        Returns:
+            None
+        """
+        self.fields = list(fields)
+        self.xpaths: Dict[str, List[lxml.etree.XPath]] = {}
+        for field in self.fields:
+            compiled = [ID_XPATH]
+            for xpath in field['xpaths']:
+                try:
+                    compiled.append(lxml.etree.XPath(xpath))
+                except lxml.etree.XPathSyntaxError:
+                    continue
+            self.xpaths[field['key']] = compiled
+
+    def element(self, page, field: dict):
+        'The element of a field on a parsed page, None when no xpath finds it'
+        for xpath in self.xpaths[field['key']]:
+            try:
+                matches = xpath(page, id=field['id'])
+            except lxml.etree.XPathEvalError:
+                continue
+            if matches:
+                return matches[0]
+        return None
+
+    def extract(self, page) -> Dict[str, Optional[str]]:
+        """
+        Reads every field from a page.
+
+        Args:
+            page: The page HTML (str or bytes) or an already parsed lxml document.
+
+        Returns:
+            dict: The value of text boxes, or the selected option text of dropdowns, keyed by the
+            field 'key'; None for fields that are not on the page.
+        """
+        if isinstance(page, (str, bytes)):
+            page = lxml.html.fromstring(page)
+        values = {}
+        for field in self.fields:
+            element = self.element(page, field)
+            if element is None:
+                values[field['key']] = None
+            elif field['kind'] == 'select':
+                options = element.xpath('.//option[@selected]') or element.xpath('.//option')[:1]
+                values[field['key']] = ' '.join(options[0].text_content().split()) if options else ''
+            elif element.tag == 'textarea':
+                values[field['key']] = element.text_content()
+            else:
+                values[field['key']] = element.get('value', '')
+        return values
+
+
+def snapshot_path(folder: str, di_num: int, tab: str) -> str:
+    return os.path.join(folder, f'{int(di_num)}_{tab}.html')
+
+
+def save_snapshot(folder: str, di_num: int, tab: str, html: str) -> str:
+    'Save the page source of a Disease Incident tab; returns its path'
+    os.makedirs(folder, exist_ok=True)
+    path = snapshot_path(folder, di_num, tab)
+    with open(path, 'w', encoding='utf-8') as output:
+        output.write(html)
+    return path
+
+
+def load_snapshot(folder: str, di_num: int, tab: str) -> str:
+    'The saved page source of a Disease Incident tab'
+    with open(snapshot_path(folder, di_num, tab), encoding='utf-8') as snapshot:
+        return snapshot.read()
@@ -0,0 +1,111 @@
+"""
+    Purpose:
+    `wait_for_download` waits for a browser download to finish in a folder and returns the
+    path of the finished file. On Linux the folder is watched with inotify so the wait ends
+    as soon as the file is renamed into place; elsewhere the folder is polled at a short
+    interval. Partial downloads (`.crdownload`, `.part`, `.tmp`) are never returned.
+
+    Algorithm:
+    1. Snapshot the folder before the download is started.
+    2. Look for a new file with a wanted suffix while no partial download is pending.
+    3. If there is none yet, sleep until inotify reports a file written or moved into the
+       folder (or for the poll interval) and look again, until the timeout.
+"""
+
+import os
+import sys
+import time
+import ctypes
+import ctypes.util
+import select
+import logging
+
+from typing import Iterable, Optional, Set
+
+
+PARTIAL_SUFFIXES = ('.crdownload', '.part', '.tmp')
+
+# inotify events of a file finished in (or renamed into) the folder
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_TO = 0x00000080
+
+
+def finished_download(folder: str, before: Set[str], suffixes: Iterable[str] = ('.xlsx',)) -> Optional[str]:
+    """
+    Returns the newest file of the folder that is not in `before` and has one of the suffixes,
+    or None while there is none or a partial download is still pending.
+    """
+    names = set(os.listdir(folder)) - before
+    if any(name.lower().endswith(PARTIAL_SUFFIXES) for name in names):
+        return None
+    suffixes = tuple(suffix.lower() for suffix in suffixes)
+    paths = [os.path.join(folder, name) for name in names if name.lower().endswith(suffixes)]
+    return max(paths, key=os.path.getmtime) if paths else None
+
+
+def _inotify(folder: str) -> Optional[int]:
+    'An inotify file descriptor watching the folder, None when inotify is not available'
+    if not sys.platform.startswith('linux'):
+        return None
+    try:
+        libc = ctypes.CDLL(ctypes.util.find_library('c') or 'libc.so.6', use_errno=True)
+        fd = libc.inotify_init1(os.O_NONBLOCK | os.O_CLOEXEC)
+        if fd < 0:
+            return None
+        if libc.inotify_add_watch(fd, os.fsencode(folder), IN_CLOSE_WRITE | IN_MOVED_TO) < 0:
+            os.close(fd)
+            return None
+        return fd
+    except (OSError, AttributeError) as e:
+        logging.info(f'inotify not available, polling the download folder: {e}')
+        return None
+
+
+def wait_for_download(
+    folder: str,
+    before: Set[str],
+    suffixes: Iterable[str] = ('.xlsx',),
+    timeout: float = 600,
+    poll_interval: float = 0.25,
+    use_inotify: bool = True
+    ) -> str:
+    """
+    Waits for a download to finish in a folder.
+
+    Parameters:
+        folder (str): The download folder.
+        before (set): Names in the folder before the download started.
+        suffixes (list): Suffixes of the wanted file.
+        timeout (float): Seconds to wait before giving up.
+        poll_interval (float): Seconds between looks at the folder when it is polled.
+        use_inotify (bool): Watch the folder with inotify where it is available.
+
+    Returns:
+        str: Path of the finished file.
+
+    Raises:
+        TimeoutError: If no finished file showed up in time.
+    """
+    deadline = time.monotonic() + timeout
+    fd = _inotify(folder) if use_inotify else None
+    try:
+        while True:
+            path = finished_download(folder, before, suffixes)
+            if path:
+                return path
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                raise TimeoutError(f'No finished download in {folder} after {timeout} seconds')
+            if fd is None:
+                time.sleep(min(poll_interval, remaining))
+                continue
+            # wake up on the next file written or renamed into the folder
+            readable, _, _ = select.select([fd], [], [], remaining)
+            if readable:
+                try:
+                    os.read(fd, 64 * 1024)
+                except BlockingIOError:
+                    pass
+    finally:
+        if fd is not None:
+            os.close(fd)
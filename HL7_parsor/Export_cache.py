@@ -0,0 +1,134 @@
+"""
+    Purpose:
+    The `Export_Cache` class keeps the frames `IMM.export_df` builds from an IMM export as
+    Parquet files named by the SHA-256 of the export, so a repeated or resumed run on the same
+    export loads them instead of reading, filtering and classifying it again. The raw frame
+    (the columns read from the export) and the final frame (the cases to validate) are kept
+    separately: when the processing changes, `FINAL_VERSION` is raised and the final frame is
+    built again from the cached raw frame.
+
+    Algorithm:
+    1. Hash the export in chunks; the digest names its cache files.
+    2. Look for `<digest>.final.<case selection>.v<FINAL_VERSION>.parquet`, then
+       `<digest>.raw.parquet`.
+    3. New frames are written to a temporary file and renamed into place, so an interrupted
+       run never leaves a half written cache file behind.
+    4. Parquet needs pyarrow (a requirement; fastparquet works too); without either the cache
+       is turned off.
+    5. Files not used for `max_age` seconds (a load refreshes the modification time) are
+       deleted when the cache is opened, so the folder does not have to be cleaned by hand.
+"""
+
+import os
+import time
+import hashlib
+import logging
+
+import numpy as np
+import pandas as pd
+
+from typing import Optional
+
+
+# raise when export_df processes the raw frame differently, so cached final frames are rebuilt
+FINAL_VERSION = 1
+
+
+def parquet_engine() -> Optional[str]:
+    'The installed Parquet engine, None when there is none'
+    for engine in ('pyarrow', 'fastparquet'):
+        try:
+            __import__(engine)
+            return engine
+        except ImportError:
+            continue
+    return None
+
+
+def file_digest(path: str, chunk_size: int = 1024 * 1024) -> str:
+    'The SHA-256 of a file'
+    digest = hashlib.sha256()
+    with open(path, 'rb') as source:
+        for chunk in iter(lambda: source.read(chunk_size), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+class Export_Cache:
+
+    def __init__(self, folder: str, max_age: float = 30 * 24 * 3600):
+        """
+        Opens (or creates) an export cache and deletes the files that were not used for max_age.
+
+        Parameters:
+            folder (str): The folder the Parquet files are kept in.
+            max_age (float): Seconds a cache file is kept after it was last written or loaded.
+
+        Returns:
+            None
+        """
+        self.folder = folder
+        self.max_age = max_age
+        self.engine = parquet_engine()
+        if self.engine is None:
+            logging.warning('No Parquet engine (pyarrow) installed, exports are not cached')
+        else:
+            os.makedirs(folder, exist_ok=True)
+            self.evict()
+
+    @property
+    def enabled(self) -> bool:
+        return self.engine is not None
+
+    def evict(self):
+        'Delete the cache files (and leftover temporary files) not used for max_age'
+        cutoff = time.time() - self.max_age
+        for entry in os.scandir(self.folder):
+            if not entry.name.endswith(('.parquet', '.tmp')):
+                continue
+            try:
+                if entry.stat().st_mtime < cutoff:
+                    os.remove(entry.path)
+            except OSError as e:
+                logging.info(f'Could not evict the cached export {entry.path}: {e}')
+
+    def path(self, digest: str, kind: str) -> str:
+        'The cache file of the raw frame or a final frame (\'final.<case selection>\') of an export'
+        name = f'{digest}.{kind}.v{FINAL_VERSION}.parquet' if kind.startswith('final') else f'{digest}.{kind}.parquet'
+        return os.path.join(self.folder, name)
+
+    def load(self, digest: str, kind: str) -> Optional[pd.DataFrame]:
+        'The cached raw or final frame of an export, None when it is not cached'
+        path = self.path(digest, kind)
+        if not self.enabled or not os.path.exists(path):
+            return None
+        try:
+            frame = pd.read_parquet(path, engine=self.engine)
+        except Exception as e:
+            logging.info(f'Could not read the cached export {path}: {e}')
+            return None
+        # a load counts as a use, eviction goes by the modification time
+        try:
+            os.utime(path)
+        except OSError:
+            pass
+        # text comes back as a string dtype and empty cells as None; the export readers give
+        # object columns with NaN
+        for column in frame.columns:
+            if pd.api.types.is_string_dtype(frame[column].dtype):
+                frame[column] = frame[column].astype(object)
+        return frame.where(frame.notna(), np.nan)
+
+    def store(self, digest: str, kind: str, frame: pd.DataFrame):
+        'Cache the raw or final frame of an export'
+        if not self.enabled:
+            return
+        path = self.path(digest, kind)
+        partial = f'{path}.{os.getpid()}.tmp'
+        try:
+            frame.to_parquet(partial, engine=self.engine)
+            os.replace(partial, path)
+        except Exception as e:
+            logging.info(f'Could not cache the export as {path}: {e}')
+            if os.path.exists(partial):
+                os.remove(partial)
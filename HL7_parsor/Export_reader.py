@@ -0,0 +1,209 @@
+"""
+    Purpose:
+    Reads an IMM export with only the columns `IMM.export_df` uses, as text. The IMM exports
+    the search results as CSV, XML or an Excel workbook; parsing the whole workbook with
+    `pd.read_excel` is the slowest part of starting a run on a big export, so each format is
+    streamed instead and every other column is skipped while reading.
+
+    Algorithm:
+    1. CSV exports are read by `pd.read_csv` with `usecols`, keeping every cell as text.
+    2. Excel workbooks are streamed row by row from the worksheet xml with lxml `iterparse`,
+       keeping only the cells in the columns the header row names (openpyxl builds a Python
+       object for every cell, which is what makes `pd.read_excel` slow).
+    3. XML exports are streamed with lxml `iterparse`; a row is the element holding the wanted
+       column elements, and each row is cleared once it was read.
+    4. Missing cells are NaN, every other cell is its text (whole numbers without '.0').
+"""
+
+import os
+import zipfile
+
+import numpy as np
+import pandas as pd
+import lxml.etree
+
+from typing import Iterable, List, Optional, Sequence
+
+
+# the columns export_df uses
+EXPORT_COLUMNS = ['DILR_ImportStatus', 'DILR_ResultedTest', 'DILR_IncidentID',
+                  'DILR_AccessionNumber', 'DILR_ResultValue']
+
+# export format: (radio button of the export dialog, suffixes of the downloaded file)
+EXPORT_FORMATS = {
+    'csv': ('optFormat_0', ('.csv',)),
+    'xml': ('optFormat_1', ('.xml',)),
+    'excel': ('optFormat_2', ('.xlsx', '.xls')),
+}
+
+# namespaces of the worksheet xml of a workbook
+SHEET_NS = 'http://schemas.openxmlformats.org/spreadsheetml/2006/main'
+RELATION_NS = 'http://schemas.openxmlformats.org/officeDocument/2006/relationships'
+
+EXPORT_SUFFIXES = tuple(suffix for _, suffixes in EXPORT_FORMATS.values() for suffix in suffixes)
+
+
+def _text(value) -> Optional[str]:
+    'The text of a cell, NaN for an empty one'
+    if value is None or value == '':
+        return np.nan
+    if isinstance(value, float) and value.is_integer():
+        return str(int(value))
+    return str(value)
+
+
+def _frame(rows: Iterable[Sequence], columns: List[str]) -> pd.DataFrame:
+    return pd.DataFrame(list(rows), columns=columns, dtype=object)
+
+
+def _missing(path: str, columns: Iterable[str], found: Iterable[str]):
+    missing = [column for column in columns if column not in found]
+    if missing:
+        raise ValueError(f'{path} has no column {", ".join(missing)}')
+
+
+def read_csv_export(path: str, columns: List[str] = EXPORT_COLUMNS) -> pd.DataFrame:
+    return pd.read_csv(path, usecols=columns, dtype=object, keep_default_na=False, na_values=[''],
+                       encoding='utf-8-sig')[columns]
+
+
+def _sheet_part(workbook: zipfile.ZipFile) -> str:
+    'The zip part of the first worksheet of a workbook'
+    book = lxml.etree.fromstring(workbook.read('xl/workbook.xml'))
+    sheet = book.find(f'{{{SHEET_NS}}}sheets/{{{SHEET_NS}}}sheet')
+    relation = sheet.get(f'{{{RELATION_NS}}}id') if sheet is not None else None
+    if relation and 'xl/_rels/workbook.xml.rels' in workbook.namelist():
+        for link in lxml.etree.fromstring(workbook.read('xl/_rels/workbook.xml.rels')):
+            if link.get('Id') == relation:
+                target = link.get('Target')
+                return target.lstrip('/') if target.startswith('/') else f'xl/{target}'
+    return 'xl/worksheets/sheet1.xml'
+
+
+def _shared_strings(workbook: zipfile.ZipFile) -> List[str]:
+    if 'xl/sharedStrings.xml' not in workbook.namelist():
+        return []
+    strings = []
+    with workbook.open('xl/sharedStrings.xml') as part:
+        for _, item in lxml.etree.iterparse(part, tag=f'{{{SHEET_NS}}}si'):
+            # rich text keeps its runs in several <t>, phonetic hints (<rPh>) are not shown
+            strings.append(''.join(text.text or '' for text in item.iter(f'{{{SHEET_NS}}}t')
+                                   if text.getparent().tag != f'{{{SHEET_NS}}}rPh'))
+            item.clear()
+    return strings
+
+
+def _cell_value(cell, strings: List[str]):
+    kind = cell.get('t')
+    if kind == 'inlineStr':
+        return ''.join(cell.itertext())
+    value = cell.findtext(f'{{{SHEET_NS}}}v')
+    if value is None:
+        return None
+    if kind == 's':
+        return strings[int(value)]
+    if kind in ('str', 'e'):
+        return value
+    if kind == 'b':
+        return value == '1'
+    return float(value) if any(c in value for c in '.eE') else int(value)
+
+
+def _column(reference: str) -> str:
+    'The column letters of a cell reference (AB12 -> AB)'
+    return reference.rstrip('0123456789')
+
+
+def _row_cells(cells: list) -> dict:
+    'The cells of a row by column letters (by position when the cells have no reference)'
+    return {_column(cell.get('r')) if cell.get('r') else position: cell for position, cell in enumerate(cells)}
+
+
+def _wanted_cells(cells: list, slots: list) -> list:
+    'The cells of the wanted (column letters, position in the header row) slots of a row'
+    found = []
+    for letter, position in slots:
+        cell = cells[position] if position < len(cells) else None
+        reference = cell.get('r') if cell is not None else None
+        if cell is None or (reference and _column(reference) != letter):
+            # a row with empty cells left out: look the columns up by cell reference
+            by_column = _row_cells(cells)
+            return [by_column.get(letter) for letter, _ in slots]
+        found.append(cell)
+    return found
+
+
+def read_excel_export(path: str, columns: List[str] = EXPORT_COLUMNS) -> pd.DataFrame:
+    if path.lower().endswith('.xls'):
+        # the legacy format can not be streamed, pandas reads it with xlrd
+        frame = pd.read_excel(path, usecols=columns, dtype=object)[columns]
+        return frame.apply(lambda column: column.map(_text))
+
+    cell_tag = f'{{{SHEET_NS}}}c'
+    with zipfile.ZipFile(path) as workbook:
+        strings = _shared_strings(workbook)
+        slots, rows = None, []
+        with workbook.open(_sheet_part(workbook)) as sheet:
+            for _, row in lxml.etree.iterparse(sheet, tag=f'{{{SHEET_NS}}}row'):
+                cells = row.findall(cell_tag)
+                if slots is None:
+                    # the header row names the columns
+                    header = {}
+                    for position, cell in enumerate(cells):
+                        letter = _column(cell.get('r')) if cell.get('r') else position
+                        header[_text(_cell_value(cell, strings))] = (letter, position)
+                    _missing(path, columns, header)
+                    slots = [header[column] for column in columns]
+                else:
+                    values = [None if cell is None else _cell_value(cell, strings) for cell in _wanted_cells(cells, slots)]
+                    if any(value is not None for value in values):
+                        rows.append([_text(value) for value in values])
+                row.clear()
+                while row.getprevious() is not None:
+                    del row.getparent()[0]
+    if slots is None:
+        raise ValueError(f'{path} has no header row')
+    return _frame(rows, columns)
+
+
+def read_xml_export(path: str, columns: List[str] = EXPORT_COLUMNS) -> pd.DataFrame:
+    wanted = set(columns)
+    rows, row, parent, found = [], {}, None, set()
+    for _, element in lxml.etree.iterparse(path, events=('end',)):
+        tag = lxml.etree.QName(element).localname
+        if tag in wanted:
+            row[tag] = _text(element.text)
+            parent = element.getparent()
+        elif element is parent:
+            rows.append([row.get(column, np.nan) for column in columns])
+            found.update(row)
+            row, parent = {}, None
+            element.clear()
+    if rows:
+        _missing(path, columns, found)
+    return _frame(rows, columns)
+
+
+def read_export(path: str, columns: List[str] = EXPORT_COLUMNS) -> pd.DataFrame:
+    """
+    Reads the wanted columns of an IMM export.
+
+    Args:
+        path (str): The export, the format is taken from its suffix.
+        columns (list): The columns to read.
+
+    Returns:
+        pandas.DataFrame: The columns in the given order, with the text of every cell
+        (NaN for empty cells).
+
+    Raises:
+        ValueError: If the format is not known or a column is not in the export.
+    """
+    suffix = os.path.splitext(path)[1].lower()
+    if suffix == '.csv':
+        return read_csv_export(path, columns)
+    if suffix == '.xml':
+        return read_xml_export(path, columns)
+    if suffix in ('.xlsx', '.xls'):
+        return read_excel_export(path, columns)
+    raise ValueError(f'Unknown export format {suffix} of {path}')
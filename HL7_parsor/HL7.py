@@ -32,19 +32,23 @@ import pandas as pd
 import re
 import numpy as np
 import logging
-import time
 
-from typing import Tuple, List
 from selenium.webdriver.remote.webdriver import WebDriver
 from selenium.webdriver.common.by import By
 from selenium.common.exceptions import StaleElementReferenceException
-from selenium.webdriver.support.wait import WebDriverWait
 from selenium.webdriver.support import expected_conditions as EC
 from DI_Incident import DI_Search
 from IMM import IMM
+from HL7_parser import HL7_Message
+from HL7_fields import HL7_Fields
+from HL7_cache import HL7_Cache
+from Case_selection import expected_visits, selection_name
+from Run_journal import Run_Journal
+from Session_pool import Session_Pool
+from WebCMR_http import WebCMR_Session
 
 
-class HL7_extraction(DI_Search, IMM):
+class HL7_extraction(DI_Search, IMM, HL7_Fields):
 
     def __init__(self, *args, **kwargs):
         """
@@ -60,7 +64,7 @@ class HL7_extraction(DI_Search, IMM):
         super().__init__(*args, **kwargs)
         return
     
-    def hl7_copy(self):
+    def hl7_copy(self, sessions=1, backend='chrome'):
         """
         Copies data from an HL7 file to a summary report.
         
@@ -73,18 +77,41 @@ class HL7_extraction(DI_Search, IMM):
         
         Parameters:
         - self: The current instance of the class.
+        - sessions: Number of browser sessions to validate cases with. With more than one, the
+          cases are shared out over a Session_Pool of logged in browsers.
+        - backend: 'chrome' drives the browser, 'http' replays the WebCMR postbacks over HTTP
+          (see WebCMR_Session) without a browser.
         
+        Every case is recorded in the lab's run journal; when the previous run of the same lab
+        and date range did not finish, it is resumed with its saved export and only the cases
+        that are not done yet are processed.
+
         Returns:
-        None
+        list: The summary DataFrame of every case, in export order (None for skipped cases).
         """
 
         logging.info('Exporting DataFrame')
-        # Going into IMM Menu and Downloading excel sheet 
-        driver = self.imm_export()
+        # An unfinished run of the same lab and date range is resumed with its saved export
+        journal = self.run_journal
+        run_id = journal.open_run(self.lab, self.fromDate, self.toDate)
+        export_path = journal.export_path(run_id)
+        login = self.http_login if backend == 'http' else self.login
+        if export_path and os.path.exists(export_path):
+            logging.info(f'Resuming run {run_id} with the export {export_path}')
+            self.export_path = export_path
+            driver = login()
+        else:
+            # Going into IMM Menu and Downloading excel sheet 
+            driver = self.http_export() if backend == 'http' else self.imm_export()
+            journal.set_export(run_id, self.export_path)
 
         logging.info("Random Sampling from Export....grabing unique test com")
         # Getting Disease Queries and Hl7 accession # from excel sheet
         df = self.export_df()
+        visits = expected_visits(df)
+        logging.info(f"{visits['cases']} cases selected ({selection_name(self.case_selection)}), expecting "
+                     f"{visits['visits']} browser visits: {visits['imm_searches']} IMM searches and "
+                     f"{visits['incident_visits']} Disease Incident visits")
         
         # Navigate to IMM menu after export
         _ = self.nav2IMM(driver) 
@@ -94,84 +121,77 @@ class HL7_extraction(DI_Search, IMM):
         di_num_list = list(df['DILR_IncidentID'])
         # Resulted test list for searches 
         test_list = list(df['DILR_ResultedTest'])
+        cases = [(str(acc_num_list[i]), str(test_list[i]), int(di_num_list[i])) for i in range(len(acc_num_list))]
+
+        # cases done before a restart are skipped, a different case list starts a new run
+        run_id = journal.add_cases(run_id, cases)
+        pending = journal.pending(run_id)
+        logging.info(f'{len(cases) - len(pending)} of {len(cases)} cases already done')
+
+        def journaled_case(driver, item):
+            i, case = item
+            report = self.process_case(driver, case)
+            journal.record(run_id, i, report)
+            return report
+
+        if sessions > 1: 
+            # the lazily created caches are shared by the pool threads, so create them here
+            # rather than in whichever thread reaches them first
+            _ = self.hl7_cache, self.incident_cache, self.locator_cache, self.wait_timer
+            # shard the cases over several logged in browsers, the export session being one of them
+            pool = Session_Pool(login, sessions, drivers=[driver])
+            pool.run(pending, journaled_case)
+        else: 
+            for i, case in pending:
+                print(f'\nITERATION #: {i}')
+                logging.info(f'\nITERATION #: {i}')
+                journaled_case(driver, (i, case))
+
+        journal.finish(run_id)
+        return journal.results(run_id)
+
+    def process_case(self, driver, case):
+        """
+        Validates one case of the export: gets its HL7 values, scrapes the Disease Incident and
+        writes the summary report. A stale element is retried once before the case is skipped,
+        and a case whose HL7 message has no OBX matching the resulted test is skipped.
+
+        Parameters:
+            driver (WebDriver): The logged in browser session to use.
+            case (tuple): (accession number, resulted test, disease incident id).
 
-        for i in range(len(acc_num_list)):
-            print(f'\nITERATION #: {i}')
-            logging.info(f'\nITERATION #: {i}')
+        Returns:
+            pandas.DataFrame: The summary of the case, or None if it was skipped.
+        """
+        acc_num, resultTest, di_num = case
+        for attempt in range(2):
             try: 
-                try: 
-                    # Searching IMM for specific accession numbers 
-                    # Going to have to put this in a for loop 
-                    acc_num = str(acc_num_list[i])
-                    resultTest = str(test_list[i])
-                    di_num = int(di_num_list[i]) 
-
-                    logging.info("Inputting ResultedTest and Accession numbers in IMM search boxes")
-
-                    acc_box, test_search = self.acc_test_search(driver, acc_num, resultTest)
-
-                    # Copy and filter hl7 results
-                    hl7_values, hl7_section_labels = self.data_wrangling(driver, resultTest, acc_num)
-                    
-                    # get webCMR values
-                    logging.info("Performing Webscraping")
-                    webCMR_values, webCMR_indicies = self.webTST_scrape(driver, di_num_list, i)
-                    '''
-                    web_values = self.webTST_scrape(driver, di_num_list, i)
-                    if web_values == 'skip':
-                        continue
-                    else: 
-                        webCMR_values, webCMR_indicies = web_values
-                    '''
-
-                    # make summary df
-                    webCMR_hl7_df = pd.DataFrame(
-                        data=np.array([webCMR_values,hl7_values, hl7_section_labels]).T, 
-                        columns=['TSTWebCMR Data', 'HL7 Data', 'HL7 Section'], 
-                        index=webCMR_indicies
-                        )
-
-                    # make summarry report 
-                    logging.info('Making summary Report folders')
-                    report = self.hl7_report(resultTest, acc_num, di_num,webCMR_hl7_df)
-                    
-                except StaleElementReferenceException as e:
-                    # Searching IMM for specific accession numbers 
-                    # Going to have to put this in a for loop 
-                    acc_num = int(acc_num_list[i])
-                    resultTest = str(test_list[i])
-                    di_num = int(di_num_list[i])
-
-                    logging.info("Inputting ResultedTest and Accession numbers in IMM search boxes")
-                    acc_box, test_search = self.acc_test_search(driver, acc_num, resultTest)
-
-                    # Copy and filter hl7 results
-                    hl7_values, hl7_section_labels = self.data_wrangling(driver, resultTest, acc_num)
-                    
-                    # get webCMR values
-                    logging.info("Performing Webscraping")
-                    webCMR_values, webCMR_indicies = self.webTST_scrape(driver, di_num_list, i)
-                    '''
-                    web_values = self.webTST_scrape(driver, di_num_list, i)
-                    if web_values == 'skip':
-                        continue
-                    else: 
-                        webCMR_values, webCMR_indicies = web_values
-                    '''
-
-                    # make summary df
-                    webCMR_hl7_df = pd.DataFrame(
-                        data=np.array([webCMR_values,hl7_values, hl7_section_labels]).T, 
-                        columns=['TSTWebCMR Data', 'HL7 Data', 'HL7 Section'], 
-                        index=webCMR_indicies
-                        )
-
-                    # make summarry report 
-                    logging.info('Making summary Report folders')
-                    report = self.hl7_report(resultTest, acc_num, di_num,webCMR_hl7_df)
+                # Copy and filter hl7 results (searches the IMM unless the message is cached)
+                hl7_values, hl7_section_labels = self.data_wrangling(driver, resultTest, acc_num)
+                
+                # get webCMR values
+                logging.info("Performing Webscraping")
+                webCMR_values, webCMR_indicies = self.webTST_scrape(driver, [di_num], 0, resultTest)
+
+                # make summary df
+                webCMR_hl7_df = pd.DataFrame(
+                    data=np.array([webCMR_values,hl7_values, hl7_section_labels]).T, 
+                    columns=['TSTWebCMR Data', 'HL7 Data', 'HL7 Section'], 
+                    index=webCMR_indicies
+                    )
+
+                # make summarry report 
+                logging.info('Making summary Report folders')
+                self.hl7_report(resultTest, acc_num, di_num,webCMR_hl7_df)
+                return webCMR_hl7_df
             except StaleElementReferenceException as e:
-                continue
-
+                logging.info(f'Stale element on accession {acc_num} (attempt {attempt + 1}): {e}')
+            except ValueError as e:
+                # no OBX of the HL7 message matches the resulted test, nothing to compare
+                logging.warning(f'Skipping accession {acc_num}: {e}')
+                print(f'Skipping accession {acc_num}: no OBX matches {resultTest}')
+                return None
+        return None
 
     def acc_test_search(self, driver, acc_num, resultTest):
         """
@@ -223,166 +243,71 @@ class HL7_extraction(DI_Search, IMM):
         Returns:
         - hl7_values: A list of specific values extracted from the HL7 message.
         - hl7_section_label: A list of section labels corresponding to the extracted values.
+
+        Raises:
+        - ValueError: If no OBX segment of the message matches the resulted test.
         """
         
-        df, obx_indx, obr_indx, spm_indx = self.hl7_redoSearch(driver, resultTest, acc_num)
-        logging.info(f'# of OBX: {len(obx_indx)} \n # of OBR segments: {len(obr_indx)} \n # of SPM segments:  {len(spm_indx)}')
-        print(f'# of OBX: {len(obx_indx)} \n # of OBR segments: {len(obr_indx)} \n # of SPM segments:  {len(spm_indx)}')
-        #print(resultTest)
-        try:
-            assert len(obr_indx) == len(obx_indx) == len(spm_indx)
-            
-            # Going to check which OBX test result matches the imported test result
-            column = 3 # OBX 3 is the column that contains resulted test 
-            key = self.match_obx(resultTest, df, obx_indx, column)  
-            
-            if key == 0: # there was an issue with a search if this value is 0
-                # going to redo search if the initial search does not provide HL7 message
-                logging.info('No OBX section found....redoing search')
-                print('No OBX section found....redoing search')
-
-                # issue is usually caused by brackets being in the resultTest name 
-                resultTest = re.sub(r'\[.*?\]', '', resultTest) # removes brackets and anything inside of them
-
-                # redoing initial hl7 search 
-                df, obx_indx, obr_indx, spm_indx = self.hl7_redoSearch(driver, resultTest, acc_num)
-                key = self.match_obx(resultTest, df, obx_indx, column)
-                
-                #print(f'Key after match_box(): {key}')
-                # finding the obr, obx, and spm sections that are corresponding to incoming message monitor 
-                # ResultedTest value
-                pos = obx_indx.index(key)
-                df_idx = [obr_indx[pos], obx_indx[pos], spm_indx[pos]]
-
-
-            # finding the obr, obx, and spm sections that are corresponding 
-            # to incoming message monitor ResultedTest value
-            pos = obx_indx.index(key)
-            df_idx = [obr_indx[pos], obx_indx[pos], spm_indx[pos]]
-
-
-        except AssertionError:
-            column = 3
-            key = self.match_obx(resultTest, df, obx_indx, column)
-            pos = obx_indx.index(key)
-            if len(spm_indx) < len(obx_indx) and len(obr_indx) < len(obx_indx): 
-                df_idx = [obr_indx[0], obx_indx[pos], spm_indx[0]]
-            elif len(spm_indx) < len(obx_indx) and len(obr_indx) == len(obx_indx): 
-                df_idx = [obr_indx[pos], obx_indx[pos], spm_indx[0]]
-            elif len(obr_indx) < len(obx_indx) and len(spm_indx)==len(obx_indx): 
-                df_idx = [obr_indx[0], obx_indx[pos], spm_indx[pos]]
-            else: pass 
-        
-        sections : list = list(df[0].values)
-        # not sure if there is going to be more than one ORC section, 
-        # Marjorie seemed hesistant around this 
-        obr_cnt = 0
-        for sect in sections: 
-            if sect == 'ORC': 
-                obr_cnt+=1
-                df_idx.append(sections.index(sect))
-                if obr_cnt > 1: 
-                    raise ValueError('Duplicate ORC Sections')
-            elif sect == 'PID': 
-                df_idx.append(sections.index(sect))
-            else: pass 
-        
-        # making pandas df with only rows related to ResultedTest of interest
-        oneResult_df = df.iloc[df_idx]
-        oneResult_df.set_index(0, inplace=True)
-        
-        # print(f'name column: {name}')
-        # going to extract values from hl7
-        name = oneResult_df.loc['PID', 5]
-        dob = oneResult_df.loc['PID', 7]
-        race = oneResult_df.loc['PID', 10]
-        ethnicity = oneResult_df.loc['PID', 22]
-        address = oneResult_df.loc['PID', 11]
-        phone_number = oneResult_df.loc['PID', 13]
-        gender = oneResult_df.loc['PID', 8]
-        accession = self.get_accession(oneResult_df.loc['SPM', 2])
-        specimen_collect = self.check_specimenCollect(oneResult_df)
-        specimen_receive = oneResult_df.loc['SPM', 18]
-        specimen_source = oneResult_df.loc['SPM', 4]
-        resulted_test = oneResult_df.loc['OBX', 3]
-        result = oneResult_df.loc['OBX', 5]
-        resulted_organism = 'If there is one it is in Result section'
-        units = oneResult_df.loc['OBX', 6]
-        ref_range = oneResult_df.loc['OBX', 7]
-        result_date = oneResult_df.loc['OBX', 19]
-        performing_facility_ID = oneResult_df.loc['OBX', 23]
-        ab_flag = oneResult_df.loc['OBX', 8]
-        ob_results = oneResult_df.loc['OBX', 11]
-        provider_name = oneResult_df.loc['ORC', 12]
-        provider_phone = oneResult_df.loc['ORC', 14]
-        provider_address = oneResult_df.loc['ORC', 24]
-        facility_name = oneResult_df.loc['ORC', 21]
-        facility_address = oneResult_df.loc['ORC', 22]
-        facility_phone = oneResult_df.loc['ORC', 23]
-
-        hl7_section_label = [
-            'PID-5',
-            'PID-7',
-            'PID-10',
-            'PID-22',
-            'PID-11',
-            'PID-13',
-            'PID-8',
-            'SPM-2',
-            'SPM-17, OBR-7, OBX-14',
-            'SPM-18',
-            'SPM-4', 
-            'OBX-3',
-            'OBX-5', 
-            'N/A',
-            'OBX-6',
-            'OBX-7',
-            'OBX-19',
-            'OBX-23',
-            'OBX-8',
-            'OBX-11',
-            'ORC-12',
-            'ORC-14',
-            'ORC-24',
-            'ORC-21',
-            'ORC-22',
-            'ORC-23'
-        ]
-        
-        hl7_values = [
-            name,
-            dob,
-            race,
-            ethnicity,
-            address,
-            phone_number,
-            gender,
-            accession,
-            specimen_collect,
-            specimen_receive,
-            specimen_source,
-            resulted_test,
-            result,
-            resulted_organism,
-            units,
-            ref_range,
-            result_date,
-            ab_flag,
-            ob_results,
-            provider_name,
-            provider_address,
-            provider_phone,
-            performing_facility_ID,
-            facility_name, 
-            facility_address,
-            facility_phone
-        ]
-        # Need to return home so that we can go to disease tab next 
-        self.go_home(driver)
+        # Fetched messages are cached by accession so repeated rows skip the IMM search
+        msg = self.hl7_cache.get(acc_num, resultTest)
+        searched = msg is None
+        if searched: 
+            msg = self.hl7_search(driver, resultTest, acc_num)
+        else: 
+            logging.info(f'Using cached HL7 message for accession {acc_num}')
+        logging.info(f'# of OBX: {len(msg.indices("OBX"))} \n # of OBR segments: {len(msg.indices("OBR"))} \n # of SPM segments:  {len(msg.indices("SPM"))} \n # of order groups: {len(msg.groups)}')
+        print(f'# of OBX: {len(msg.indices("OBX"))} \n # of OBR segments: {len(msg.indices("OBR"))} \n # of SPM segments:  {len(msg.indices("SPM"))}')
+
+        # Going to check which OBX test result matches the imported test result
+        column = 3 # OBX 3 is the column that contains resulted test 
+        key = self.match_obx(resultTest, msg, column)  
+
+        try: 
+            # extracting the values of the order group (ORC, OBR and SPM) that the matched OBX belongs to,
+            # a key of 0 (no OBX matches the resulted test) raises a ValueError
+            hl7_values, hl7_section_label = self.extract_fields(msg, key)
+        finally: 
+            # Need to return home from the IMM so that we can go to disease tab next, a cached
+            # message never left the page the browser was on
+            if searched: 
+                self.go_home(driver)
 
         return hl7_values, hl7_section_label
 
-    def hl7_redoSearch(self, driver: WebDriver, resultTest: str, acc_num: str) -> Tuple[pd.DataFrame, List[int], List[int], List[int]]:
+    def hl7_search(self, driver: WebDriver, resultTest: str, acc_num: str) -> HL7_Message:
+        """
+        Searches the IMM for a message and stores it in the HL7 message cache.
+
+        If the first search does not return an HL7 message the search is redone without the
+        bracketed part of the resulted test, which is what usually trips the IMM search.
+
+        Args:
+            driver: The WebDriver object used to control the web browser.
+            resultTest: The result test to search for.
+            acc_num: The accession number to search for.
+
+        Returns:
+            HL7_Message: The parsed HL7 message.
+        """
+        msg = self.hl7_redoSearch(driver, resultTest, acc_num)
+
+        # match_obx already handles brackets in the resultTest name, so the IMM only has to be 
+        # searched again when the initial search did not provide an HL7 message at all
+        if not msg.indices('OBX'): 
+            logging.info('No OBX section found....redoing search')
+            print('No OBX section found....redoing search')
+
+            # issue is usually caused by brackets being in the resultTest name 
+            strippedTest = re.sub(r'\[.*?\]', '', resultTest) # removes brackets and anything inside of them
+
+            # redoing initial hl7 search 
+            msg = self.hl7_redoSearch(driver, strippedTest, acc_num)
+
+        if msg.indices('OBX'): 
+            self.hl7_cache.put(acc_num, resultTest, msg.text)
+        return msg
+
+    def hl7_redoSearch(self, driver: WebDriver, resultTest: str, acc_num: str) -> HL7_Message:
         """
         Perform a redo search in the HL7 module.
         
@@ -392,55 +317,35 @@ class HL7_extraction(DI_Search, IMM):
             acc_num: The accession number to search for.
         
         Returns:
-            A tuple containing the following:
-                - DataFrame: A DataFrame object containing the HL7 sections.
-                - list: A list of indices for the OBX sections.
-                - list: A list of indices for the OBR sections.
-                - list: A list of indices for the SPM sections.
+            HL7_Message: The parsed HL7 message, with its segments grouped by order.
         """
+        if isinstance(driver, WebCMR_Session):
+            return HL7_Message(driver.hl7_text(acc_num, resultTest))
         self.nav2IMM(driver=driver)
-        time.sleep(1)
+        # the IMM page is ready once its search box is there
+        self.wait_timer.until(driver, 'page:imm', EC.presence_of_element_located((By.ID, 'txtAccession')),
+                              default=8)
         self.acc_test_search(resultTest=resultTest,
                                 acc_num=acc_num,
                                 driver=driver)
         # Get HL7 from contents area after IMM search 
-        table = driver.find_element(By.ID, "divContentsArea").text
-        hl7_sections = table.split('\n')
-        components = [section.split("|") for section in hl7_sections]
-        df = pd.DataFrame(components)
-        obx_indx, obr_indx, spm_indx = [], [], []
-        for index, section in enumerate(list(df[0].values)):
-            if section.upper() == 'OBR':
-                obr_indx.append(index)
-            elif section.upper() == 'OBX': 
-                obx_indx.append(index)
-            elif section.upper() == 'SPM': 
-                spm_indx.append(index)
-            else: continue 
-        return df, obx_indx, obr_indx, spm_indx
-    
-    def get_accession(self, string ):
-        'Return first part of SPM 2 that is seen before accession #'
-        return string.split('&', 1)[0]
-
-    def check_specimenCollect(self, df):
-        spm, obx, obr = df.loc['SPM', 17], df.loc['OBX', 14], df.loc['OBR', 7]
-        if spm == obx == obr:
-            sp_collect = spm
-        elif spm == obx:
-            sp_collect = f'SPM-17 & OBX-14 is {obx}, while OBR-7 is {obr}'
-        elif spm == obr:
-            sp_collect = f'SPM-17 & OBR-7 is {spm}, while OBX-14 is {obx}'
-        elif obx == obr:
-            sp_collect = f'OBX-14 & OBR-7 is {obr}, while SPM-17 is {spm}'
-        else:
-            sp_collect=f"""
-            All variables are different.
-            SPM-17: {spm}
-            OBX-14: {obx}
-            OBR-7: {obr}
-            """
-        return sp_collect
+        table = self.wait_timer.until(driver, 'page:imm_message', EC.presence_of_element_located((By.ID, "divContentsArea")),
+                                      default=10).text
+        return HL7_Message(table)
+
+    @property
+    def hl7_cache(self):
+        'The HL7 message cache of the lab, stored in the lab output folder'
+        if getattr(self, '_hl7_cache', None) is None:
+            self._hl7_cache = HL7_Cache(os.path.join(self.lab_dir(), 'hl7_cache.sqlite'))
+        return self._hl7_cache
+
+    @property
+    def run_journal(self):
+        'The run journal of the lab, stored in the lab output folder'
+        if getattr(self, '_run_journal', None) is None:
+            self._run_journal = Run_Journal(os.path.join(self.lab_dir(), 'run_journal.sqlite'))
+        return self._run_journal
 
     def hl7_report(self, resultTest, acc_num, di_num,df):
         """
@@ -455,37 +360,7 @@ class HL7_extraction(DI_Search, IMM):
         Returns:
             None
         """
-        home_directory = os.path.expanduser( '~' )
-        lab_name = re.sub(r'[^\w\s]+', '_',self.lab)
-        new_dir = f'./{lab_name}/'
-        try:
-            mkdir = os.mkdir(new_dir)
-        except FileExistsError:
-            pass 
+        new_dir = self.lab_dir()
         file_name = re.sub(r'[^\w\s]+', '_', resultTest)
         file_dir = f'{new_dir}/{file_name}'
         df.to_excel(f'{file_dir}_ACCnum_{acc_num}_DInum_{int(di_num)}.xlsx')
-
-    def match_obx(self, resultTest : str, df : pd.DataFrame, obx_indx : int, column : int):
-        """
-        Finds the index of the first row in the given DataFrame that contains a specified string in the specified column.
-        
-        Parameters:
-            resultTest (str): The string to search for.
-            df (pd.DataFrame): The DataFrame to search in.
-            obx_indx (int): The index of the column to search in.
-            column (int): The index of the column to search in.
-        
-        Returns:
-            int: The index of the first row that matches the search string, or 0 if no match is found.
-        """
-        key = 0
-        for row_index in obx_indx: 
-            obx_result : str = str(df.iloc[row_index, column])
-            if resultTest in obx_result:
-                #print(f'\nFound the Index: {row_index}\n') 
-                key = int(row_index)
-                #print(f'Return Key in if-else: {key}')
-                break
-        #print(f'Return value: {key}')
-        return key
\ No newline at end of file
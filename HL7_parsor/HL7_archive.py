@@ -0,0 +1,155 @@
+"""
+    Purpose:
+    The `HL7_Archive` class gives random access into very large HL7 archives (a month of ELR
+    for a big lab can be several GB) without reading them into Python strings. The file is
+    memory-mapped, a compact array of MSH start offsets is built once, and only the message
+    whose accession (SPM-2) or resulted test (OBX-3) is requested gets decoded and parsed.
+
+    Algorithm:
+    1. Memory-map the archive read-only.
+    2. Scan the mapping once for segment starts of MSH and store their byte offsets.
+    3. On the first lookup, scan the mapping for SPM-2 (or OBX-3) values and map each value
+       to the numbers of the messages it appears in.
+    4. Decode only the bytes between two MSH offsets and parse them with `HL7_Message`.
+"""
+
+import io
+import mmap
+import re
+
+from array import array
+from bisect import bisect_right
+from typing import Dict, List, Optional
+from HL7_parser import HL7_Message, iter_hl7_messages, normalize_test
+
+
+# Byte patterns run directly against the memory map. The lookups assume the usual '|'
+# field, '^' component and '&' sub-component separators.
+MSH_START = re.compile(rb'(?:^|[\r\n])[\x0b \t]*(MSH)')
+SPM_ACCESSION = re.compile(rb'[\r\n][\x0b \t]*SPM\|[^|\r\n]*\|([^|\r\n]*)')
+OBX_TEST = re.compile(rb'[\r\n][\x0b \t]*OBX\|[^|\r\n]*\|[^|\r\n]*\|([^|\r\n]*)')
+
+
+class HL7_Archive:
+
+    def __init__(self, path: str, encoding: str = 'utf-8'):
+        """
+        Opens and indexes an HL7 archive.
+
+        Parameters:
+            path (str): Path to the archive (an HL7 batch file, FHS/BHS wrapped or not).
+            encoding (str): Text encoding used to decode a message once it is requested.
+
+        Returns:
+            None
+        """
+        self.path = path
+        self.encoding = encoding
+        self.offsets = array('Q')
+        self._accessions: Optional[Dict[str, List[int]]] = None
+        self._tests: Optional[Dict[str, List[int]]] = None
+        self._file = open(path, 'rb')
+        try:
+            self._map = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+        except ValueError:
+            # empty archives cannot be mapped
+            self._map = b''
+        for match in MSH_START.finditer(self._map):
+            self.offsets.append(match.start(1))
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def close(self):
+        'Release the memory map and the file handle'
+        if isinstance(self._map, mmap.mmap):
+            self._map.close()
+        self._file.close()
+
+    def __len__(self):
+        return len(self.offsets)
+
+    def __getitem__(self, number: int) -> HL7_Message:
+        """
+        Decodes and parses one message of the archive.
+
+        Parameters:
+            number (int): The number of the message, in archive order.
+
+        Returns:
+            HL7_Message: The parsed message.
+        """
+        return HL7_Message(self.message_text(number))
+
+    def message_text(self, number: int) -> str:
+        """
+        Returns the text of one message without any batch envelope segments that follow it.
+        """
+        start = self.offsets[number]
+        end = self.offsets[number + 1] if number + 1 < len(self.offsets) else len(self._map)
+        text = self._map[start:end].decode(self.encoding, errors='replace')
+        return next(iter_hl7_messages(io.StringIO(text, newline=None)), '')
+
+    def message_number(self, offset: int) -> int:
+        'Return the number of the message that contains a byte offset'
+        return bisect_right(self.offsets, offset) - 1
+
+    def find_accession(self, acc_num: str) -> List[HL7_Message]:
+        """
+        Returns every message whose SPM-2 carries an accession number.
+
+        Parameters:
+            acc_num (str): The accession number, as returned by `get_accession`.
+
+        Returns:
+            list: The parsed messages, in archive order.
+        """
+        if self._accessions is None:
+            self._accessions = self._build_index(SPM_ACCESSION, self._accession_keys)
+        return [self[number] for number in self._accessions.get(str(acc_num).strip(), [])]
+
+    def find_test(self, resultTest: str) -> List[HL7_Message]:
+        """
+        Returns every message with an OBX-3 whose identifier, text or alternate text
+        equals the resulted test, compared with `normalize_test`.
+
+        Parameters:
+            resultTest (str): The resulted test to look up.
+
+        Returns:
+            list: The parsed messages, in archive order.
+        """
+        if self._tests is None:
+            self._tests = self._build_index(OBX_TEST, self._test_keys)
+        return [self[number] for number in self._tests.get(normalize_test(resultTest), [])]
+
+    def _build_index(self, pattern, keys) -> Dict[str, List[int]]:
+        """
+        Scans the memory map once with a segment pattern and maps every key of the captured
+        field to the numbers of the messages it appears in.
+        """
+        index: Dict[str, List[int]] = {}
+        for match in pattern.finditer(self._map):
+            number = self.message_number(match.start())
+            if number < 0:
+                continue
+            for key in keys(match.group(1).decode(self.encoding, errors='replace')):
+                numbers = index.setdefault(key, [])
+                if not numbers or numbers[-1] != number:
+                    numbers.append(number)
+        return index
+
+    @staticmethod
+    def _accession_keys(value: str) -> List[str]:
+        'SPM-2 keys: the accession number before the first sub-component separator'
+        return [value.split('&', 1)[0].strip()]
+
+    @staticmethod
+    def _test_keys(value: str) -> List[str]:
+        'OBX-3 keys: identifier, text and alternate text components'
+        components = value.split('^')
+        keys = [normalize_test(components[i]) for i in (0, 1, 4) if i < len(components)]
+        return [key for key in dict.fromkeys(keys) if key]
@@ -0,0 +1,105 @@
+"""
+    Purpose:
+    The `HL7_Cache` class keeps the HL7 messages fetched from the Incoming Message Monitor in
+    a SQLite file, keyed by accession number and normalized resulted test, so re-runs and
+    overlapping date ranges do not repeat the browser search. Rows of an export that share an
+    accession number are served from one fetched message, since it carries every OBX.
+
+    Algorithm:
+    1. Look up (accession, normalized test); if missing, look at the other messages cached for
+       the accession and use one whose OBX-3 index has the resulted test.
+    2. Entries older than the TTL are not returned; they are deleted when the cache is opened
+       and on every store.
+    3. Every hit refreshes the entry's last access time.
+    4. After a store, the least recently used entries beyond `max_entries` are evicted.
+"""
+
+from typing import Optional
+from HL7_parser import HL7_Message, normalize_test
+from SQLite_cache import SQLite_TTL_Cache
+
+
+class HL7_Cache(SQLite_TTL_Cache):
+
+    schema = (
+        '''CREATE TABLE IF NOT EXISTS messages (
+            accession TEXT NOT NULL,
+            test TEXT NOT NULL,
+            message TEXT NOT NULL,
+            stored REAL NOT NULL,
+            accessed REAL NOT NULL,
+            PRIMARY KEY (accession, test)
+        )''',
+        'CREATE INDEX IF NOT EXISTS messages_accessed ON messages (accessed)',
+    )
+    expiring = 'messages'
+
+    def __init__(self, path: str, ttl: float = 7 * 24 * 3600, max_entries: int = 20000):
+        """
+        Opens a message cache, usually inside the lab output directory.
+
+        Parameters:
+            path (str): The SQLite file.
+            ttl (float): Seconds an entry stays valid.
+            max_entries (int): Number of messages kept before least recently used ones are evicted.
+
+        Returns:
+            None
+        """
+        self.max_entries = max_entries
+        super().__init__(path, ttl)
+
+    def get(self, acc_num: str, resultTest: str) -> Optional[HL7_Message]:
+        """
+        Returns the cached message of an accession number and resulted test.
+
+        Parameters:
+            acc_num (str): The accession number searched in the IMM.
+            resultTest (str): The resulted test searched in the IMM.
+
+        Returns:
+            HL7_Message: The parsed message, or None when nothing valid is cached.
+        """
+        acc_num, test = str(acc_num).strip(), normalize_test(str(resultTest))
+        now = self.clock()
+        with self._lock:
+            rows = self._conn.execute(
+                'SELECT test, message FROM messages WHERE accession = ? AND stored >= ? ORDER BY test = ? DESC, accessed DESC',
+                (acc_num, self.cutoff(), test)
+            ).fetchall()
+            for cached_test, text in rows:
+                msg = HL7_Message(text)
+                # the message of another test of the same accession is fine if it carries this one
+                if cached_test == test or msg.find_obx(resultTest):
+                    self._conn.execute(
+                        'UPDATE messages SET accessed = ? WHERE accession = ? AND test = ?',
+                        (now, acc_num, cached_test)
+                    )
+                    self._conn.commit()
+                    return msg
+        return None
+
+    def put(self, acc_num: str, resultTest: str, text: str):
+        """
+        Stores a fetched message, deletes expired entries and evicts the least recently used
+        entries over the limit.
+
+        Parameters:
+            acc_num (str): The accession number searched in the IMM.
+            resultTest (str): The resulted test searched in the IMM.
+            text (str): The HL7 message text.
+        """
+        now = self.clock()
+        with self._lock:
+            self._purge()
+            self._conn.execute(
+                'INSERT OR REPLACE INTO messages VALUES (?, ?, ?, ?, ?)',
+                (str(acc_num).strip(), normalize_test(str(resultTest)), text, now, now)
+            )
+            self._conn.execute(
+                '''DELETE FROM messages WHERE rowid IN (
+                    SELECT rowid FROM messages ORDER BY accessed DESC LIMIT -1 OFFSET ?
+                )''',
+                (self.max_entries,)
+            )
+            self._conn.commit()
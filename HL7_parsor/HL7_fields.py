@@ -0,0 +1,499 @@
+"""
+    Purpose:
+    The `HL7_Fields` class holds the part of the validation that only needs a parsed HL7
+    message: matching the resulted test to an OBX segment, picking the segments of its order
+    group and extracting the fields that are compared against TST WebCMR. It has no browser
+    dependency, so the same extraction serves the IMM screen-scrape in `HL7_extraction` and
+    the offline ingestion of HL7 batch files from disk. `extract_columns` does the same
+    extraction for many messages at once, column by column with pandas string operations.
+    Large batches can be fanned out to a process pool in chunks, with results coming back in
+    message order.
+
+    Algorithm:
+    1. Read HL7 batch files (FHS/BHS wrapped or plain MSH messages) one message at a time.
+    2. Parse each message with `HL7_Message`.
+    3. For every OBX (resulted test) pick the OBR, SPM, ORC and PID segments it belongs to.
+    4. Extract the validation fields into `hl7_values` / `hl7_section_label` records, following
+       the field map in config.yml compiled into a `Field_Plan`.
+"""
+
+import os
+import yaml
+import pickle
+import logging
+import numpy as np
+import pandas as pd
+
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from functools import lru_cache
+from itertools import islice
+from typing import Dict, Iterable, Iterator, List, Optional, Sequence, Tuple, Union
+from HL7_parser import HL7_Message, iter_hl7_messages, normalize_test
+
+
+# Field map the extraction plan is compiled from
+CONFIG_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'config.yml')
+
+
+class Field_Plan:
+
+    def __init__(self, entries: List[dict]):
+        """
+        Compiles the `hl7_fields` entries of the field map into an extraction plan.
+
+        Every path is parsed here, once, into integer (segment, field, component,
+        sub-component) offsets, so extracting a message does no path parsing.
+
+        Parameters:
+            entries (list): Dicts with a 'label' and one of 'path', 'reconcile' or 'value'.
+
+        Raises:
+            ValueError: If an entry has none of 'path', 'reconcile' or 'value'.
+            KeyError: If a path is not a valid HL7 path.
+        """
+        self.labels: List[str] = []
+        self.steps: List[tuple] = []
+        self.segments: List[str] = []
+        for entry in entries:
+            label = str(entry['label'])
+            if 'path' in entry:
+                step = ('path', HL7_Message.parse_path(entry['path']))
+            elif 'reconcile' in entry:
+                paths = [str(path).strip().upper() for path in entry['reconcile']]
+                step = ('reconcile', paths, [HL7_Message.parse_path(path) for path in paths])
+            elif 'value' in entry:
+                step = ('value', str(entry['value']))
+            else:
+                raise ValueError(f'Field map entry {label} needs a path, reconcile or value')
+            for offsets in ([step[1]] if step[0] == 'path' else step[2] if step[0] == 'reconcile' else []):
+                if offsets[0] not in self.segments:
+                    self.segments.append(offsets[0])
+            self.labels.append(label)
+            self.steps.append(step)
+
+    @classmethod
+    def from_config(cls, path: str = CONFIG_PATH) -> 'Field_Plan':
+        'Load and compile the field map of a YAML config file'
+        with open(path, 'r', encoding='utf-8') as config:
+            return cls(yaml.safe_load(config)['hl7_fields'])
+
+    def extract(self, msg: HL7_Message, chosen: Dict[str, int]) -> list:
+        """
+        Runs the plan against one message.
+
+        Parameters:
+            msg (HL7_Message): The parsed message.
+            chosen (dict): The position of the segment to read for each segment name.
+
+        Returns:
+            list: One value per label.
+        """
+        def read(offsets):
+            position = chosen.get(offsets[0])
+            if position is None:
+                return ''
+            return msg.value(position, *offsets[1:])
+
+        values = []
+        for step in self.steps:
+            if step[0] == 'path':
+                values.append(read(step[1]))
+            elif step[0] == 'reconcile':
+                values.append(self.reconcile(step[1], [read(offsets) for offsets in step[2]]))
+            else:
+                values.append(step[1])
+        return values
+
+    def extract_columns(self, messages: List[HL7_Message], chosen: List[Optional[Dict[str, int]]]) -> pd.DataFrame:
+        """
+        Runs the plan against many messages at once, one column at a time.
+
+        The fields of the chosen segments (already split by each message's MSH-1) are put in
+        one frame per segment name, and components and sub-components are split with pandas
+        string operations, grouped by the separators each message declares in MSH-2.
+
+        Parameters:
+            messages (list): The parsed messages.
+            chosen (list): The `chosen` segment positions of every message, None for a message
+                without a resulted test to extract (its row is left empty).
+
+        Returns:
+            pandas.DataFrame: One row per message and one column per label.
+        """
+        index = pd.RangeIndex(len(messages))
+        fields = {
+            name: pd.DataFrame(
+                [msg.segments[c[name]] if c is not None and c.get(name) is not None else []
+                 for msg, c in zip(messages, chosen)],
+                index=index, dtype=object)
+            for name in self.segments
+        }
+        component_seps = pd.Series([msg.component_sep for msg in messages], index=index, dtype=object)
+        subcomponent_seps = pd.Series([msg.subcomponent_sep for msg in messages], index=index, dtype=object)
+
+        def part(values, seps, number):
+            result = pd.Series('', index=index, dtype=object)
+            for sep, rows in seps.groupby(seps).groups.items():
+                result[rows] = values[rows].str.split(sep, regex=False).str[number - 1].fillna('')
+            return result
+
+        def read(offsets):
+            name, field, component, subcomponent = offsets
+            frame = fields[name]
+            if field not in frame.columns:
+                return pd.Series('', index=index, dtype=object)
+            values = frame[field].fillna('')
+            if component:
+                values = part(values, component_seps, component)
+                if subcomponent:
+                    values = part(values, subcomponent_seps, subcomponent)
+            return values
+
+        columns = []
+        for step in self.steps:
+            if step[0] == 'path':
+                columns.append(read(step[1]))
+            elif step[0] == 'reconcile':
+                columns.append(self.reconcile_columns(step[1], [read(offsets) for offsets in step[2]]))
+            else:
+                columns.append(pd.Series(step[1], index=index, dtype=object))
+        table = pd.concat(columns, axis=1, ignore_index=True) if columns else pd.DataFrame(index=index)
+        table.columns = self.labels
+        table.loc[[c is None for c in chosen]] = None
+        return table
+
+    @staticmethod
+    def reconcile_columns(names: List[str], values: List[pd.Series]) -> pd.Series:
+        'Column-wise `reconcile`: describes, row by row, which of three columns differ'
+        (a, b, c), (x, y, z) = names, values
+        xy, xz, yz = x == y, x == z, y == z
+        choices = [
+            x,
+            f'{a} & {b} is ' + y + f', while {c} is ' + z,
+            f'{a} & {c} is ' + x + f', while {b} is ' + y,
+            f'{b} & {c} is ' + z + f', while {a} is ' + x,
+        ]
+        differ = (f'\n            All variables are different.\n            {a}: ' + x
+                  + f'\n            {b}: ' + y + f'\n            {c}: ' + z + '\n            ')
+        return pd.Series(np.select([xy & yz, xy, xz, yz], choices, differ), index=x.index, dtype=object)
+
+    @staticmethod
+    def reconcile(names: List[str], values: List[str]) -> str:
+        """
+        Compares three values that should agree (e.g. the specimen collection date in
+        SPM-17, OBX-14 and OBR-7) and describes which of them differ.
+        """
+        (a, b, c), (x, y, z) = names, values
+        if x == y == z:
+            return x
+        elif x == y:
+            return f'{a} & {b} is {y}, while {c} is {z}'
+        elif x == z:
+            return f'{a} & {c} is {x}, while {b} is {y}'
+        elif y == z:
+            return f'{b} & {c} is {z}, while {a} is {x}'
+        return f"""
+            All variables are different.
+            {a}: {x}
+            {b}: {y}
+            {c}: {z}
+            """
+
+
+@lru_cache(maxsize=None)
+def load_field_plan(path: str = CONFIG_PATH) -> Field_Plan:
+    'Compile the field map once per config file'
+    return Field_Plan.from_config(path)
+
+
+# Section labels of the values returned by `extract_fields`
+HL7_SECTION_LABELS = load_field_plan().labels
+
+
+def extract_messages(
+    texts: List[str],
+    resultTest: Optional[str] = None,
+    field_map: str = CONFIG_PATH
+    ) -> List[Tuple[str, str, list, List[str]]]:
+    """
+    Parses a chunk of HL7 messages and extracts one record per OBX. Module level so it
+    can be sent to process pool workers.
+
+    Parameters:
+        texts (list): The raw HL7 messages.
+        resultTest (str, optional): Only extract OBX segments whose OBX-3 contains this,
+            compared after `normalize_test` as in `match_obx`.
+        field_map (str): The field map config to extract with.
+
+    Returns:
+        list: (accession number, OBX-3 resulted test, hl7_values, hl7_section_label) records.
+    """
+    fields = HL7_Fields()
+    fields.field_map = field_map
+    normalized = normalize_test(resultTest) if resultTest else ''
+    records = []
+    for text in texts:
+        msg = HL7_Message(text)
+        for key in msg.indices('OBX'):
+            if normalized and normalized not in normalize_test(msg.field(key, 3)):
+                continue
+            hl7_values, hl7_section_label = fields.extract_fields(msg, key)
+            accession = hl7_values[hl7_section_label.index('SPM-2')]
+            records.append((accession, msg.field(key, 3), hl7_values, hl7_section_label))
+    return records
+
+
+class HL7_Fields:
+
+    # Field map used by `field_plan`, override to validate a different set of fields
+    field_map = CONFIG_PATH
+
+    @property
+    def field_plan(self) -> Field_Plan:
+        'The compiled extraction plan of `field_map`'
+        return load_field_plan(self.field_map)
+
+    def extract_fields(self, msg: HL7_Message, key: int) -> Tuple[list, List[str]]:
+        """
+        Extracts the validation fields of one resulted test from a parsed HL7 message.
+
+        Parameters:
+            msg (HL7_Message): The parsed HL7 message.
+            key (int): The position of the OBX segment of the resulted test.
+
+        Returns:
+            tuple: containing the following
+                - hl7_values: A list of specific values extracted from the HL7 message.
+                - hl7_section_label: A list of section labels corresponding to the extracted values.
+
+        Raises:
+            ValueError: If key is not the position of an OBX segment (0 when match_obx found no match).
+        """
+        # finding the order group (ORC, OBR and SPM) that the matched OBX belongs to
+        df_idx = self.result_segments(msg, key)
+
+        # view over only the segments related to ResultedTest of interest
+        oneResult = msg.select(df_idx)
+
+        # going to extract values from hl7 with the compiled field map
+        plan = self.field_plan
+        hl7_values = plan.extract(msg, oneResult.chosen)
+        hl7_section_label = list(plan.labels)
+
+        return hl7_values, hl7_section_label
+
+    def result_segments(self, msg: HL7_Message, key: int) -> List[int]:
+        """
+        Returns the positions of the segments describing one resulted test.
+
+        Parameters:
+            msg (HL7_Message): The parsed HL7 message.
+            key (int): The position of the OBX segment of the resulted test.
+
+        Returns:
+            list: Positions of the OBR, OBX, SPM, ORC and PID segments. The OBR, SPM and ORC
+            come from the order group of the OBX; when the group has no SPM or ORC the first
+            one in the message is used instead.
+
+        Raises:
+            ValueError: If key is not the position of an OBX segment (0 when match_obx found no match).
+        """
+        if key not in msg.indices('OBX'):
+            raise ValueError(f'No OBX segment at position {key} of message {msg["MSH-10"]}')
+        group = msg.group_of.get(key)
+        obr = group.obr if group else None
+        spm = group.specimen if group else None
+        orc = group.orc if group else None
+        if obr is None: 
+            obr = next(iter(msg.indices('OBR')), None)
+        if spm is None: 
+            spm = next(iter(msg.indices('SPM')), None)
+        if orc is None: 
+            orc = next(iter(msg.indices('ORC')), None)
+        pid = next(iter(msg.indices('PID')), None)
+        return [pos for pos in (obr, key, spm, orc, pid) if pos is not None]
+    
+    def get_accession(self, string ):
+        'Return first part of SPM 2 that is seen before accession #'
+        return string.split('&', 1)[0]
+
+    def check_specimenCollect(self, msg):
+        'Reconcile the specimen collection date across SPM-17, OBX-14 and OBR-7'
+        names = ['SPM-17', 'OBX-14', 'OBR-7']
+        return Field_Plan.reconcile(names, [msg[name] for name in names])
+
+    def match_obx(self, resultTest : str, msg : HL7_Message, column : int):
+        """
+        Finds the position of the first OBX segment in the given message that contains a specified string in the specified field.
+
+        For OBX-3 the normalized resulted test index of the message is tried first, which also
+        covers resulted tests whose brackets differ from the HL7. Otherwise the field is scanned
+        for the string, as is and then normalized.
+        
+        Parameters:
+            resultTest (str): The string to search for.
+            msg (HL7_Message): The parsed HL7 message to search in.
+            column (int): The OBX field to search in.
+        
+        Returns:
+            int: The position of the first OBX segment that matches the search string, or 0 if no match is found.
+        """
+        if column == 3: 
+            key = msg.find_obx(resultTest)
+            if key: 
+                return key
+        key = 0
+        for row_index in msg.indices('OBX'): 
+            obx_result : str = msg.field(row_index, column)
+            if resultTest in obx_result:
+                #print(f'\nFound the Index: {row_index}\n') 
+                key = int(row_index)
+                #print(f'Return Key in if-else: {key}')
+                break
+        if key == 0: 
+            # brackets (and case / spacing) differing between the export and the HL7
+            normalized = normalize_test(resultTest)
+            for row_index in msg.indices('OBX'): 
+                if normalized and normalized in normalize_test(msg.field(row_index, column)):
+                    key = int(row_index)
+                    break
+        #print(f'Return value: {key}')
+        return key
+
+    def extract_columns(
+        self,
+        messages: Sequence[Union[HL7_Message, str]],
+        resultTests: Optional[Sequence[str]] = None
+        ) -> pd.DataFrame:
+        """
+        Extracts the validation fields of many HL7 messages into one columnar table.
+
+        The resulted test of every message is matched to its OBX as in `extract_fields`, then
+        `Field_Plan.extract_columns` reads each label for all messages at once, honouring the
+        MSH-1/MSH-2 separators of every message.
+
+        Parameters:
+            messages (list): Parsed messages (or raw HL7 text).
+            resultTests (list, optional): The resulted test of each message. When left out
+                the first OBX of every message is used.
+
+        Returns:
+            pandas.DataFrame: One row per message and one column per label of the field map.
+            The row of a message without a matching OBX is left empty (None).
+        """
+        parsed, chosen = [], []
+        for i, msg in enumerate(messages):
+            if not isinstance(msg, HL7_Message):
+                msg = HL7_Message(msg)
+            if resultTests is not None:
+                key = self.match_obx(str(resultTests[i]), msg, 3)
+            else:
+                key = next(iter(msg.indices('OBX')), 0)
+            parsed.append(msg)
+            if key == 0:
+                logging.info(f'No OBX of message {msg["MSH-10"]} matches its resulted test')
+                chosen.append(None)
+            else:
+                chosen.append(msg.select(self.result_segments(msg, key)).chosen)
+        return self.field_plan.extract_columns(parsed, chosen)
+
+    def hl7_ingest(
+        self,
+        paths: Union[str, Iterable[str]],
+        resultTest: Optional[str] = None,
+        workers: int = 1,
+        chunksize: int = 500
+        ) -> Iterator[Tuple[str, str, list, List[str]]]:
+        """
+        Streams HL7 batch files from disk through the parser without a browser session.
+
+        Every OBX segment of every message produces one record, the same values and
+        labels that `data_wrangling` produces for an IMM search.
+
+        Parameters:
+            paths (str or list): One or more HL7 batch files (FHS/BHS wrapped or newline
+                separated MSH messages).
+            resultTest (str, optional): Only yield records for OBX segments whose OBX-3
+                contains this resulted test.
+            workers (int): Number of worker processes for parsing and extraction, 1 to
+                stay in-process (see `extract_parallel`).
+            chunksize (int): Number of messages sent to a worker at a time.
+
+        Yields:
+            tuple: (accession number, OBX-3 resulted test, hl7_values, hl7_section_label)
+        """
+        if isinstance(paths, str):
+            paths = [paths]
+
+        def texts():
+            for path in paths:
+                logging.info(f'Ingesting HL7 batch file: {path}')
+                yield from iter_hl7_messages(path)
+
+        yield from self.extract_parallel(texts(), resultTest, workers, chunksize)
+
+    def extract_parallel(
+        self,
+        texts: Iterable[str],
+        resultTest: Optional[str] = None,
+        workers: int = 1,
+        chunksize: int = 500
+        ) -> Iterator[Tuple[str, str, list, List[str]]]:
+        """
+        Parses and extracts a stream of HL7 messages, fanned out over a process pool.
+
+        Messages are submitted in chunks, with at most two chunks per worker in flight so
+        memory stays flat on large archives, and records are yielded in message order.
+        With one worker (or when a process pool cannot be started) everything runs in
+        this process, as do the unfinished chunks when the pool breaks (a worker killed,
+        or a chunk that cannot be pickled). Workers are capped at the number of CPUs and
+        at 61, the most Windows allows.
+
+        Parameters:
+            texts (iterable): The raw HL7 messages.
+            resultTest (str, optional): Only extract OBX segments whose OBX-3 contains this.
+            workers (int): Number of worker processes, 1 to stay in-process.
+            chunksize (int): Number of messages sent to a worker at a time.
+
+        Yields:
+            tuple: (accession number, OBX-3 resulted test, hl7_values, hl7_section_label)
+        """
+        texts = iter(texts)
+        chunks = iter(lambda: list(islice(texts, chunksize)), [])
+        workers = min(workers, os.cpu_count() or 1, 61)
+        executor = None
+        if workers > 1:
+            try:
+                executor = ProcessPoolExecutor(max_workers=workers)
+            except (OSError, NotImplementedError) as e:
+                logging.info(f'Process pool unavailable, extracting in-process: {e}')
+        if executor is None:
+            for chunk in chunks:
+                yield from extract_messages(chunk, resultTest, self.field_map)
+            return
+
+        pending = deque()
+        submitting = None
+        try:
+            for submitting in chunks:
+                pending.append((submitting, executor.submit(extract_messages, submitting, resultTest, self.field_map)))
+                submitting = None
+                if len(pending) >= workers * 2:
+                    yield from pending[0][1].result()
+                    pending.popleft()
+            while pending:
+                yield from pending[0][1].result()
+                pending.popleft()
+        except (BrokenProcessPool, pickle.PicklingError) as e:
+            # a worker died or a chunk could not be sent, finish what is left in this process
+            logging.warning(f'Process pool failed, extracting the remaining messages in-process: {e!r}')
+            executor.shutdown(wait=False, cancel_futures=True)
+            unfinished = [chunk for chunk, _ in pending] + ([submitting] if submitting else [])
+            for chunk in unfinished:
+                yield from extract_messages(chunk, resultTest, self.field_map)
+            for chunk in chunks:
+                yield from extract_messages(chunk, resultTest, self.field_map)
+        finally:
+            executor.shutdown(cancel_futures=True)
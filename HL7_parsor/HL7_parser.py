@@ -0,0 +1,362 @@
+"""
+    Purpose:
+    The `HL7_Message` class is a single-pass parser for HL7 v2 messages. It replaces the
+    pipe-split pandas DataFrame that used to be built for every IMM search. The message is
+    parsed once: encoding characters are read from MSH-1/MSH-2, every segment is split into
+    its fields and the character offset of each segment is kept, so any field can be read
+    with a path such as `msg['PID-5']` without re-scanning the message. In the same pass the
+    ORDER_OBSERVATION groups of the message are built (ORC, OBR, its OBX and SPM segments),
+    so every OBX knows its parent OBR and sibling SPM. OBX-3 identifiers and texts are indexed
+    under a normalized key, so a resulted test from the IMM export is found with a hash lookup.
+
+    Algorithm:
+    1. Read the field separator (MSH-1) and encoding characters (MSH-2) from the MSH segment.
+    2. Walk the text once, splitting it into segments on carriage returns and/or newlines.
+    3. Split each segment into fields and record its offset and position by segment name.
+    4. Open a new order group on every ORC/OBR and attach the following OBX and SPM segments to it.
+    5. Resolve paths like 'OBX-3' into (segment, field) lookups against that position index.
+    6. On the first resulted test lookup, index OBX-3 components by their normalized text.
+"""
+
+import re
+
+from typing import Dict, IO, Iterator, List, Optional, Tuple, Union
+
+
+# Default HL7 v2 delimiters, used when a message has no (or a malformed) MSH segment
+FIELD_SEPARATOR = '|'
+ENCODING_CHARACTERS = '^~\\&'
+
+# A segment is any run of text between carriage returns / newlines
+SEGMENT_PATTERN = re.compile(r'[^\r\n]+')
+BRACKET_PATTERN = re.compile(r'\[.*?\]')
+WHITESPACE_PATTERN = re.compile(r'\s+')
+MSH_PATTERN = re.compile(r'(?:^|[\r\n])[ \t]*(MSH)')
+PATH_PATTERN = re.compile(r'^([A-Z0-9]{3})-(\d+)(?:\.(\d+))?(?:\.(\d+))?$')
+
+# Segments that make up an ORDER_OBSERVATION group
+GROUP_SEGMENTS = frozenset(('ORC', 'OBR', 'OBX', 'SPM'))
+# Batch envelope segments (file/batch header and trailer) that wrap messages in a batch file
+ENVELOPE_SEGMENTS = ('FHS', 'BHS', 'BTS', 'FTS')
+# MLLP start/end block characters that can be left behind in captured feeds
+MLLP_CHARACTERS = '\x0b\x1c'
+
+
+class HL7_Message:
+
+    def __init__(self, text: str):
+        """
+        Parses an HL7 v2 message.
+
+        Parameters:
+            text (str): The raw HL7 message. Segments may be separated by '\\r', '\\n' or '\\r\\n'.
+
+        Returns:
+            None
+        """
+        self.text = text
+        self.field_sep = FIELD_SEPARATOR
+        self.component_sep, self.repetition_sep, self.escape_char, self.subcomponent_sep = ENCODING_CHARACTERS
+        self.segments: List[List[str]] = []
+        self.offsets: List[int] = []
+        self.positions: Dict[str, List[int]] = {}
+        self.groups: List[Order_Group] = []
+        self.group_of: Dict[int, Order_Group] = {}
+        self._obx_index: Optional[Dict[str, List[int]]] = None
+        self._read_encoding()
+        self._parse()
+
+    def _read_encoding(self):
+        """
+        Reads the field separator (MSH-1) and encoding characters (MSH-2) from the MSH segment.
+        Falls back to the HL7 defaults when the message does not start with a usable MSH.
+        """
+        match = MSH_PATTERN.search(self.text)
+        if not match or len(self.text) < match.start(1) + 8:
+            return
+        start = match.start(1)
+        self.field_sep = self.text[start + 3]
+        encoding = self.text[start + 4:].split(self.field_sep, 1)[0]
+        # MSH-2 may legally leave out the trailing characters, keep defaults for those
+        encoding = encoding + ENCODING_CHARACTERS[len(encoding):]
+        self.component_sep, self.repetition_sep, self.escape_char, self.subcomponent_sep = encoding[:4]
+
+    def _parse(self):
+        """
+        Splits the message into segments and fields and builds the order groups in a single
+        pass over the text.
+        """
+        group = None
+        for match in SEGMENT_PATTERN.finditer(self.text):
+            segment = match.group().strip()
+            if not segment:
+                continue
+            fields = segment.split(self.field_sep)
+            name = fields[0].upper()
+            fields[0] = name
+            if name == 'MSH':
+                # MSH-1 is the field separator itself, so shift MSH fields to line up
+                # field numbers with list indices (fields[n] == MSH-n)
+                fields.insert(1, self.field_sep)
+            position = len(self.segments)
+            self.positions.setdefault(name, []).append(position)
+            self.segments.append(fields)
+            self.offsets.append(match.start())
+            if name in GROUP_SEGMENTS:
+                group = self._group_segment(name, position, group)
+
+    def _group_segment(self, name: str, position: int, group: Optional['Order_Group']) -> Optional['Order_Group']:
+        """
+        Attaches one segment to the ORDER_OBSERVATION group it belongs to.
+
+        An ORC always opens a new group. An OBR fills the group opened by a preceding ORC,
+        otherwise it opens its own group (HL7 lets later orders leave out the ORC). OBX and
+        SPM segments belong to the most recent group.
+
+        Returns:
+            Order_Group: The group that following segments belong to.
+        """
+        if name == 'ORC' or (name == 'OBR' and (group is None or group.obr is not None)):
+            group = Order_Group()
+            self.groups.append(group)
+        if group is None:
+            return group
+        if name == 'ORC':
+            group.orc = position
+        elif name == 'OBR':
+            group.obr = position
+        elif name == 'OBX':
+            group.observations.append(position)
+            self.group_of[position] = group
+        elif name == 'SPM':
+            group.specimens.append(position)
+            self.group_of[position] = group
+        return group
+
+    def __len__(self):
+        return len(self.segments)
+
+    def __contains__(self, segment: str):
+        return segment.upper() in self.positions
+
+    def __getitem__(self, path: str) -> str:
+        """
+        Returns a field from the first occurrence of a segment.
+
+        Parameters:
+            path (str): A field path such as 'PID-5', or a component path such as 'PID-5.1'
+                or 'SPM-2.1.1'.
+
+        Returns:
+            str: The field value, or an empty string if the segment or field is missing.
+        """
+        segment, field, component, subcomponent = self.parse_path(path)
+        positions = self.positions.get(segment)
+        if not positions:
+            return ''
+        return self.value(positions[0], field, component, subcomponent)
+
+    @staticmethod
+    def parse_path(path: str) -> Tuple[str, int, int, int]:
+        """
+        Splits a path such as 'PID-5' or 'PID-5.1' into its segment name, field number,
+        component number and sub-component number (0 when the path does not go that deep).
+
+        Raises:
+            KeyError: If the path is not a valid segment-field path.
+        """
+        match = PATH_PATTERN.match(path.strip().upper())
+        if not match:
+            raise KeyError(f'Invalid HL7 field path: {path}')
+        return match.group(1), int(match.group(2)), int(match.group(3) or 0), int(match.group(4) or 0)
+
+    def indices(self, segment: str) -> List[int]:
+        """
+        Returns the positions of every occurrence of a segment, in message order.
+        """
+        return self.positions.get(segment.upper(), [])
+
+    def name(self, position: int) -> str:
+        """
+        Returns the segment name at a position.
+        """
+        return self.segments[position][0]
+
+    def field(self, position: int, field: int) -> str:
+        """
+        Returns one field of the segment at a position.
+
+        Parameters:
+            position (int): The position of the segment in the message.
+            field (int): The HL7 field number (e.g. 5 for PID-5).
+
+        Returns:
+            str: The field value, or an empty string if the segment is shorter than that.
+        """
+        fields = self.segments[position]
+        if field < len(fields):
+            return fields[field]
+        return ''
+
+    def value(self, position: int, field: int, component: int = 0, subcomponent: int = 0) -> str:
+        """
+        Returns a field, component or sub-component of the segment at a position.
+
+        Parameters:
+            position (int): The position of the segment in the message.
+            field (int): The HL7 field number.
+            component (int): The component number, 0 for the whole field.
+            subcomponent (int): The sub-component number, 0 for the whole component.
+
+        Returns:
+            str: The value, or an empty string if it is not present.
+        """
+        value = self.field(position, field)
+        if component:
+            parts = value.split(self.component_sep)
+            value = parts[component - 1] if component <= len(parts) else ''
+            if subcomponent:
+                parts = value.split(self.subcomponent_sep)
+                value = parts[subcomponent - 1] if subcomponent <= len(parts) else ''
+        return value
+
+    def segment_text(self, position: int) -> str:
+        """
+        Returns the raw text of the segment at a position.
+        """
+        start = self.offsets[position]
+        end = SEGMENT_PATTERN.match(self.text, start).end()
+        return self.text[start:end].strip()
+
+    @property
+    def obx_index(self) -> Dict[str, List[int]]:
+        """
+        Index of OBX positions by the normalized identifier, text and alternate text of
+        OBX-3 (components 1, 2 and 5). Built on first use.
+        """
+        if self._obx_index is None:
+            self._obx_index = {}
+            for position in self.indices('OBX'):
+                components = self.field(position, 3).split(self.component_sep)
+                for i in (0, 1, 4):
+                    if i < len(components):
+                        key = normalize_test(components[i])
+                        if key:
+                            positions = self._obx_index.setdefault(key, [])
+                            if position not in positions:
+                                positions.append(position)
+        return self._obx_index
+
+    def find_obx(self, resultTest: str) -> int:
+        """
+        Finds the OBX segment of a resulted test.
+
+        The resulted test is normalized the same way as the OBX-3 index, so case, extra
+        whitespace and bracketed qualifiers such as '[Presence]' do not matter.
+
+        Parameters:
+            resultTest (str): The resulted test, e.g. DILR_ResultedTest from the IMM export.
+
+        Returns:
+            int: The position of the first matching OBX segment, or 0 if there is none.
+        """
+        positions = self.obx_index.get(normalize_test(resultTest))
+        return positions[0] if positions else 0
+
+    def select(self, positions: List[int]) -> 'Segment_View':
+        """
+        Returns a view over a subset of segments (one per segment name), for example
+        the PID, ORC, OBR, OBX and SPM segments belonging to one resulted test.
+        """
+        return Segment_View(self, positions)
+
+
+class Order_Group:
+
+    def __init__(self):
+        """
+        One ORDER_OBSERVATION group of an ORU message: the order (ORC), the observation
+        request (OBR), its observations (OBX) and specimens (SPM), stored as segment positions.
+        """
+        self.orc: Optional[int] = None
+        self.obr: Optional[int] = None
+        self.observations: List[int] = []
+        self.specimens: List[int] = []
+
+    @property
+    def specimen(self) -> Optional[int]:
+        'Return the position of the first SPM of the group, if there is one'
+        return self.specimens[0] if self.specimens else None
+
+
+class Segment_View:
+
+    def __init__(self, message: HL7_Message, positions: List[int]):
+        """
+        Maps segment names to one chosen position in a parsed HL7 message.
+
+        Parameters:
+            message (HL7_Message): The parsed message.
+            positions (list): Segment positions to expose. If a segment name appears more
+                than once the first position given wins.
+
+        Returns:
+            None
+        """
+        self.message = message
+        self.chosen: Dict[str, int] = {}
+        for position in positions:
+            self.chosen.setdefault(message.name(position), position)
+
+    def __getitem__(self, path: str) -> str:
+        segment, field, component, subcomponent = HL7_Message.parse_path(path)
+        position: Optional[int] = self.chosen.get(segment)
+        if position is None:
+            return ''
+        return self.message.value(position, field, component, subcomponent)
+
+
+def normalize_test(text: str) -> str:
+    """
+    Normalizes a resulted test name for lookups: bracketed text is removed, the text is
+    case-folded and runs of whitespace are collapsed.
+
+    Example:
+        'SARS-CoV-2 RNA  [Presence] in Specimen' -> 'sars-cov-2 rna in specimen'
+    """
+    return WHITESPACE_PATTERN.sub(' ', BRACKET_PATTERN.sub(' ', text)).strip().casefold()
+
+
+def iter_hl7_messages(source: Union[str, IO[str]]) -> Iterator[str]:
+    """
+    Streams the messages of an HL7 batch file one at a time.
+
+    Handles FHS/BHS wrapped batches and plain files of back to back MSH messages, with
+    segments separated by '\\r', '\\n' or '\\r\\n'. Only one message is held in memory.
+
+    Parameters:
+        source (str or file): Path to the batch file, or an open text file.
+
+    Yields:
+        str: The text of each message, segments joined with '\\r'.
+    """
+    if isinstance(source, str):
+        with open(source, 'r', encoding='utf-8', errors='replace') as batch:
+            yield from iter_hl7_messages(batch)
+        return
+    segments: List[str] = []
+    # text mode with universal newlines splits on '\r', '\n' and '\r\n' alike
+    for line in source:
+        segment = line.strip().strip(MLLP_CHARACTERS).strip()
+        if not segment:
+            continue
+        name = segment[:3].upper()
+        if name in ENVELOPE_SEGMENTS:
+            continue
+        if name == 'MSH' and segments:
+            yield '\r'.join(segments)
+            segments = []
+        if name == 'MSH' or segments:
+            segments.append(segment)
+    if segments:
+        yield '\r'.join(segments)
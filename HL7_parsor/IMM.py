@@ -13,26 +13,61 @@
     3. Input date ranges using the `date_range` method.
     4. Choose the desired laboratory from the dropdown menu.
     5. Click the search button to perform the search.
-    6. If needed, use the `imm_export` method to export the search results as an Excel workbook.
+    6. If needed, use the `imm_export` method to export the search results (CSV, XML or Excel).
 """
 
 import os
+import re
 import time
 import glob
+import logging
 import pandas as pd
-# import numpy as np 
+import numpy as np
 
 from SetUp import SetUp
 # from selenium.webdriver.common.keys import Keys
 from selenium.webdriver.common.by import By
-from selenium.webdriver.support.wait import WebDriverWait
 from selenium.webdriver.support import expected_conditions as EC
 from selenium.webdriver.support.select import Select
-from selenium.common.exceptions import TimeoutException, ElementClickInterceptedException
+from selenium.webdriver.common.alert import Alert
+from selenium.common.exceptions import (TimeoutException, 
+                                        NoSuchElementException,
+                                        ElementClickInterceptedException,
+                                        WebDriverException)
+from Locator_cache import Locator_Cache, ABSENT, environment
+from urllib.parse import urlsplit
+from Download_watch import wait_for_download
+from Export_reader import read_export, EXPORT_FORMATS, EXPORT_SUFFIXES
+from Export_cache import Export_Cache, file_digest
+from Case_selection import select_cases, selection_name
+from WebCMR_http import WebCMR_Session
 
 
 class IMM(SetUp): 
 
+    # SQLite file remembering which locator finds each field on each WebCMR environment
+    # (None turns the cache off)
+    locator_cache_path = 'locator_cache.sqlite'
+
+    # open the IMM and Disease Incident pages by their learned url instead of the menus
+    deep_links = True
+
+    # address of the Incoming Message Monitor for the browserless backend, when it is not
+    # learned from a browser run (see `deep_link`)
+    imm_url = None
+
+    # format the IMM search results are exported in: 'csv', 'xml' or 'excel' (see
+    # Export_reader.EXPORT_FORMATS); CSV is the quickest to read back
+    export_format = 'csv'
+
+    # folder keeping the frames export_df built from each export, by the hash of the export
+    # (None turns the cache off)
+    export_cache_folder = 'export_cache'
+
+    # engine picking the cases of the export, a name of Case_selection.CASE_SELECTIONS or a
+    # callable: 'last_row' keeps every categorical result and one numeric and error example
+    # per test, 'set_cover' covers every (test, classification) with the fewest accessions
+    case_selection = 'last_row'
     
     def __init__(self, LabName : str, *args, **kwargs): 
         """
@@ -69,6 +104,9 @@ class IMM(SetUp):
         :param self: The current instance of the class.
         :param driver: The driver object used to interact with the web page.
         """ 
+        # HTTP sessions open the page each operation needs themselves
+        if isinstance(driver, WebCMR_Session):
+            return
 
         # Clicking home button 
         home_btn = self.multiFind(
@@ -98,11 +136,17 @@ class IMM(SetUp):
             None
         """
 
+        if isinstance(driver, WebCMR_Session):
+            return
+
+        # Opening the learned IMM url directly, the menus are only used when that fails
+        if self.deep_link(driver, 'imm', 'txtAccession'):
+            return
+
         # Navigating back to home page
         self.go_home(driver)
 
         # Looking at Administrator dropdown menu
-        wait = WebDriverWait(driver, 8)
         #dropdown_menu = wait.until(EC.presence_of_element_located((By.ID, "FragTop1_mnuMain-menuItem017")))
         dropdown_menu = self.multiFind(
             driver=driver,
@@ -129,6 +173,7 @@ class IMM(SetUp):
             xpath='/html/body/form/table[2]/tbody/tr/td[2]/table[5]/tbody/tr[3]/td'
         )
         desired_option.click()
+        self.learn_url(driver, 'imm')
         return
     
     def imm_search(self): 
@@ -177,89 +222,160 @@ class IMM(SetUp):
     def imm_export(self): 
         '''
         Method is used after completing the search for specific lab and exporting
-        all the results as an excel workbook and looking up those results in TST system.
-        Takes you back to the home page after excel workbook is downloaded
+        all the results (in `export_format`) and looking up those results in TST system.
+        Takes you back to the home page after the export is downloaded
         
         Returns:
             WebDriver: The WebDriver object representing the browser session.
         '''
         driver = self.imm_search()
+
+        # Routing the download into this run's own download folder, else Chrome saves it in
+        # the default Downloads folder
+        download_folder = self.download_folder()
+        if not self.route_downloads(driver, download_folder):
+            download_folder = self.default_download_folder()
+        initial_files = set(os.listdir(download_folder))
         
         # clicking export button
         csv_id = 'btnExport_btnExport'
-        wait = WebDriverWait(driver, 10)
-        csv_sheet = wait.until(EC.presence_of_element_located((By.ID, csv_id)))
+        csv_sheet = self.wait_timer.until(driver, 'page:imm_results', EC.presence_of_element_located((By.ID, csv_id)),
+                                          default=10)
         csv_sheet.click()
 
         # making selections in pop-up menu
-        iframe = wait.until(EC.presence_of_element_located((By.XPATH, "/html/body/div[1]/iframe")))
+        iframe = self.wait_timer.until(driver, 'page:export_dialog', EC.presence_of_element_located((By.XPATH, "/html/body/div[1]/iframe")),
+                                       default=10)
         driver.switch_to.frame(iframe)
 
         # choosing select all for columns
         select_all = driver.find_element(By.ID, 'clstAll_0' )
         select_all.click()
 
-        # choosing microsoft excel format
-        csv_option = driver.find_element(by=By.ID, value='optFormat_2')
+        # choosing the export format
+        format_id, suffixes = EXPORT_FORMATS[self.export_format]
+        csv_option = driver.find_element(by=By.ID, value=format_id)
         csv_option.click()
 
         # Clicking Export
         export_id = 'btnExport'
-        export_btn = wait.until(EC.presence_of_element_located((By.ID, export_id)))
+        export_btn = self.wait_timer.until(driver, 'element:btnExport', EC.presence_of_element_located((By.ID, export_id)),
+                                           default=10)
         export_btn.click()
 
         # switching back to parent frame / default content: 
         driver.switch_to.default_content()
 
-        # Making relative path to Downloads folder
-        download_folder = self.download_folder()
-        initial_files = set(os.listdir(download_folder))
-        
-        # Wait for the download to complete
-        while True: 
-            current_files = set(os.listdir(download_folder))
-            if len(current_files) <= len(initial_files): 
-                try:
-                    # going to wait 6 seconds if nothing shows up 
-                    # will wait 6 more seconds
-                    time.sleep(6)
-                except: 
-                    pass 
-            elif len(current_files) > len(initial_files): 
-                break
-            else: 
-                break 
+        # Waiting for the export to be renamed into place in this run's download folder
+        try:
+            self.export_path = wait_for_download(download_folder, initial_files, suffixes)
+        except TimeoutError as e:
+            raise TimeoutException(str(e))
+        logging.info(f'Export downloaded to {self.export_path}')
         # driver.quit()
         self.go_home(driver)
         return driver
 
     def download_folder(self):
         """
-        Downloads the folder where the files are saved.
+        The download folder of this run, a time stamped folder under Downloads/TST WebCMR that
+        is created on first use, so an export can not be confused with any other download.
 
         :param self: The object instance.
         :return: The path of the downloaded folder.
         """
+        if getattr(self, '_download_folder', None) is None:
+            run = time.strftime('%Y%m%d_%H%M%S')
+            self._download_folder = os.path.join(self.default_download_folder(), "TST WebCMR", f'{run}_{os.getpid()}')
+            os.makedirs(self._download_folder, exist_ok=True)
+        return self._download_folder
+
+    def default_download_folder(self):
+        'The Downloads folder Chrome saves to when downloads are not routed'
+        return os.path.join(os.path.expanduser("~"), "Downloads")
+
+    def latest_export(self):
+        """
+        The newest IMM export downloaded: from the download folder of this run, else from the
+        folders of earlier runs and the default Downloads folder.
+
+        Returns:
+            str: Path of the export.
+
+        Raises:
+            FileNotFoundError: If no export is found in any of the folders.
+        """
+        run_folders = glob.glob(os.path.join(self.default_download_folder(), "TST WebCMR", '*'))
+        searches = [[self.download_folder()], run_folders + [self.default_download_folder()]]
+        for folders in searches:
+            exports = [file for folder in folders for file in glob.glob(os.path.join(folder, '*'))
+                       if file.lower().endswith(EXPORT_SUFFIXES) and os.path.isfile(file)]
+            if exports:
+                return max(exports, key=os.path.getctime)
+        raise FileNotFoundError(
+            f'No IMM export ({", ".join(EXPORT_SUFFIXES)}) found in {self.download_folder()} or '
+            f'{self.default_download_folder()}; run imm_export or pass the path of the export'
+        )
 
-        home_directory = os.path.expanduser("~")
-        download_folder = os.path.join(home_directory, "Downloads")
-        return download_folder
+    def lab_dir(self):
+        """
+        Returns the output folder of the lab, creating it if needed.
 
-    def export_df(self): 
+        Returns:
+            str: The relative path of the folder (the lab name with special characters replaced).
+        """
+        lab_name = re.sub(r'[^\w\s]+', '_',self.lab)
+        new_dir = f'./{lab_name}/'
+        try:
+            mkdir = os.mkdir(new_dir)
+        except FileExistsError:
+            pass 
+        return new_dir
+
+    def route_downloads(self, driver, download_folder):
+        'Tells Chrome to save downloads into the folder without asking; returns whether it could'
+        try:
+            driver.execute_cdp_cmd('Browser.setDownloadBehavior', {'behavior': 'allow', 'downloadPath': os.path.abspath(download_folder)})
+            return True
+        except (AttributeError, WebDriverException) as e:
+            logging.warning(f'Could not route downloads to {download_folder}, watching the Downloads folder: {e}')
+            return False
+
+    def export_df(self, path=None): 
         """
         Export the DataFrame to an Excel file and return the filtered DataFrame.
+
+        Args:
+            path (str, optional): The export (CSV, XML or Excel). Defaults to the one `imm_export`
+                downloaded, or the newest export downloaded (see `latest_export`).
         
         Returns:
             pandas.DataFrame: The filtered DataFrame containing the unique resulted tests, incident ID,
             accession number, and result value.
         """ 
         
-        download_folder = self.download_folder()
-        
-        # Reading in the most recently downloaded excel file from downloads folder
-        list_of_files = glob.glob(f'{download_folder}/*.xlsx')
-        latest_file = max(list_of_files, key=os.path.getctime)
-        export_df = pd.read_excel(latest_file)
+        latest_file = path or getattr(self, 'export_path', None)
+        if latest_file is None: 
+            # Reading in the most recently downloaded export from downloads folder
+            latest_file = self.latest_export()
+
+        # an export processed before is loaded from the export cache by the hash of its content
+        cache = self.export_cache
+        digest = file_digest(latest_file) if cache is not None and cache.enabled else None
+        final_kind = f'final.{selection_name(self.case_selection)}'
+        final_df = cache.load(digest, final_kind) if digest else None
+        if final_df is not None:
+            logging.info(f'Loaded the cases of {latest_file} from the export cache')
+            # the summary workbook is shared by every lab, so it is rewritten for this export
+            final_df.to_excel('ELR_Validation_Search_Summary.xlsx')
+            return final_df
+
+        export_df = cache.load(digest, 'raw') if digest else None
+        if export_df is None:
+            # only the columns used below are read, as text
+            export_df = read_export(latest_file)
+            if digest:
+                cache.store(digest, 'raw', export_df)
 
         # Filtering results based on unique resulted tests and test type
         # Remember this is only for imported reports ONLY not all 
@@ -267,34 +383,16 @@ class IMM(SetUp):
         filtered_import = imported_status_df[['DILR_ResultedTest', 
                                                 'DILR_IncidentID', 
                                                 'DILR_AccessionNumber',
-                                                'DILR_ResultValue']]
-        
-        # only looking at last unique result value for each test
-        # This will make sure that the resultValue and resultTest are unique combos
-        filtered_import.drop_duplicates(subset=['DILR_ResultedTest','DILR_ResultValue'],
-                                                        keep='last',
-                                                        inplace=True)
-
-        # Need to classify each result so that I can filter the numeric results and just pick 
-        # one accession ID and disease ID for each test that has numeric
-        # Will do the same for mixed as well 
-        filtered_import['Classification'] = filtered_import['DILR_ResultValue'
-                                                        ].apply(self.classify_column)
-        
-        # Final filter of df based on classification column and ResultedTest
-        # Although we kept all of the unique combinations of DILR_ResultValue and ResultedTest after classification
-        # We might have multiple numeric values and we would not want to look at every single one so instead we
-        # only look at one example of this classification for each ResultedTest and that is also why we split the 
-        # data into two dataframes and recombine them (because we only want one example of ERROR and Numeric)
-        
-        num_error = filtered_import[filtered_import['Classification'].isin(['ERROR', 'Numeric'])]
-        num_error.drop_duplicates(subset=['DILR_ResultedTest','Classification'],
-                                                        keep='last',
-                                                        inplace=True)
-        categorical_df = filtered_import[filtered_import['Classification'].isin(['Categorical'])]
-        
-        # Combine dataframe 
-        final_df = pd.concat([categorical_df, num_error], ignore_index=True)
+                                                'DILR_ResultValue']].copy()
+
+        # Need to classify each result so that the selection engine can pick one accession ID
+        # and disease ID for each test that has numeric (the same for mixed as well)
+        filtered_import['Classification'] = self.classify_values(filtered_import['DILR_ResultValue'])
+
+        # Picking the cases to validate (see Case_selection)
+        final_df = select_cases(filtered_import, self.case_selection)
+        if digest:
+            cache.store(digest, final_kind, final_df)
         final_df.to_excel('ELR_Validation_Search_Summary.xlsx')
 
         return final_df
@@ -328,6 +426,53 @@ class IMM(SetUp):
                 else:
                     # Return 'Categorical' for other cases
                     return 'Categorical'
+
+    def classify_values(self, values):
+        """
+        Vectorized `classify_column` over a whole column: gives every value the same 'Categorical',
+        'Numeric' or 'ERROR' label with pandas string methods and `pd.to_numeric`, run once per
+        distinct value.
+
+        Non-text cells (numbers or blanks read from the workbook) are classified by their text.
+        The few values `float()` reads but `pd.to_numeric` does not ('1_000', 'nan', non-ASCII
+        digits or spaces) are checked one by one with `classify_column`.
+
+        Parameters:
+            values (pandas.Series): The values to classify.
+
+        Returns:
+            pandas.Series: The classification of each value, with the index of `values`.
+        """
+        # results repeat a lot, so each distinct value is classified once
+        codes, distinct = pd.factorize(values.astype(str))
+        text = pd.Series(distinct, dtype=object)
+        labels = np.full(len(text), 'Categorical', dtype=object)
+
+        alpha = text.str.isalpha().to_numpy()
+        rest = text[~alpha]
+        digits = rest.str.contains('[0-9]', regex=True).to_numpy()
+        letters = rest.str.contains('[A-Za-z]', regex=True).to_numpy()
+
+        # a number has a digit, so only those values go through pd.to_numeric ('nan' and 'inf'
+        # are checked below)
+        numeric = np.zeros(len(rest), dtype=bool)
+        numeric[digits] = pd.to_numeric(rest[digits], errors='coerce').notna().to_numpy()
+        # pd.to_numeric also reads spaces inside a number ('1e 5'), float() does not
+        spaced = np.zeros(len(rest), dtype=bool)
+        spaced[numeric] = rest[numeric].str.strip().str.contains(r'\s', regex=True).to_numpy()
+        numeric &= ~spaced
+        rest_labels = np.where(numeric, 'Numeric', np.where(letters & digits, 'ERROR', 'Categorical')).astype(object)
+
+        # values float() may read differently from pd.to_numeric are checked one by one
+        unsure = spaced.copy()
+        others = ~numeric & ~spaced
+        unsure[others] = (rest[others].str.contains('_|nan|inf', case=False, regex=True)
+                          | ~rest[others].str.isascii()).to_numpy()
+        if unsure.any():
+            rest_labels[unsure] = [self.classify_column(value) for value in rest[unsure]]
+        labels[~alpha] = rest_labels
+        return pd.Series(labels[codes], index=values.index, dtype=object)
+
     def multiFind(self, driver, element_id, xpath=None, field_name=None):
         """
         Finds and returns a web element on the page using the given driver and element identifier.
@@ -341,24 +486,173 @@ class IMM(SetUp):
         Returns:
             The web element that was found using the given identifier.
         """
-         
-        wait = WebDriverWait(driver, 1)
+        element_btn = None
         try: 
-            element_btn = wait.until(EC.presence_of_element_located((By.ID, element_id)))
-        except TimeoutException:
-            #time.sleep(3)
-            if xpath:
-                try: 
-                    element_btn = wait.until(EC.presence_of_element_located((By.XPATH, xpath)))
-                except: 
-                    pass
-            if field_name:
-                try: 
-                    element_btn = wait.until(EC.presence_of_element_located((By.XPATH, field_name)))
-                except: 
-                    pass  
-            else: print(f'Cannot locate desired field or tab')
+            element_btn = self.locate(driver, element_id, xpath, field_name, skip_absent=True)
         except ElementClickInterceptedException: 
             self.alert_handling(driver)
+        if element_btn is None:
+            print(f'Cannot locate desired field or tab')
+            raise NoSuchElementException(f'{element_id} not found by id, xpath or field name')
+
+        return element_btn  
+
+    @property
+    def export_cache(self):
+        'The export cache shared by every lab run on this machine, None when turned off'
+        if self.export_cache_folder and getattr(self, '_export_cache', None) is None:
+            self._export_cache = Export_Cache(self.export_cache_folder)
+        return getattr(self, '_export_cache', None)
+
+    @property
+    def locator_cache(self):
+        'The locator cache shared by every lab run on this machine, None when turned off'
+        if self.locator_cache_path and getattr(self, '_locator_cache', None) is None:
+            self._locator_cache = Locator_Cache(self.locator_cache_path)
+        return getattr(self, '_locator_cache', None)
+
+    def locate(self, driver, element_id, xpath=None, field_name=None, skip_absent=False):
+        """
+        Finds a web element by its id, xpath or field_name xpath, trying first the strategy that
+        found it last time on this environment (see `Locator_Cache`).
+        A field is only remembered as absent when every strategy waited at least the default
+        timeout, as a miss with a shorter, learned timeout may just be a slow page.
+
+        Args:
+            driver: The driver used to interact with the web page.
+            element_id: The ID of the element to locate on the page.
+            xpath: Optional. The XPath of the element to locate on the page.
+            field_name: Optional. The name of the field to locate on the page.
+            skip_absent: Optional. For fields remembered as absent, only check the page without
+                waiting.
+
+        Returns:
+            The web element, or None when no strategy found it.
+        """
+        locators = {'id': (By.ID, element_id), 'xpath': (By.XPATH, xpath), 'field_name': (By.XPATH, field_name)}
+        strategies = [strategy for strategy, (_, value) in locators.items() if value]
+        cache = self.locator_cache
+        env = environment(self.url)
+        if cache is not None:
+            if skip_absent and cache.strategy(env, element_id) == ABSENT:
+                for strategy in strategies:
+                    try:
+                        elements = driver.find_elements(*locators[strategy])
+                    except WebDriverException:
+                        continue
+                    if elements:
+                        cache.found(env, element_id, strategy)
+                        return elements[0]
+                return None
+            strategies = cache.order(env, element_id, strategies)
+
+        default = 1
+        full_waits = True
+        for strategy in strategies:
+            # latencies are learned per strategy, a strategy that misses does not slow the others
+            key = f'element:{element_id}:{strategy}'
+            full_waits = full_waits and self.wait_timer.timeout(key, default) >= default
+            try: 
+                element_btn = self.wait_timer.until(driver, key, EC.presence_of_element_located(locators[strategy]), default=default)
+            except ElementClickInterceptedException: 
+                raise
+            except WebDriverException:
+                # TimeoutException, or an invalid xpath
+                continue
+            if cache is not None:
+                cache.found(env, element_id, strategy)
+            return element_btn
+        if cache is not None and full_waits:
+            cache.missing(env, element_id)
+        return None
+
+    def deep_link(self, driver, page, ready_id, **values):
+        """
+        Opens a page by the url learned for it with a single `driver.get`.
 
-        return element_btn  
\ No newline at end of file
+        Args:
+            driver: The driver used to interact with the web page.
+            page: The name the url was learned under (see `learn_url`).
+            ready_id: ID of an element that is only on the page once it loaded.
+            values: Values filled into the url template, e.g. incident=1234.
+
+        Returns:
+            bool: True when the page loaded; False when no url is known or the deep link did
+            not land (the page is then marked so the menus are used until that expires).
+        """
+        cache = self.locator_cache
+        if not self.deep_links or cache is None:
+            return False
+        env = environment(self.url)
+        template = cache.page_url(env, page)
+        if not template or template == ABSENT:
+            return False
+        try:
+            driver.get(template.format(**values))
+            self.accept_alert(driver)
+            self.wait_timer.until(driver, f'page:{page}', EC.presence_of_element_located((By.ID, ready_id)), default=3)
+        except WebDriverException as e:
+            logging.info(f'Deep link to {page} did not load, using the menus: {e}')
+            cache.forget_url(env, page)
+            return False
+        return True
+
+    def learn_url(self, driver, page, **values):
+        """
+        Stores the url of the page the driver is on as the deep link of a page, with the given
+        values (e.g. incident=1234) replaced by template fields.
+        """
+        cache = self.locator_cache
+        if not self.deep_links or cache is None:
+            return
+        env = environment(self.url)
+        current = urlsplit(driver.current_url)
+        # only the path and query are templated, so values are never replaced inside the host
+        site = f'{current.scheme}://{current.netloc}'
+        url = driver.current_url[len(site):].replace('{', '{{').replace('}', '}}')
+        for key, value in values.items():
+            if str(value) not in url:
+                # the page is not addressed by its url (e.g. an ASP.NET postback)
+                cache.forget_url(env, page)
+                return
+            url = url.replace(str(value), '{' + key + '}')
+        cache.learn_url(env, page, site + url)
+
+    def accept_alert(self, driver):
+        'Accepts an alert if one is open (e.g. the one about a locked case)'
+        try: 
+            Alert(driver).accept()
+        except WebDriverException:
+            pass
+
+    def learned_url(self, page, **values):
+        'The deep link learned for a page with the template values filled in, None when there is none'
+        cache = self.locator_cache
+        template = cache.page_url(environment(self.url), page) if cache is not None else None
+        if not template or template == ABSENT:
+            return None
+        return template.format(**values)
+
+    def http_login(self):
+        """
+        Logs in a browserless session (see `WebCMR_Session`), which replays the ASP.NET postbacks
+        of the pages over HTTP instead of driving Chrome.
+
+        Returns:
+            WebCMR_Session: The logged in session.
+        """
+        imm_url = self.imm_url or self.learned_url('imm')
+        return WebCMR_Session(self.url, self.username, self.paswrd, imm_url=imm_url).login()
+
+    def http_export(self):
+        """
+        `imm_export` over HTTP: logs in, searches the IMM for the lab and date range and saves
+        the export in the download folder.
+
+        Returns:
+            WebCMR_Session: The logged in session.
+        """
+        session = self.http_login()
+        session.imm_search(self.lab, self.fromDate, self.toDate)
+        self.export_path = session.export(self.download_folder(), self.export_format)
+        return session
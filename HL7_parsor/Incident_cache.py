@@ -0,0 +1,61 @@
+"""
+    Purpose:
+    The `Incident_Cache` class keeps what was scraped from each Disease Incident (the
+    Demographics tab and every row of the lab grid), keyed by incident id, so a run visits an
+    incident once however many resulted tests of the export belong to it. It lives in memory
+    for one run, or in a SQLite file to serve later runs too until the entries expire.
+
+    Algorithm:
+    1. Look up the incident id; entries older than the TTL are not returned.
+    2. After a scrape, store the demographics and lab rows of the incident as JSON. Expired
+       entries are deleted when the cache is opened and on every store.
+"""
+
+import json
+import time
+
+from typing import Callable, Optional
+from SQLite_cache import SQLite_TTL_Cache
+
+
+class Incident_Cache(SQLite_TTL_Cache):
+    'An in-memory cache unless given a path; `ttl` is the seconds a scrape stays valid'
+
+    schema = (
+        '''CREATE TABLE IF NOT EXISTS incidents (
+            incident_id INTEGER PRIMARY KEY,
+            scrape TEXT NOT NULL,
+            stored REAL NOT NULL
+        )''',
+    )
+    expiring = 'incidents'
+
+    def __init__(self, path: Optional[str] = None, ttl: float = 24 * 3600, clock: Callable[[], float] = time.time):
+        super().__init__(path, ttl, clock)
+
+    def get(self, di_num: int) -> Optional[dict]:
+        """
+        Returns the cached scrape of a Disease Incident.
+
+        Parameters:
+            di_num (int): The Disease Incident id.
+
+        Returns:
+            dict: {'demographics': {...}, 'lab': [{...}, ...]}, or None when nothing valid is cached.
+        """
+        with self._lock:
+            row = self._conn.execute(
+                'SELECT scrape FROM incidents WHERE incident_id = ? AND stored >= ?',
+                (int(di_num), self.cutoff())
+            ).fetchone()
+        return json.loads(row[0]) if row else None
+
+    def put(self, di_num: int, scrape: dict):
+        'Stores the scrape of a Disease Incident'
+        with self._lock:
+            self._purge()
+            self._conn.execute(
+                'INSERT OR REPLACE INTO incidents VALUES (?, ?, ?)',
+                (int(di_num), json.dumps(scrape), self.clock())
+            )
+            self._conn.commit()
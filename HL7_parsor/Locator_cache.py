@@ -0,0 +1,148 @@
+"""
+    Purpose:
+    The `Locator_Cache` class remembers, per WebCMR environment, which locator strategy
+    (element id, xpath or field_name xpath) found each field, so `multiFind` and `extract_info`
+    try the winning strategy first instead of waiting out the id lookup on builds where the id
+    differs. Fields that no strategy found are remembered as absent and are only checked
+    without waiting until the entry expires. It also keeps the learned url of pages, such as
+    the Incoming Message Monitor or a Disease Incident, so they can be opened with one
+    `driver.get` instead of a chain of menu clicks.
+
+    Algorithm:
+    1. Load every (environment, field) -> strategy entry of the SQLite file into memory.
+    2. `order` puts the remembered strategy in front of the others.
+    3. `found` / `missing` record the outcome of a lookup, writing to disk only when it changes.
+    4. Absent entries older than `absent_ttl` are forgotten so the field gets waited for again.
+    5. Page urls are stored as templates (e.g. the incident id replaced by `{incident}`); pages
+       whose deep link did not land are marked ABSENT and go through the menus until that expires.
+"""
+
+from typing import Dict, List, Optional, Sequence, Tuple
+from urllib.parse import urlsplit
+from SQLite_cache import SQLite_TTL_Cache
+
+
+# strategy recorded for fields that no strategy found
+ABSENT = 'absent'
+
+
+def environment(url: str) -> str:
+    'The environment key of a WebCMR url: host and application folder, e.g. test-sdcounty.atlasph.com/TSTWebCMR'
+    parts = urlsplit(url)
+    folder = parts.path.strip('/').split('/', 1)[0]
+    return f'{parts.netloc}/{folder}'.lower()
+
+
+class Locator_Cache(SQLite_TTL_Cache):
+
+    schema = (
+        '''CREATE TABLE IF NOT EXISTS locators (
+            environment TEXT NOT NULL,
+            field TEXT NOT NULL,
+            strategy TEXT NOT NULL,
+            updated REAL NOT NULL,
+            PRIMARY KEY (environment, field)
+        )''',
+        '''CREATE TABLE IF NOT EXISTS pages (
+            environment TEXT NOT NULL,
+            page TEXT NOT NULL,
+            url TEXT NOT NULL,
+            updated REAL NOT NULL,
+            PRIMARY KEY (environment, page)
+        )''',
+    )
+
+    def __init__(self, path: str, absent_ttl: float = 24 * 3600):
+        """
+        Opens a locator cache and loads it into memory. Only ABSENT entries expire, after
+        `absent_ttl` seconds, and they are kept on disk so the expiry can be checked.
+
+        Parameters:
+            path (str): The SQLite file.
+            absent_ttl (float): Seconds a field stays known to be absent.
+
+        Returns:
+            None
+        """
+        super().__init__(path, absent_ttl)
+        self._pages: Dict[Tuple[str, str], Tuple[str, float]] = {
+            (env, page): (url, updated)
+            for env, page, url, updated in self._conn.execute('SELECT * FROM pages')
+        }
+        self._entries: Dict[Tuple[str, str], Tuple[str, float]] = {
+            (env, field): (strategy, updated)
+            for env, field, strategy, updated in self._conn.execute('SELECT * FROM locators')
+        }
+
+    def strategy(self, env: str, field: str) -> Optional[str]:
+        """
+        Returns the strategy remembered for a field, ABSENT for fields known to be missing,
+        or None when nothing (valid) is remembered.
+        """
+        with self._lock:
+            strategy, updated = self._entries.get((env, field), (None, 0.0))
+        if strategy == ABSENT and updated < self.cutoff():
+            return None
+        return strategy
+
+    def order(self, env: str, field: str, strategies: Sequence[str]) -> List[str]:
+        """
+        Returns the strategies with the remembered winner first, the rest in their given order.
+        """
+        winner = self.strategy(env, field)
+        if winner in strategies:
+            return [winner] + [strategy for strategy in strategies if strategy != winner]
+        return list(strategies)
+
+    def found(self, env: str, field: str, strategy: str):
+        'Record the strategy that found a field'
+        self._store(env, field, strategy)
+
+    def missing(self, env: str, field: str):
+        'Record that no strategy found a field'
+        self._store(env, field, ABSENT)
+
+    def _store(self, env: str, field: str, strategy: str):
+        now = self.clock()
+        with self._lock:
+            current, updated = self._entries.get((env, field), (None, 0.0))
+            # repeated outcomes do not touch the disk; absent entries keep their time until
+            # they expire, so the field is then waited for again
+            expired = strategy == ABSENT and updated < now - self.ttl
+            if current == strategy and not expired:
+                return
+            self._entries[(env, field)] = (strategy, now)
+            self._conn.execute('INSERT OR REPLACE INTO locators VALUES (?, ?, ?, ?)', (env, field, strategy, now))
+            self._conn.commit()
+
+    def page_url(self, env: str, page: str) -> Optional[str]:
+        """
+        Returns the url template learned for a page, ABSENT for pages that cannot be deep
+        linked, or None when nothing (valid) is known.
+        """
+        with self._lock:
+            url, updated = self._pages.get((env, page), (None, 0.0))
+        if url == ABSENT and updated < self.cutoff():
+            return None
+        return url
+
+    def learn_url(self, env: str, page: str, url: str):
+        'Record the url template of a page, unless the page is known not to deep link'
+        if self.page_url(env, page) in (url, ABSENT):
+            return
+        self._store_page(env, page, url)
+
+    def forget_url(self, env: str, page: str):
+        'Record that the deep link of a page did not land'
+        self._store_page(env, page, ABSENT)
+
+    def _store_page(self, env: str, page: str, url: str):
+        now = self.clock()
+        with self._lock:
+            self._pages[(env, page)] = (url, now)
+            self._conn.execute('INSERT OR REPLACE INTO pages VALUES (?, ?, ?, ?)', (env, page, url, now))
+            self._conn.commit()
+
+    def __len__(self):
+        with self._lock:
+            return len(self._entries)
@@ -0,0 +1,283 @@
+# ---------------------------------------------------------------------------------------------------
+#   Purpose:
+#       Receives HL7 messages over TCP (MLLP framing) and feeds them straight into the same field
+#       extraction that data_wrangling performs, so ELR can be validated as messages arrive instead
+#       of screen-scraping the Incoming Message Monitor after the fact.
+#   Algorithm:
+#       1. Listen for MLLP connections on the event loop
+#       2. Parse every complete frame and put the message on a queue
+#       3. ACK the message once it is queued (NAK frames that are too large, cut off or have no MSH)
+#       4. A consumer extracts the hl7_values / hl7_section_label record of every OBX
+#       5. Records are appended to a CSV file (or handed to a callback)
+#   Usage:
+#       python MLLP_listener.py listen --port 2575 --output mllp_records.csv
+#       python MLLP_listener.py send --port 2575 lab_feed.hl7
+# ---------------------------------------------------------------------------------------------------
+
+import sys
+import csv
+import asyncio
+import logging
+import argparse
+
+from datetime import datetime
+from typing import Callable, Iterable, List, Optional
+from HL7_parser import HL7_Message, iter_hl7_messages
+from HL7_fields import HL7_Fields, HL7_SECTION_LABELS
+
+
+# MLLP frame characters: <VT> message <FS><CR>
+START_BLOCK = b'\x0b'
+END_BLOCK = b'\x1c\r'
+
+# largest frame the listener reads, well above any ELR message (the asyncio default is 64 KiB)
+FRAME_LIMIT = 16 * 1024 * 1024
+
+
+def mllp_frame(text: str) -> bytes:
+    'Wrap an HL7 message in an MLLP frame'
+    return START_BLOCK + text.encode('utf-8') + END_BLOCK
+
+
+def build_ack(msg: HL7_Message, code: str = 'AA') -> str:
+    """
+    Builds an HL7 ACK for a received message.
+
+    Parameters:
+        msg (HL7_Message): The received message.
+        code (str): MSA-1 acknowledgment code (AA accept, AE error, AR reject).
+
+    Returns:
+        str: The ACK message, segments separated by carriage returns.
+    """
+    sep = msg.field_sep
+    encoding = msg.component_sep + msg.repetition_sep + msg.escape_char + msg.subcomponent_sep
+    control_id = msg['MSH-10']
+    msh = sep.join([
+        'MSH', encoding,
+        msg['MSH-5'], msg['MSH-6'],     # receiving application / facility become the sender
+        msg['MSH-3'], msg['MSH-4'],
+        datetime.now().strftime('%Y%m%d%H%M%S'), '',
+        'ACK', f'ACK{control_id}', msg['MSH-11'] or 'P', msg['MSH-12'] or '2.5.1'
+    ])
+    msa = sep.join(['MSA', code, control_id])
+    return '\r'.join([msh, msa])
+
+
+class MLLP_Listener(HL7_Fields):
+
+    def __init__(
+        self,
+        host: str = '127.0.0.1',
+        port: int = 2575,
+        on_record: Optional[Callable] = None,
+        queue_size: int = 10000,
+        frame_limit: int = FRAME_LIMIT
+        ):
+        """
+        Initializes a new instance of the class.
+
+        Parameters:
+            host (str): The interface to listen on.
+            port (int): The TCP port to listen on (0 picks a free port).
+            on_record (callable, optional): Called with (accession, resulted test, hl7_values,
+                hl7_section_label) for every OBX of every received message.
+            queue_size (int): Maximum number of parsed messages waiting for extraction.
+            frame_limit (int): Largest MLLP frame, in bytes, accepted from a sender.
+
+        Returns:
+            None
+        """
+        self.host = host
+        self.port = port
+        self.on_record = on_record
+        self.queue_size = queue_size
+        self.frame_limit = frame_limit
+        self.queue: Optional[asyncio.Queue] = None
+        self.server: Optional[asyncio.AbstractServer] = None
+        self.received = 0
+
+    async def start(self):
+        """
+        Starts the TCP server and the extraction consumer on the running event loop.
+
+        Returns:
+            asyncio.Task: The consumer task.
+        """
+        self.queue = asyncio.Queue(maxsize=self.queue_size)
+        self.server = await asyncio.start_server(
+            self.handle_client, self.host, self.port, limit=self.frame_limit)
+        # port 0 asks the OS for a free port, keep the one it picked
+        self.port = self.server.sockets[0].getsockname()[1]
+        logging.info(f'MLLP listener on {self.host}:{self.port}')
+        return asyncio.get_running_loop().create_task(self.consume())
+
+    async def stop(self):
+        'Stop accepting connections and wait for the queued messages to be extracted'
+        if self.server:
+            self.server.close()
+            await self.server.wait_closed()
+        if self.queue:
+            await self.queue.join()
+
+    async def handle_client(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        """
+        Reads MLLP frames from one connection, queues each message for extraction and ACKs it.
+
+        Frames larger than `frame_limit` are skipped and rejected (AR), a frame cut off by the
+        sender closing the connection gets an error (AE) and a message without MSH is rejected.
+        """
+        peer = writer.get_extra_info('peername')
+        try:
+            while True:
+                try:
+                    frame = await reader.readuntil(END_BLOCK)
+                except asyncio.LimitOverrunError:
+                    logging.warning(f'Rejected MLLP frame over {self.frame_limit} bytes from {peer}')
+                    await self.discard_frame(reader)
+                    await self.send_ack(writer, HL7_Message(''), 'AR')
+                    continue
+                except asyncio.IncompleteReadError as e:
+                    if e.partial.strip():
+                        logging.warning(f'Connection from {peer} closed in the middle of an MLLP frame')
+                        await self.send_ack(writer, HL7_Message(''), 'AE')
+                    break
+                text = frame[:-len(END_BLOCK)].lstrip(START_BLOCK).decode('utf-8', errors='replace')
+                msg = HL7_Message(text)
+                if 'MSH' in msg:
+                    # only acknowledge once the message is safely queued
+                    await self.queue.put(msg)
+                    self.received += 1
+                    await self.send_ack(writer, msg, 'AA')
+                else:
+                    logging.info(f'Rejected message without MSH from {peer}')
+                    await self.send_ack(writer, msg, 'AR')
+        except (asyncio.IncompleteReadError, ConnectionError):
+            logging.info(f'Connection from {peer} lost')
+        finally:
+            writer.close()
+
+    @staticmethod
+    async def discard_frame(reader: asyncio.StreamReader):
+        'Skip the rest of an oversized frame, up to and including its end block'
+        while True:
+            try:
+                await reader.readuntil(END_BLOCK)
+                return
+            except asyncio.LimitOverrunError as e:
+                await reader.readexactly(e.consumed)
+
+    @staticmethod
+    async def send_ack(writer: asyncio.StreamWriter, msg: HL7_Message, code: str):
+        'Frame and send the ACK (or NAK) of a message'
+        writer.write(mllp_frame(build_ack(msg, code)))
+        await writer.drain()
+
+    async def consume(self):
+        'Extract the validation fields of queued messages as they arrive'
+        while True:
+            msg = await self.queue.get()
+            try:
+                for key in msg.indices('OBX'):
+                    hl7_values, hl7_section_label = self.extract_fields(msg, key)
+                    accession = hl7_values[hl7_section_label.index('SPM-2')]
+                    if self.on_record:
+                        self.on_record(accession, msg.field(key, 3), hl7_values, hl7_section_label)
+            except Exception as e:
+                logging.exception(f'Could not extract message {msg["MSH-10"]}: {e}')
+            finally:
+                self.queue.task_done()
+
+
+async def send_mllp(host: str, port: int, messages: Iterable[str]) -> List[str]:
+    """
+    Sends HL7 messages over one MLLP connection, waiting for the ACK of each message.
+
+    Parameters:
+        host (str): The listener host.
+        port (int): The listener port.
+        messages (iterable): The HL7 messages to send.
+
+    Returns:
+        list: The ACK messages received, one per message sent.
+    """
+    reader, writer = await asyncio.open_connection(host, port)
+    acks = []
+    try:
+        for text in messages:
+            writer.write(mllp_frame(text))
+            await writer.drain()
+            frame = await reader.readuntil(END_BLOCK)
+            acks.append(frame[:-len(END_BLOCK)].lstrip(START_BLOCK).decode('utf-8', errors='replace'))
+    finally:
+        writer.close()
+        await writer.wait_closed()
+    return acks
+
+
+class CSV_Writer:
+    """
+    An on_record callback that appends every record as a row of a CSV file. Close it (or use
+    it as a context manager) when the listener stops.
+    """
+
+    def __init__(self, path: str):
+        self.output = open(path, 'a', newline='', encoding='utf-8')
+        self.writer = csv.writer(self.output)
+        if self.output.tell() == 0:
+            self.writer.writerow(['Accession', 'Resulted Test'] + HL7_SECTION_LABELS)
+
+    def __call__(self, accession, resultTest, hl7_values, hl7_section_label):
+        self.writer.writerow([accession, resultTest] + list(hl7_values))
+        self.output.flush()
+
+    def close(self):
+        self.output.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+def csv_writer(path: str) -> CSV_Writer:
+    """
+    Returns an on_record callback that appends every record as a row of a CSV file.
+    """
+    return CSV_Writer(path)
+
+
+async def listen(host: str, port: int, output: str):
+    with csv_writer(output) as on_record:
+        listener = MLLP_Listener(host=host, port=port, on_record=on_record)
+        await listener.start()
+        print(f'Listening for HL7 on {host}:{listener.port}, writing records to {output} (Ctrl+C to stop)')
+        async with listener.server:
+            await listener.server.serve_forever()
+
+
+def main():
+    # Set up logging configuration
+    logging.basicConfig(filename='Log_Info.log', level=logging.INFO, format='%(asctime)s:%(levelname)s:%(message)s')
+
+    parser = argparse.ArgumentParser(description='Receive (or send) HL7 messages over MLLP')
+    parser.add_argument('mode', choices=['listen', 'send'])
+    parser.add_argument('files', nargs='*', help='HL7 batch files to send')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=2575)
+    parser.add_argument('--output', default='mllp_records.csv', help='CSV file the listener appends records to')
+    args = parser.parse_args()
+
+    if args.mode == 'listen':
+        try:
+            asyncio.run(listen(args.host, args.port, args.output))
+        except KeyboardInterrupt:
+            logging.info('MLLP listener stopped')
+    else:
+        messages = (text for path in args.files for text in iter_hl7_messages(path))
+        acks = asyncio.run(send_mllp(args.host, args.port, messages))
+        print(f'Sent {len(acks)} messages, {sum("|AA|" in ack for ack in acks)} accepted')
+
+if __name__=="__main__":
+    sys.exit(main())
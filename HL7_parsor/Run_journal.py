@@ -0,0 +1,181 @@
+"""
+    Purpose:
+    The `Run_Journal` class records the progress of a validation run in a SQLite file, so a run
+    that stopped part way (a Chrome crash at case 250 of 400) can be restarted for the same lab
+    and date range and continue where it stopped. The run keeps the path of its IMM export, so a
+    resumed run reads the saved workbook instead of exporting again, and every case keeps its
+    status and summary report.
+
+    Algorithm:
+    1. `open_run` returns the unfinished run of the lab and date range, or starts a new one.
+    2. The export path and the cases of the export are stored once per run, with a digest of
+       the case list; a different case list (another selection, a changed export) starts a new run.
+    3. Each processed case is recorded as done (with its summary DataFrame) or skipped (the case
+       cannot be validated, e.g. no OBX matches its resulted test). A case whose processing
+       raised is not recorded and stays pending.
+    4. `pending` lists the cases that are neither done nor skipped, so a resumed run retries
+       them; a run is finished once no case is pending, and the next run exports again.
+"""
+
+import io
+import json
+import time
+import hashlib
+import sqlite3
+import threading
+
+import pandas as pd
+
+from typing import List, Optional, Sequence, Tuple
+
+
+def cases_digest(cases: Sequence[Tuple[str, str, int]]) -> str:
+    'SHA-256 of a list of (accession, resulted test, incident id) cases, in order'
+    rows = [[str(acc_num), str(resultTest), int(di_num)] for acc_num, resultTest, di_num in cases]
+    return hashlib.sha256(json.dumps(rows).encode('utf-8')).hexdigest()
+
+
+class Run_Journal:
+
+    def __init__(self, path: str):
+        """
+        Opens (or creates) a run journal.
+
+        Parameters:
+            path (str): The SQLite file, usually inside the lab output directory.
+
+        Returns:
+            None
+        """
+        self.path = path
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.executescript(
+            '''CREATE TABLE IF NOT EXISTS runs (
+                run_id INTEGER PRIMARY KEY AUTOINCREMENT,
+                lab TEXT NOT NULL,
+                from_date TEXT NOT NULL,
+                to_date TEXT NOT NULL,
+                export_path TEXT,
+                cases_digest TEXT,
+                started REAL NOT NULL,
+                finished REAL
+            );
+            CREATE TABLE IF NOT EXISTS cases (
+                run_id INTEGER NOT NULL,
+                position INTEGER NOT NULL,
+                accession TEXT NOT NULL,
+                resulted_test TEXT NOT NULL,
+                incident_id INTEGER NOT NULL,
+                status TEXT NOT NULL DEFAULT 'pending',
+                result TEXT,
+                updated REAL,
+                PRIMARY KEY (run_id, position)
+            );'''
+        )
+        # journals written before the case list digest was kept
+        columns = [row[1] for row in self._conn.execute('PRAGMA table_info(runs)')]
+        if 'cases_digest' not in columns:
+            self._conn.execute('ALTER TABLE runs ADD COLUMN cases_digest TEXT')
+        self._conn.commit()
+
+    def close(self):
+        self._conn.close()
+
+    def open_run(self, lab: str, from_date: str, to_date: str) -> int:
+        'The id of the unfinished run of a lab and date range, a new run when there is none'
+        with self._lock:
+            row = self._conn.execute(
+                'SELECT run_id FROM runs WHERE lab = ? AND from_date = ? AND to_date = ? AND finished IS NULL ORDER BY run_id DESC',
+                (lab, str(from_date), str(to_date))
+            ).fetchone()
+            if row:
+                return row[0]
+            cursor = self._conn.execute(
+                'INSERT INTO runs (lab, from_date, to_date, started) VALUES (?, ?, ?, ?)',
+                (lab, str(from_date), str(to_date), time.time())
+            )
+            self._conn.commit()
+            return cursor.lastrowid
+
+    def export_path(self, run_id: int) -> Optional[str]:
+        'The IMM export the run is working through, None before it was exported'
+        with self._lock:
+            row = self._conn.execute('SELECT export_path FROM runs WHERE run_id = ?', (run_id,)).fetchone()
+        return row[0] if row else None
+
+    def set_export(self, run_id: int, path: str):
+        with self._lock:
+            self._conn.execute('UPDATE runs SET export_path = ? WHERE run_id = ?', (path, run_id))
+            self._conn.commit()
+
+    def add_cases(self, run_id: int, cases: Sequence[Tuple[str, str, int]]) -> int:
+        """
+        Stores the (accession, resulted test, incident id) cases of the run, unless already stored.
+
+        A run only resumes the same case list: when the cases differ from the ones stored (the
+        digest of the list changed), the run is closed and a new run of the same lab, date range
+        and export is started with these cases.
+
+        Returns:
+            int: The id of the run the cases belong to.
+        """
+        digest = cases_digest(cases)
+        with self._lock:
+            lab, from_date, to_date, export_path, stored = self._conn.execute(
+                'SELECT lab, from_date, to_date, export_path, cases_digest FROM runs WHERE run_id = ?', (run_id,)
+            ).fetchone()
+            if stored is not None and stored != digest:
+                now = time.time()
+                self._conn.execute('UPDATE runs SET finished = ? WHERE run_id = ?', (now, run_id))
+                run_id = self._conn.execute(
+                    'INSERT INTO runs (lab, from_date, to_date, export_path, started) VALUES (?, ?, ?, ?, ?)',
+                    (lab, from_date, to_date, export_path, now)
+                ).lastrowid
+            self._conn.execute('UPDATE runs SET cases_digest = ? WHERE run_id = ?', (digest, run_id))
+            self._conn.executemany(
+                'INSERT OR IGNORE INTO cases (run_id, position, accession, resulted_test, incident_id) VALUES (?, ?, ?, ?, ?)',
+                [(run_id, i, str(acc_num), str(resultTest), int(di_num)) for i, (acc_num, resultTest, di_num) in enumerate(cases)]
+            )
+            self._conn.commit()
+        return run_id
+
+    def pending(self, run_id: int) -> List[Tuple[int, Tuple[str, str, int]]]:
+        'The (position, case) of every case that is neither done nor skipped, in export order'
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT position, accession, resulted_test, incident_id FROM cases WHERE run_id = ? AND status NOT IN ('done', 'skipped') ORDER BY position",
+                (run_id,)
+            ).fetchall()
+        return [(position, (acc_num, resultTest, di_num)) for position, acc_num, resultTest, di_num in rows]
+
+    def record(self, run_id: int, position: int, result: Optional[pd.DataFrame]):
+        'Record the summary of a processed case; None marks it skipped, it is not retried'
+        status = 'skipped' if result is None else 'done'
+        text = None if result is None else result.to_json(orient='split')
+        with self._lock:
+            self._conn.execute(
+                'UPDATE cases SET status = ?, result = ?, updated = ? WHERE run_id = ? AND position = ?',
+                (status, text, time.time(), run_id, position)
+            )
+            self._conn.commit()
+
+    def results(self, run_id: int) -> List[Optional[pd.DataFrame]]:
+        'The summary of every case of the run in export order, None for cases that are not done'
+        with self._lock:
+            rows = self._conn.execute(
+                'SELECT status, result FROM cases WHERE run_id = ? ORDER BY position', (run_id,)
+            ).fetchall()
+        return [pd.read_json(io.StringIO(text), orient='split', dtype=False, convert_dates=False) if status == 'done' else None for status, text in rows]
+
+    def finish(self, run_id: int) -> bool:
+        'Mark the run finished when every case is done or skipped; pending cases keep it open for a rerun'
+        with self._lock:
+            left = self._conn.execute(
+                "SELECT COUNT(*) FROM cases WHERE run_id = ? AND status NOT IN ('done', 'skipped')", (run_id,)
+            ).fetchone()[0]
+            if left:
+                return False
+            self._conn.execute('UPDATE runs SET finished = ? WHERE run_id = ?', (time.time(), run_id))
+            self._conn.commit()
+        return True
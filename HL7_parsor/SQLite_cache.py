@@ -0,0 +1,67 @@
+"""
+    Purpose:
+    The `SQLite_TTL_Cache` class is the common part of the SQLite caches of a run (the HL7
+    message, Disease Incident and locator caches): the connection shared by the browser
+    sessions of a run, the lock around it, the expiry of entries after a TTL and the clock that
+    expiry is measured with. A subclass declares its tables and handles its own keys.
+
+    Algorithm:
+    1. Connect to the SQLite file (or memory) and create the tables of the subclass.
+    2. When the subclass names an `expiring` table, index its `stored` column and delete the
+       expired entries at open; subclasses call `_purge` again when they store an entry.
+    3. Lookups only return entries stored after `cutoff()`, so they never write.
+"""
+
+import time
+import sqlite3
+import threading
+
+from typing import Callable, Optional, Sequence
+
+
+class SQLite_TTL_Cache:
+
+    # CREATE statements of the subclass tables
+    schema: Sequence[str] = ()
+    # table whose entries expire by their `stored` time, None when the subclass expires its own
+    expiring: Optional[str] = None
+
+    def __init__(self, path: Optional[str], ttl: float, clock: Callable[[], float] = time.time):
+        """
+        Opens (or creates) the cache.
+
+        Parameters:
+            path (str): The SQLite file, usually inside the lab output folder; None keeps the
+                cache in memory for this run only.
+            ttl (float): Seconds an entry stays valid.
+            clock (callable): Returns the current time in seconds, time.time unless testing.
+
+        Returns:
+            None
+        """
+        self.path = path
+        self.ttl = ttl
+        self.clock = clock
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path or ':memory:', check_same_thread=False)
+        for statement in self.schema:
+            self._conn.execute(statement)
+        if self.expiring:
+            self._conn.execute(f'CREATE INDEX IF NOT EXISTS {self.expiring}_stored ON {self.expiring} (stored)')
+            self._purge()
+        self._conn.commit()
+
+    def close(self):
+        self._conn.close()
+
+    def cutoff(self) -> float:
+        'Entries stored before this time have expired'
+        return self.clock() - self.ttl
+
+    def _purge(self):
+        'Delete the expired entries; callers hold the lock (or are opening the cache) and commit'
+        self._conn.execute(f'DELETE FROM {self.expiring} WHERE stored < ?', (self.cutoff(),))
+
+    def __len__(self):
+        with self._lock:
+            return self._conn.execute(f'SELECT COUNT(*) FROM {self.expiring}').fetchone()[0]
@@ -0,0 +1,170 @@
+"""
+    Purpose:
+    The `Session_Pool` class runs the per-case work of a validation run (IMM search,
+    `data_wrangling`, `webTST_scrape` and the report) over several logged-in browser sessions
+    at once. Each session works through the shared case list on its own thread, and the
+    results come back in the original case order.
+
+    Algorithm:
+    1. Log in the browser sessions in parallel (re-using any session that is already logged in).
+    2. Put every case, with its position, on a shared queue.
+    3. Each session takes the next case from the queue until it is empty, so slow cases do
+       not hold up a fixed shard.
+    4. When the session fails (a WebDriverException of the browser, or a WebCMR_Error or
+       requests exception of the HTTP backend), its case goes back on the queue for the other sessions (up to `max_attempts` tries per case) and the session
+       logs in again, or stops once it used up its `relogins`.
+    5. Store each result at its case position, then close the sessions the pool opened.
+"""
+
+import queue
+import logging
+import requests
+import threading
+
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, List, Optional, Sequence
+from selenium.common.exceptions import WebDriverException
+from WebCMR_http import WebCMR_Error
+
+
+# failures of the session rather than of the case, for the chrome and the http backend
+SESSION_ERRORS = (WebDriverException, WebCMR_Error, requests.RequestException)
+
+
+class Session_Pool:
+
+    def __init__(
+        self,
+        login: Callable[[], Any],
+        size: int,
+        drivers: Optional[List[Any]] = None,
+        max_attempts: int = 3,
+        relogins: int = 1
+        ):
+        """
+        Initializes a new instance of the class.
+
+        Parameters:
+            login (callable): Opens and logs in a new browser session, e.g. `SetUp.login`.
+            size (int): Number of browser sessions to run.
+            drivers (list, optional): Sessions that are already logged in and should be used
+                as part of the pool. They are left open when the pool is done.
+            max_attempts (int): Times a case is tried when browsers fail on it.
+            relogins (int): Times a session whose browser failed logs in again before it stops.
+
+        Returns:
+            None
+        """
+        self.login = login
+        self.size = max(1, int(size))
+        self.drivers = list(drivers or [])[:self.size]
+        self.max_attempts = max(1, int(max_attempts))
+        self.relogins = max(0, int(relogins))
+        self._owned: List[Any] = []
+        self._lock = threading.Lock()
+
+    def open(self):
+        'Log in the missing sessions in parallel'
+        missing = self.size - len(self.drivers)
+        if missing <= 0:
+            return
+        logging.info(f'Logging in {missing} browser sessions')
+        with ThreadPoolExecutor(max_workers=missing) as executor:
+            new_drivers = list(executor.map(lambda _: self.login(), range(missing)))
+        self._owned.extend(new_drivers)
+        self.drivers.extend(new_drivers)
+
+    def replace(self, driver):
+        'Log in a new session in place of a failed one; None when that fails too'
+        if driver in self._owned:
+            try:
+                driver.quit()
+            except Exception as e:
+                logging.info(f'Could not quit failed browser session: {e}')
+        try:
+            new_driver = self.login()
+        except Exception as e:
+            logging.exception(f'Could not log in a new browser session: {e}')
+            return None
+        with self._lock:
+            if driver in self._owned:
+                self._owned.remove(driver)
+            self._owned.append(new_driver)
+        return new_driver
+
+    def close(self):
+        'Quit the sessions the pool logged in'
+        for driver in self._owned:
+            try:
+                driver.quit()
+            except Exception as e:
+                logging.info(f'Could not quit browser session: {e}')
+        self.drivers = [driver for driver in self.drivers if driver not in self._owned]
+        self._owned = []
+
+    def run(self, cases: Sequence[Any], work: Callable[[Any, Any], Any]) -> List[Any]:
+        """
+        Runs `work(driver, case)` for every case over the pooled sessions.
+
+        Parameters:
+            cases (list): The cases to process.
+            work (callable): Processes one case with one browser session.
+
+        Returns:
+            list: The result of every case in the original order, None for cases whose work
+            raised (the exception is logged) or that no working session was left for.
+        """
+        self.open()
+        results: List[Any] = [None] * len(cases)
+        attempts = [0] * len(cases)
+        todo: queue.Queue = queue.Queue()
+        for i, case in enumerate(cases):
+            todo.put((i, case))
+        # cases taken but not finished; a session only stops when none is left that could
+        # come back on the queue
+        in_flight = [0]
+
+        def session(driver):
+            relogins = self.relogins
+            while True:
+                try:
+                    i, case = todo.get(timeout=0.05)
+                except queue.Empty:
+                    with self._lock:
+                        if in_flight[0] == 0:
+                            return
+                    continue
+                with self._lock:
+                    in_flight[0] += 1
+                    attempts[i] += 1
+                logging.info(f'[{threading.current_thread().name}] case #: {i}')
+                try:
+                    results[i] = work(driver, case)
+                except SESSION_ERRORS as e:
+                    # the session failed, not the case: hand the case to another session
+                    logging.exception(f'Case #{i} failed on a broken session: {e}')
+                    if attempts[i] < self.max_attempts:
+                        todo.put((i, case))
+                    if relogins > 0:
+                        relogins -= 1
+                        driver = self.replace(driver)
+                    else:
+                        driver = None
+                    if driver is None:
+                        logging.info(f'[{threading.current_thread().name}] stopping')
+                        return
+                except Exception as e:
+                    logging.exception(f'Case #{i} failed: {e}')
+                finally:
+                    with self._lock:
+                        in_flight[0] -= 1
+
+        try:
+            with ThreadPoolExecutor(max_workers=len(self.drivers), thread_name_prefix='session') as executor:
+                list(executor.map(session, self.drivers))
+        finally:
+            self.close()
+        left = todo.qsize()
+        if left:
+            logging.error(f'{left} cases were not processed, no working browser session was left')
+        return results
@@ -5,19 +5,63 @@ on a website.
 
 Algorithm:
 1. The __init__ method initializes the SetUp object with the provided username, password, start date, end date, and an optional URL parameter.
-2. The login method logs into a website using the provided username and password, and returns a WebDriver object.
+2. The login method launches Chrome with the run's launch profile ('full' is a normal headed browser, 'lean' a
+   headless one that does not load images, fonts or style sheets), logs in with the provided username and password,
+   and returns a WebDriver object.
 3. The date_range method inputs the date range in the provided WebDriver object.
 """
 
-import time
-import os 
-
 from selenium import webdriver
 from selenium.webdriver.chrome.service import Service as ChromeService
 from selenium.webdriver.common.keys import Keys
-from selenium.webdriver.support.ui import WebDriverWait
 from selenium.webdriver.support import expected_conditions as EC
 from selenium.webdriver.common.by import By
+from Wait_timing import Wait_Timer
+
+
+# Launch profiles of SetUp.login
+LAUNCH_PROFILES = ('full', 'lean')
+
+# Requests the lean profile blocks: images, fonts and style sheets are not needed to read the pages
+LEAN_BLOCKED_URLS = [
+    '*.png', '*.jpg', '*.jpeg', '*.gif', '*.bmp', '*.ico', '*.svg', '*.webp',
+    '*.woff', '*.woff2', '*.ttf', '*.otf', '*.eot',
+    '*.css',
+]
+
+LEAN_ARGUMENTS = [
+    '--headless=new',
+    '--window-size=1366,900',
+    '--disable-extensions',
+    '--disable-background-networking',
+    '--disable-component-update',
+    '--disable-default-apps',
+    '--disable-sync',
+    '--no-first-run',
+    '--mute-audio',
+]
+
+
+def chrome_options(profile='full'):
+    """
+    Chrome options of a launch profile.
+
+    :param profile: 'full' for a normal headed browser, 'lean' for an unattended headless one.
+    :return: The ChromeOptions to start the driver with.
+    """
+    if profile not in LAUNCH_PROFILES:
+        raise ValueError(f'Unknown launch profile {profile}, expected one of {LAUNCH_PROFILES}')
+    options = webdriver.ChromeOptions()
+    if profile == 'lean':
+        for argument in LEAN_ARGUMENTS:
+            options.add_argument(argument)
+        # return once the DOM is ready instead of waiting for every sub-resource
+        options.page_load_strategy = 'eager'
+        options.add_experimental_option('prefs', {
+            'profile.managed_default_content_settings.images': 2,
+            'profile.default_content_setting_values.notifications': 2,
+        })
+    return options
 
 
 class SetUp:
@@ -27,13 +71,15 @@ class SetUp:
         paswrd, 
         FromDate, 
         ToDate,
-        url = 'https://test-sdcounty.atlasph.com/TSTWebCMR/pages/login/login.aspx'
+        url = 'https://test-sdcounty.atlasph.com/TSTWebCMR/pages/login/login.aspx',
+        launch_profile = 'full'
         ):
         self.url = url 
         self.username = username
         self.paswrd = paswrd
         self.fromDate = FromDate
         self.toDate = ToDate
+        self.launch_profile = launch_profile
 
 
     def login(self): 
@@ -44,25 +90,35 @@ class SetUp:
             :rtype: WebDriver
         """
 
-        # create chrome webdriver object with the above options
+        # create chrome webdriver object with the options of the launch profile
         service = ChromeService(executable_path="chromedriver.exe")
-        driver = webdriver.Chrome(service=service)
+        driver = webdriver.Chrome(service=service, options=chrome_options(self.launch_profile))
+        if self.launch_profile == 'lean':
+            # intercepting the requests for images, fonts and style sheets
+            driver.execute_cdp_cmd('Network.enable', {})
+            driver.execute_cdp_cmd('Network.setBlockedURLs', {'urls': LEAN_BLOCKED_URLS})
 
         # go to TST website
         driver.get(self.url)
 
         # Find the username and password elements and enter login credentials
-        # time.sleep(30)
-        wait = WebDriverWait(driver, 30)
-        username = wait.until(EC.presence_of_element_located((By.XPATH, '//*[@id="txtUsername"]')))
+        username = self.wait_timer.until(driver, 'page:login', EC.presence_of_element_located((By.XPATH, '//*[@id="txtUsername"]')),
+                                         default=30)
         username.send_keys(self.username)
 
-        password = wait.until(EC.presence_of_element_located((By.XPATH, '//*[@id="txtPassword"]')))
+        password = driver.find_element(By.XPATH, '//*[@id="txtPassword"]')
         password.send_keys(self.paswrd)
         password.send_keys(Keys.RETURN)
         
         return driver
 
+    @property
+    def wait_timer(self):
+        'The Wait_Timer of this run, shared by its browser sessions'
+        if getattr(self, '_wait_timer', None) is None:
+            self._wait_timer = Wait_Timer()
+        return self._wait_timer
+
     def date_range(self,driver): 
         """
         Input the date range in the provided driver object.
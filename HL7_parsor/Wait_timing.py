@@ -0,0 +1,118 @@
+"""
+    Purpose:
+    The `Wait_Timer` class replaces the fixed WebDriverWait timeouts with timeouts learned
+    from how long each page and element actually takes to show up. Latencies are kept per key
+    (e.g. 'element:txtAccession' or 'page:imm') in a rolling window, and the timeout of a wait
+    is the window's 99th percentile with a safety margin, kept between a lower and upper bound.
+    Element waits get a higher lower bound than page waits, as a field that is slow to render
+    should not be mistaken for a missing one.
+
+    Algorithm:
+    1. Until a key has `min_samples` latencies its waits use the default timeout of the call.
+    2. Every wait that succeeds records how long it took. A wait that timed out with a learned
+       timeout shorter than the default records that timeout, so a slow environment pushes its
+       timeout back up; a wait that timed out after the full default records nothing, so a
+       lookup that is expected to miss never grows the timeout past default * margin.
+    3. The timeout is p99 * margin, bounded to [lower, upper] ([element_lower, upper] for
+       'element:' keys).
+"""
+
+import math
+import time
+import threading
+
+from collections import deque
+from typing import Callable, Deque, Dict
+from selenium.webdriver.support.wait import WebDriverWait
+from selenium.common.exceptions import TimeoutException
+
+
+class Wait_Timer:
+
+    def __init__(
+        self,
+        lower: float = 0.25,
+        element_lower: float = 0.5,
+        upper: float = 60,
+        margin: float = 1.5,
+        window: int = 200,
+        min_samples: int = 5,
+        poll_frequency: float = 0.1
+        ):
+        """
+        Initializes a new instance of the class.
+
+        Parameters:
+            lower (float): Shortest timeout a learned page wait gets, in seconds.
+            element_lower (float): Shortest timeout a learned element wait gets, in seconds.
+            upper (float): Longest timeout a learned wait gets, in seconds.
+            margin (float): Factor applied to the p99 latency.
+            window (int): Number of latencies kept per key.
+            min_samples (int): Latencies needed before the timeout of a key is learned.
+            poll_frequency (float): Seconds between checks of a wait condition.
+
+        Returns:
+            None
+        """
+        self.lower = lower
+        self.element_lower = element_lower
+        self.upper = upper
+        self.margin = margin
+        self.window = window
+        self.min_samples = min_samples
+        self.poll_frequency = poll_frequency
+        self._lock = threading.Lock()
+        self._latencies: Dict[str, Deque[float]] = {}
+
+    def record(self, key: str, seconds: float):
+        'Record how long a page or element took'
+        with self._lock:
+            self._latencies.setdefault(key, deque(maxlen=self.window)).append(seconds)
+
+    def percentile(self, key: str, q: float = 99) -> float:
+        'The q-th percentile latency of a key (nearest rank), nan without samples'
+        with self._lock:
+            samples = sorted(self._latencies.get(key, ()))
+        if not samples:
+            return math.nan
+        return samples[max(0, math.ceil(q / 100 * len(samples)) - 1)]
+
+    def timeout(self, key: str, default: float) -> float:
+        'The timeout of a wait: the learned p99 with margin and bounds, else the default'
+        if not self.learned(key):
+            return default
+        lower = self.element_lower if key.startswith('element:') else self.lower
+        return min(self.upper, max(lower, self.percentile(key) * self.margin))
+
+    def learned(self, key: str) -> bool:
+        'Whether a key has enough latencies for its timeout to be learned'
+        with self._lock:
+            return len(self._latencies.get(key, ())) >= self.min_samples
+
+    def until(self, driver, key: str, condition: Callable, default: float):
+        """
+        Waits for a condition with the learned timeout of a key and records the latency.
+
+        Args:
+            driver: The driver used to interact with the web page.
+            key: The page or element being waited for.
+            condition: An expected condition, called with the driver.
+            default: Timeout in seconds until the key has been learned, also the largest
+                timeout a timed out wait is recorded for.
+
+        Returns:
+            The value returned by the condition.
+
+        Raises:
+            TimeoutException: If the condition was not met in time.
+        """
+        timeout = self.timeout(key, default)
+        start = time.monotonic()
+        try:
+            result = WebDriverWait(driver, timeout, poll_frequency=self.poll_frequency).until(condition)
+        except TimeoutException:
+            if timeout < default:
+                self.record(key, timeout)
+            raise
+        self.record(key, time.monotonic() - start)
+        return result
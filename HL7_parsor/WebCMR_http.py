@@ -0,0 +1,294 @@
+"""
+    Purpose:
+    The `WebCMR_Session` class does what `IMM` and `DI_Search` do with Chrome (login, IMM search,
+    export, reading the HL7 text of a message and reading Disease Incident fields) over plain
+    HTTP. TST WebCMR is an ASP.NET WebForms application, so every button click is a form post
+    of the page's fields, including the hidden `__VIEWSTATE` / `__EVENTVALIDATION` state, which
+    this class replays on a keep-alive `requests` session and parses with lxml.
+
+    Algorithm:
+    1. GET the login page and post the username and password with its form state.
+    2. Keep the last page received; a postback posts every field of its form (as a browser
+       would), the fields set by the caller and the clicked button or `__EVENTTARGET`.
+    3. IMM searches post the search fields to the IMM page; the HL7 text is read from
+       `divContentsArea` and the export is downloaded from the export dialog's frame.
+    4. Disease Incidents are opened by their url (learned by a browser run) or by the home page
+       search; fields are read from the page by id with xpath fallbacks.
+"""
+
+import os
+import re
+import logging
+
+import requests
+import lxml.html
+import lxml.etree
+
+from typing import Dict, Iterable, Optional
+from urllib.parse import urljoin
+from requests.adapters import HTTPAdapter
+from DI_snapshot import Field_Extractor
+from Export_reader import EXPORT_FORMATS
+
+
+# javascript:__doPostBack('target','argument') links
+POSTBACK_PATTERN = re.compile(r"__doPostBack\('([^']*)','([^']*)'\)")
+FILENAME_PATTERN = re.compile(r'filename\*?=(?:UTF-8\'\')?"?([^";]+)"?', re.IGNORECASE)
+
+# elements whose text starts on a new line when rendered
+BLOCK_TAGS = {'br', 'div', 'p', 'tr', 'li', 'table'}
+
+
+class WebCMR_Error(Exception):
+    'A WebCMR page did not have what the operation needed'
+
+
+class WebCMR_Session:
+
+    def __init__(
+        self,
+        url: str,
+        username: str,
+        paswrd: str,
+        imm_url: Optional[str] = None,
+        pool_size: int = 4,
+        timeout: float = 60
+        ):
+        """
+        Initializes a new instance of the class.
+
+        Parameters:
+            url (str): The WebCMR login page.
+            username (str): TST username.
+            paswrd (str): TST password.
+            imm_url (str, optional): The Incoming Message Monitor page, e.g. the url a browser
+                run learned for it.
+            pool_size (int): Number of keep-alive connections kept per host.
+            timeout (float): Seconds to wait for a response.
+
+        Returns:
+            None
+        """
+        self.url = url
+        self.username = username
+        self.paswrd = paswrd
+        self.imm_url = imm_url
+        self.timeout = timeout
+        self.home_url: Optional[str] = None
+        self.page = None
+        self.page_url: Optional[str] = None
+        self.http = requests.Session()
+        adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size)
+        self.http.mount('http://', adapter)
+        self.http.mount('https://', adapter)
+
+    # ----- requests ----------------------------------------------------------
+
+    def get(self, url: str):
+        'GET a page and make it the current page'
+        return self._load(self.http.get(url, timeout=self.timeout))
+
+    def postback(
+        self,
+        button: Optional[str] = None,
+        button_xpaths: Iterable[str] = (),
+        fields: Optional[Dict[str, str]] = None,
+        event_target: str = '',
+        event_argument: str = '',
+        load: bool = True
+        ):
+        """
+        Posts the form of the current page back, as a browser does when a control is used.
+
+        Args:
+            button (str, optional): ID of the clicked submit or image button. Without a button
+                or event target, the first submit button of the form is sent, as browsers do
+                when Enter is pressed in a text box.
+            button_xpaths (list): Fallback xpaths of the button.
+            fields (dict, optional): Field values to set, keyed by element id or name.
+            event_target (str): `__EVENTTARGET` of a link or auto-postback control.
+            event_argument (str): `__EVENTARGUMENT` of the event.
+            load (bool): Make the response the current page. Turned off for file downloads.
+
+        Returns:
+            requests.Response: The response of the post.
+        """
+        form = self._form()
+        data = dict(form.form_values())
+        for key, value in (fields or {}).items():
+            data[self.field_name(key)] = value
+        if event_target:
+            data['__EVENTTARGET'] = event_target
+            data['__EVENTARGUMENT'] = event_argument
+        if button:
+            element = self.element(button, button_xpaths)
+            if element is None:
+                raise WebCMR_Error(f'Button {button} not on {self.page_url}')
+        elif not event_target:
+            submits = form.xpath('.//input[@type="submit" or @type="image"]')
+            element = submits[0] if submits else None
+        else:
+            element = None
+        if element is not None:
+            name = element.get('name', element.get('id'))
+            if element.get('type', '').lower() == 'image':
+                data[f'{name}.x'], data[f'{name}.y'] = '1', '1'
+            else:
+                data[name] = element.get('value', '')
+        action = urljoin(self.page_url, form.get('action') or self.page_url)
+        response = self.http.post(action, data=data, timeout=self.timeout)
+        return self._load(response) if load else response
+
+    def _load(self, response):
+        response.raise_for_status()
+        self.page_url = response.url
+        self.page = lxml.html.fromstring(response.content, base_url=response.url)
+        return response
+
+    def _form(self):
+        forms = self.page.forms if self.page is not None else []
+        if not forms:
+            raise WebCMR_Error(f'No form on {self.page_url}')
+        return forms[0]
+
+    # ----- reading pages -----------------------------------------------------
+
+    def element(self, key: str, xpaths: Iterable[str] = ()):
+        'The element of the current page with an id (or name), else the first xpath fallback that matches'
+        matches = self.page.xpath('//*[@id=$key]', key=key) or self.page.xpath('//*[@name=$key]', key=key)
+        for xpath in xpaths:
+            if matches:
+                break
+            try:
+                matches = self.page.xpath(xpath)
+            except lxml.etree.XPathError:
+                continue
+        return matches[0] if matches else None
+
+    def field_name(self, key: str) -> str:
+        'The posted name of a field given by id (ASP.NET names use $ where ids use _)'
+        element = self.element(key)
+        return element.get('name', key) if element is not None else key
+
+    def read_fields(self, fields: Iterable[dict]) -> Dict[str, Optional[str]]:
+        """
+        Reads field specs (see DI_Incident.DEMOGRAPHIC_FIELDS) from the current page.
+
+        Returns:
+            dict: The value of text boxes, or the selected option text of dropdowns, keyed by the
+            field 'key'; None for fields that are not on the page.
+        """
+        return Field_Extractor(fields).extract(self.page)
+
+    def text(self, element_id: str) -> str:
+        'The rendered text of an element of the current page, with block elements on their own lines'
+        element = self.element(element_id)
+        if element is None:
+            raise WebCMR_Error(f'{element_id} not on {self.page_url}')
+        for child in element.iter(*BLOCK_TAGS):
+            child.tail = '\n' + (child.tail or '')
+        return '\n'.join(line.strip() for line in element.text_content().splitlines() if line.strip())
+
+    # ----- WebCMR operations ---------------------------------------------------
+
+    def login(self):
+        'Log in and keep the home page; returns the session so it can be used as a pool login'
+        self.get(self.url)
+        self.postback(fields={'txtUsername': self.username, 'txtPassword': self.paswrd})
+        if self.element('txtPassword') is not None:
+            raise WebCMR_Error('Login failed, the login page came back')
+        self.home_url = self.page_url
+        return self
+
+    def quit(self):
+        'Close the pooled connections'
+        self.http.close()
+
+    def imm_search(self, lab: Optional[str] = None, from_date: str = '', to_date: str = '', **fields):
+        """
+        Opens the Incoming Message Monitor and posts a search.
+
+        Args:
+            lab (str, optional): Visible text of the laboratory to select in `ddlLaboratory`.
+            from_date (str): Value for `txtFromDate`.
+            to_date (str): Value for `txtToDate`.
+            fields: Other search fields by id, e.g. txtAccession='ACC123'.
+        """
+        if not self.imm_url:
+            raise WebCMR_Error('The Incoming Message Monitor url is not known, run once with the chrome backend')
+        self.get(self.imm_url)
+        search = dict(fields)
+        if from_date or to_date:
+            search.update(txtFromDate=from_date, txtToDate=to_date)
+        if lab:
+            select = self.element('ddlLaboratory')
+            options = select.xpath('.//option') if select is not None else []
+            values = [option.get('value', option.text_content()) for option in options if option.text_content().strip() == lab]
+            if not values:
+                raise WebCMR_Error(f'Laboratory {lab} not in ddlLaboratory')
+            search['ddlLaboratory'] = values[0]
+        self.postback(button='ibtnSearch', fields=search)
+
+    def export(self, folder: str, export_format: str = 'excel') -> str:
+        """
+        Exports the results of the last IMM search.
+
+        Args:
+            folder (str): Folder the export is saved in.
+            export_format (str): 'csv', 'xml' or 'excel' (see Export_reader.EXPORT_FORMATS).
+
+        Returns:
+            str: Path of the saved export.
+        """
+        self.postback(button='btnExport_btnExport')
+        frames = self.page.xpath('//iframe/@src')
+        if not frames:
+            raise WebCMR_Error('The export dialog did not open')
+        self.get(urljoin(self.page_url, frames[0]))
+
+        # select all columns and the export format
+        format_id, suffixes = EXPORT_FORMATS[export_format]
+        fields = {}
+        select_all = self.element('clstAll_0')
+        if select_all is not None:
+            fields[select_all.get('name')] = select_all.get('value', 'on')
+        option = self.element(format_id)
+        if option is None:
+            raise WebCMR_Error(f'No {export_format} option in the export dialog')
+        fields[option.get('name')] = option.get('value')
+        response = self.postback(button='btnExport', fields=fields, load=False)
+        response.raise_for_status()
+
+        match = FILENAME_PATTERN.search(response.headers.get('Content-Disposition', ''))
+        filename = os.path.basename(match.group(1)) if match else f'IMM_Export{suffixes[0]}'
+        path = os.path.join(folder, filename)
+        with open(path, 'wb') as output:
+            output.write(response.content)
+        logging.info(f'Exported IMM search to {path}')
+        return path
+
+    def hl7_text(self, acc_num: str, resultTest: str) -> str:
+        'The HL7 text the IMM shows for an accession number and resulted test'
+        self.imm_search(txtAccession=str(acc_num), txtResultedTest=resultTest)
+        return self.text('divContentsArea')
+
+    def open_incident(self, di_num: int, url: Optional[str] = None):
+        """
+        Opens a Disease Incident, by its url when one is given, else through the home page search.
+        """
+        if url:
+            self.get(url)
+            if self.element('txtLastName') is not None:
+                return
+            logging.info(f'Disease Incident url did not load, searching for {di_num}')
+        self.get(self.home_url or self.url)
+        self.postback(fields={'txtFindDisInc': str(di_num)})
+        links = [link for link in self.page.xpath('//a') if link.text_content().strip() == str(di_num)]
+        if not links:
+            raise WebCMR_Error(f'Disease Incident {di_num} not found')
+        href = links[0].get('href', '')
+        postback = POSTBACK_PATTERN.search(href)
+        if postback:
+            self.postback(event_target=postback.group(1), event_argument=postback.group(2))
+        else:
+            self.get(urljoin(self.page_url, href))
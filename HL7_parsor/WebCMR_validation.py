@@ -22,7 +22,11 @@
 import sys
 
 import logging
+import argparse
+import requests
 from HL7 import HL7_extraction
+from WebCMR_http import WebCMR_Error
+from Case_selection import CASE_SELECTIONS
 from selenium.common.exceptions import (
     NoSuchElementException, 
     StaleElementReferenceException,
@@ -36,6 +40,14 @@ def main():
     # Set up logging configuration
     logging.basicConfig(filename='Log_Info.log', level=logging.INFO, format='%(asctime)s:%(levelname)s:%(message)s')
 
+    # Optional run settings
+    parser = argparse.ArgumentParser(description='TST WebCMR validation with HL7 messages')
+    parser.add_argument('--sessions', type=int, default=1, help='number of browser sessions to validate cases with')
+    parser.add_argument('--profile', choices=['full', 'lean'], default='full', help="Chrome launch profile, 'lean' runs headless without images, fonts or style sheets")
+    parser.add_argument('--backend', choices=['chrome', 'http'], default='chrome', help='drive Chrome, or replay the WebCMR pages over HTTP without a browser')
+    parser.add_argument('--selection', choices=list(CASE_SELECTIONS), default='last_row', help="how cases are picked from the export, 'set_cover' covers every test and classification with the fewest accessions")
+    args = parser.parse_args()
+
     # Prompt the user for input
     username = input("Please enter your TST username: ")
     password = input("Please enter your password: ")
@@ -52,6 +64,10 @@ def main():
         START_DATE : {FromDate}
         END_DATE : {EndDate}
         LAB_NAME : {LabName}
+        SESSIONS : {args.sessions}
+        BACKEND : {args.backend}
+        PROFILE : {args.profile}
+        SELECTION : {args.selection}
         -----------------------------
         '''
     )
@@ -66,11 +82,13 @@ def main():
             paswrd=password,
             FromDate=FromDate,
             ToDate=EndDate,
-            LabName=LabName
+            LabName=LabName,
+            launch_profile=args.profile
         )
+        report.case_selection = args.selection
 
         # Copy the HL7 report
-        di = report.hl7_copy()
+        di = report.hl7_copy(sessions=args.sessions, backend=args.backend)
 
     except NoSuchElementException as ne:
         # Log the exception and prompt the user to check the log
@@ -90,6 +108,14 @@ def main():
     except WebDriverException as sessionIncompatible:
         # Log the exception related to session compatibility
         logging.exception("Incompatibility with Chromedriver and Chromebrowser: %s", sessionIncompatible)
+    except WebCMR_Error as pageError:
+        # Log the exception raised when a WebCMR page of the http backend is not as expected
+        logging.exception("An error occurred on a WebCMR page, check Log_info.log: %s", pageError)
+        input('Check log info...press enter after complete')
+    except requests.RequestException as connectionError:
+        # Log the exception raised when the http backend cannot reach WebCMR
+        logging.exception("Could not reach WebCMR, check Log_info.log: %s", connectionError)
+        input('Check log info...press enter after complete')
 
     # Log the completion of the process
     logging.info('Process Complete...')
@@ -0,0 +1,77 @@
+# ---------------------------------------------------------------------------------------------------
+#   Purpose:
+#       Compares the per-value IMM.classify_column with the vectorized IMM.classify_values on a
+#       synthetic DILR_ResultValue column, checks that both give the same label to every value and
+#       prints the time each one took.
+#   Algorithm:
+#       1. Build a column of typical lab results (repeated, as in a real export) or random strings
+#       2. Classify it with Series.apply(classify_column) and with classify_values
+#       3. Fail on any value that got a different label, print the timings and the speed-up
+#   Usage:
+#       python benchmark_classify.py --rows 500000
+#       python benchmark_classify.py --rows 300000 --random
+# ---------------------------------------------------------------------------------------------------
+
+import sys
+import time
+import random
+import string
+import argparse
+
+import pandas as pd
+
+from IMM import IMM
+
+
+RESULT_VALUES = [
+    'Detected', 'Not Detected', 'Negative', 'Positive', 'Reactive', 'Nonreactive', 'Indeterminate',
+    'NEG', 'POS', 'See note', '5.2', '0.8', '1.25', '12', '120', '<0.5', '>100', '3+', 'A1c',
+    '10^3 copies/mL', '1_000', 'nan', '-inf', '1e 5', '', ' 7 '
+]
+RANDOM_CHARACTERS = string.ascii_letters[:6] + string.digits + ' .+-eE_,<>%nafiINF\xa0١²½é\t'
+
+
+def result_column(rows: int, unique: bool = False, seed: int = 1) -> pd.Series:
+    'A synthetic DILR_ResultValue column: typical results with some numbers appended, or random strings'
+    rng = random.Random(seed)
+    if unique:
+        values = [''.join(rng.choice(RANDOM_CHARACTERS) for _ in range(rng.randint(0, 6))) for _ in range(rows)]
+    else:
+        values = [rng.choice(RESULT_VALUES) + ('' if rng.random() < 0.7 else str(rng.randint(0, 999))) for _ in range(rows)]
+    return pd.Series(values, dtype=object)
+
+
+def compare(values: pd.Series):
+    'Returns the labels of both classifiers and the seconds each one took'
+    imm = IMM('', '', '', '', '')
+    start = time.perf_counter()
+    expected = values.apply(imm.classify_column)
+    scalar_seconds = time.perf_counter() - start
+    start = time.perf_counter()
+    labels = imm.classify_values(values)
+    vector_seconds = time.perf_counter() - start
+    return expected, labels, scalar_seconds, vector_seconds
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Benchmark the vectorized result value classifier')
+    parser.add_argument('--rows', type=int, default=500000)
+    parser.add_argument('--random', action='store_true', help='random strings instead of typical lab results')
+    parser.add_argument('--seed', type=int, default=1)
+    args = parser.parse_args(argv)
+
+    values = result_column(args.rows, args.random, args.seed)
+    expected, labels, scalar_seconds, vector_seconds = compare(values)
+    mismatched = values[expected != labels]
+    print(f'{len(values)} values, {values.nunique()} distinct')
+    print(f'classify_column (apply): {scalar_seconds:.3f}s')
+    print(f'classify_values:         {vector_seconds:.3f}s ({scalar_seconds / vector_seconds:.1f}x)')
+    if len(mismatched):
+        print(f'{len(mismatched)} values classified differently, e.g. {list(mismatched.unique()[:10])}')
+        return 1
+    print('labels identical')
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
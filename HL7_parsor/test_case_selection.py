@@ -0,0 +1,65 @@
+import pandas as pd
+import pytest
+
+from Case_selection import last_row_cases, set_cover_cases, select_cases, expected_visits
+
+
+def classified_rows():
+    rows = [
+        # test, incident, accession, value, classification
+        ('HIV-1 RNA', 1, 'ACC1', 'Not Detected', 'Categorical'),
+        ('HIV-1 RNA', 1, 'ACC1', '1200', 'Numeric'),
+        ('CD4 count', 1, 'ACC1', '350', 'Numeric'),
+        ('HIV-1 RNA', 2, 'ACC2', 'Detected', 'Categorical'),
+        ('CD4 count', 2, 'ACC2', '410', 'Numeric'),
+        ('CD4 count', 3, 'ACC3', 'A1c', 'ERROR'),
+        ('HIV-1 RNA', 4, 'ACC4', '900', 'Numeric'),
+        ('CD4 count', 5, 'ACC5', '5E', 'ERROR'),
+    ]
+    return pd.DataFrame(rows, columns=['DILR_ResultedTest', 'DILR_IncidentID', 'DILR_AccessionNumber',
+                                       'DILR_ResultValue', 'Classification'])
+
+
+def test_last_row_cases():
+    '''
+    The original sampling: every categorical result, one Numeric and ERROR example per test.
+    '''
+    cases = last_row_cases(classified_rows())
+    assert list(cases['DILR_ResultValue']) == ['Not Detected', 'Detected', '410', '900', '5E']
+
+
+def test_set_cover_cases():
+    '''
+    Every (test, classification) is covered with the fewest (accession, incident) pairs.
+    '''
+    df = classified_rows()
+    cases = set_cover_cases(df)
+    covered = set(zip(cases['DILR_ResultedTest'], cases['Classification']))
+    assert covered == set(zip(df['DILR_ResultedTest'], df['Classification']))
+    assert len(cases) == len(covered)
+    # ACC1 covers three combinations, then one ERROR example is needed (the later ACC5)
+    assert list(cases['DILR_AccessionNumber']) == ['ACC1', 'ACC1', 'ACC1', 'ACC5']
+    assert expected_visits(cases)['imm_searches'] == 2
+    assert expected_visits(last_row_cases(df))['imm_searches'] == 4
+
+
+def test_set_cover_skips_rows_without_incident():
+    '''
+    Rows that can not be looked up are not picked.
+    '''
+    df = classified_rows()
+    df.loc[0, 'DILR_IncidentID'] = None
+    cases = set_cover_cases(df)
+    assert cases['DILR_IncidentID'].notna().all()
+    assert ('HIV-1 RNA', 'Categorical') in set(zip(cases['DILR_ResultedTest'], cases['Classification']))
+
+
+def test_select_cases():
+    '''
+    Engines are picked by name, or passed in.
+    '''
+    df = classified_rows()
+    assert select_cases(df, 'set_cover').equals(set_cover_cases(df))
+    assert select_cases(df, lambda rows: rows.head(1)).equals(df.head(1))
+    with pytest.raises(ValueError):
+        select_cases(df, 'random')
@@ -0,0 +1,29 @@
+import pandas as pd
+
+from IMM import IMM
+from benchmark_classify import result_column, compare
+
+
+def test_classify_values_matches_classify_column():
+    '''
+    The vectorized classifier gives every value the label classify_column gives it, including
+    the values float() and pd.to_numeric read differently.
+    '''
+    values = pd.Series([
+        'Detected', 'Not Detected', '5.2', '-12', ' 7 ', '<0.5', '3+', 'A1c', 'HIV1', '', '1_000',
+        '1e5', '1e 5', 'nan', '+NaN', '-inf', 'Infinity', '١٢', '²', '5.2', 'A1c'
+    ], index=range(100, 121))
+    imm = IMM('', '', '', '', '')
+    labels = imm.classify_values(values)
+    assert list(labels.index) == list(values.index)
+    assert list(labels) == [imm.classify_column(value) for value in values]
+    assert labels[102] == 'Numeric' and labels[107] == 'ERROR' and labels[100] == 'Categorical'
+
+
+def test_classify_values_agrees_on_export_values():
+    '''
+    On repeated lab results, as in a real export, the vectorized classifier agrees with
+    applying classify_column to every row. The timing is left to benchmark_classify.py.
+    '''
+    expected, labels, _, _ = compare(result_column(20000))
+    assert (expected == labels).all()
@@ -0,0 +1,55 @@
+from DI_Incident import DI_Search, DEMOGRAPHIC_FIELDS, LAB_FIELDS, WEBCMR_INDICIES
+
+
+class Fake_Driver:
+    'Answers the bulk extraction script from a dict of element values keyed by field key'
+
+    def __init__(self, values):
+        self.values = values
+        self.scripts = 0
+
+    def execute_script(self, script, fields):
+        self.scripts += 1
+        return {field['key']: self.values.get(field['key']) for field in fields}
+
+
+def di_search():
+    return DI_Search('Test Lab', 'user', 'password', '01/01/2024', '01/31/2024')
+
+
+def test_tab_values_one_round_trip():
+    '''
+    Each tab is read with a single script call.
+    '''
+    driver = Fake_Driver({'last_name': 'DOE', 'first_name': 'JANE', 'gender': 'Female'})
+    demographics = di_search().tab_values(driver, DEMOGRAPHIC_FIELDS)
+    assert driver.scripts == 1
+    assert demographics['last_name'] == 'DOE'
+    assert demographics['gender'] == 'Female'
+    assert demographics['dob'] is None
+
+
+def test_webCMR_record():
+    '''
+    Scraped tab values are put together in report order; missing text boxes read as empty
+    and missing dropdowns as the code error text.
+    '''
+    demographics = {
+        'first_name': 'JANE', 'last_name': 'DOE', 'street': '1 MAIN ST', 'unit': '', 'city': 'SAN DIEGO',
+        'state': 'CA', 'zip_code': '92101', 'ethnicity': 'Not Hispanic', 'gender': 'Female'
+    }
+    lab = {
+        'acc_num': 'ACC123', 'provider_street': '2 LAB RD', 'provider_city': 'SAN DIEGO',
+        'provider_state': 'CA', 'provider_zip': '92102', 'ab_flag': 'Abnormal'
+    }
+    values, indicies = di_search().webCMR_record(demographics, lab)
+    record = dict(zip(indicies, values))
+    assert indicies == WEBCMR_INDICIES
+    assert len(values) == len(indicies) == 26
+    assert record['Name'] == 'JANE DOE'
+    assert record['Demographic Address'] == '1 MAIN ST, SAN DIEGO, CA 92101'
+    assert record['Provider Address'] == '2 LAB RD, SAN DIEGO, CA 92102'
+    assert record['Accession Number'] == 'ACC123'
+    assert record['DOB'] == ''
+    assert record['Observation Results'] == 'CODE ERROR....element not found but is there'
+    assert {field['key'] for field in LAB_FIELDS} >= {'acc_num', 'ab_flag', 'ob_results'}
@@ -0,0 +1,70 @@
+import os
+import time
+
+from DI_Incident import DI_Search, DEMOGRAPHIC_FIELDS, LAB_FIELDS, TAB_EXTRACTORS
+from DI_snapshot import Field_Extractor, snapshot_path
+
+# Synthetic WebCMR pages, hand-written to the ids and postback fields the scrapers use (not recorded)
+FIXTURES = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'fixtures', 'webcmr')
+
+
+def fixture(name):
+    with open(os.path.join(FIXTURES, name), encoding='utf-8') as page:
+        return page.read()
+
+
+class Snapshot_Driver:
+    'Serves the page source of the tab it is on'
+
+    def __init__(self, page_source):
+        self.page_source = page_source
+
+
+def test_extract_fields():
+    '''
+    Text boxes give their value and dropdowns their selected option text; fallback xpaths are
+    used when the id is not on the page and invalid ones are skipped. The Disease Incident
+    pages are synthetic, hand-written to the ids in DEMOGRAPHIC_FIELDS and LAB_FIELDS.
+    '''
+    demographics = TAB_EXTRACTORS['demographics'].extract(fixture('di_demographics.html'))
+    assert demographics['last_name'] == 'DOE'
+    assert demographics['unit'] == ''
+    assert demographics['ethnicity'] == 'Not Hispanic'
+    assert demographics['gender'] == 'Female'
+
+    lab = Field_Extractor(LAB_FIELDS).extract(fixture('di_lab.html'))
+    assert lab['acc_num'] == 'ACC123'
+    assert lab['resulted_test'] == 'SARS-CoV-2 RNA [Presence]'
+    assert lab['facility_name'] == 'TEST LAB'
+    assert lab['ab_flag'] == 'Abnormal'
+    assert lab['units'] is None
+
+
+def test_parse_is_fast():
+    '''
+    Reading every field of a tab from its page source takes milliseconds.
+    '''
+    html = fixture('di_demographics.html')
+    start = time.perf_counter()
+    for _ in range(100):
+        TAB_EXTRACTORS['demographics'].extract(html)
+    assert (time.perf_counter() - start) / 100 < 0.01
+
+
+def test_snapshots_read_again_offline(tmp_path, monkeypatch):
+    '''
+    Saved snapshots give the same record without a browser.
+    '''
+    monkeypatch.chdir(tmp_path)
+    report = DI_Search('TEST LAB', 'user', 'password', '01/01/2023', '01/31/2023')
+    report.snapshot_scrape = True
+    report.keep_snapshots = True
+
+    demographics = report.tab_values(Snapshot_Driver(fixture('di_demographics.html')), DEMOGRAPHIC_FIELDS, 'demographics', 1234)
+    lab = report.tab_values(Snapshot_Driver(fixture('di_lab.html')), LAB_FIELDS, 'lab', 1234)
+    assert os.path.exists(snapshot_path(report.snapshot_folder(), 1234, 'lab'))
+
+    assert report.scrape_snapshot(1234) == report.webCMR_record(demographics, lab)
+    record = dict(zip(*reversed(report.scrape_snapshot(1234))))
+    assert record['Name'] == 'JANE DOE'
+    assert record['Accession Number'] == 'ACC123'
@@ -0,0 +1,84 @@
+import os
+import time
+import threading
+
+import pytest
+
+from Download_watch import wait_for_download, finished_download
+
+
+def download_later(folder, name, delay=0.2):
+    'Writes a partial download and renames it into place, as Chrome does'
+    def download():
+        partial = os.path.join(folder, f'{name}.crdownload')
+        with open(partial, 'wb') as output:
+            output.write(b'half')
+        time.sleep(delay)
+        with open(partial, 'ab') as output:
+            output.write(b' and the rest')
+        os.replace(partial, os.path.join(folder, name))
+    thread = threading.Thread(target=download)
+    thread.start()
+    return thread
+
+
+@pytest.mark.parametrize('use_inotify', [True, False])
+def test_wait_for_download(tmp_path, use_inotify):
+    '''
+    The finished file is returned as soon as it is renamed into place, never the partial
+    download or a workbook that was there before.
+    '''
+    (tmp_path / 'old_export.xlsx').write_bytes(b'stale')
+    before = set(os.listdir(tmp_path))
+    start = time.time()
+    thread = download_later(str(tmp_path), 'IMM_Export.xlsx')
+    path = wait_for_download(str(tmp_path), before, timeout=5, use_inotify=use_inotify)
+    thread.join()
+    assert path == str(tmp_path / 'IMM_Export.xlsx')
+    assert open(path, 'rb').read() == b'half and the rest'
+    assert time.time() - start < 2
+
+
+def test_partial_download_pending(tmp_path):
+    '''
+    Nothing is returned while a partial download is still pending.
+    '''
+    (tmp_path / 'IMM_Export.xlsx').write_bytes(b'done')
+    (tmp_path / 'Unconfirmed 1234.crdownload').write_bytes(b'half')
+    assert finished_download(str(tmp_path), set()) is None
+    with pytest.raises(TimeoutError):
+        wait_for_download(str(tmp_path), set(), timeout=0.3)
+
+
+def test_export_df_finds_earlier_download(tmp_path, monkeypatch):
+    '''
+    A new run without an export of its own reads the newest export of an earlier run, and
+    says so clearly when there is none.
+    '''
+    from IMM import IMM
+    monkeypatch.setenv('HOME', str(tmp_path))
+    monkeypatch.chdir(tmp_path)
+    with pytest.raises(FileNotFoundError):
+        IMM('TEST LAB', '', '', '', '').latest_export()
+
+    earlier = tmp_path / 'Downloads' / 'TST WebCMR' / '20240101_000000_1'
+    earlier.mkdir(parents=True)
+    (earlier / 'IMM_Export.csv').write_text(
+        'DILR_ImportStatus,DILR_ResultedTest,DILR_IncidentID,DILR_AccessionNumber,DILR_ResultValue\n'
+        'Imported,HIV-1 RNA,1234,ACC1,Detected\n'
+    )
+    imm = IMM('TEST LAB', '', '', '', '')
+    assert imm.latest_export() == str(earlier / 'IMM_Export.csv')
+    assert list(imm.export_df()['DILR_AccessionNumber']) == ['ACC1']
+    assert imm.download_folder() == imm.download_folder()
+
+
+def test_unrouted_downloads_fall_back(tmp_path, monkeypatch):
+    '''
+    When Chrome can not be told where to save, the default Downloads folder is watched.
+    '''
+    from IMM import IMM
+    monkeypatch.setenv('HOME', str(tmp_path))
+    imm = IMM('TEST LAB', '', '', '', '')
+    assert not imm.route_downloads(object(), imm.download_folder())
+    assert imm.default_download_folder() == str(tmp_path / 'Downloads')
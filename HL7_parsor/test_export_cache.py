@@ -0,0 +1,80 @@
+import os
+import time
+
+import pandas as pd
+
+import IMM as imm_module
+import Export_cache
+
+from IMM import IMM
+from Export_cache import Export_Cache, file_digest
+from test_export_reader import write_export
+
+
+def test_file_digest(tmp_path):
+    '''
+    Exports are cached by their content, not their name.
+    '''
+    (tmp_path / 'a.csv').write_bytes(b'DILR_ImportStatus\nImported\n')
+    (tmp_path / 'b.csv').write_bytes(b'DILR_ImportStatus\nImported\n')
+    (tmp_path / 'c.csv').write_bytes(b'DILR_ImportStatus\nNot Imported\n')
+    assert file_digest(str(tmp_path / 'a.csv')) == file_digest(str(tmp_path / 'b.csv'))
+    assert file_digest(str(tmp_path / 'a.csv')) != file_digest(str(tmp_path / 'c.csv'))
+
+
+def test_cache_without_parquet_engine(tmp_path, monkeypatch):
+    '''
+    Without a Parquet engine the cache is turned off and export_df reads the export.
+    '''
+    monkeypatch.setattr(Export_cache, 'parquet_engine', lambda: None)
+    monkeypatch.chdir(tmp_path)
+    cache = Export_Cache(str(tmp_path / 'export_cache'))
+    assert not cache.enabled
+    cache.store('digest', 'raw', pd.DataFrame({'a': [1]}))
+    assert cache.load('digest', 'raw') is None
+    imm = IMM('TEST LAB', '', '', '', '')
+    assert len(imm.export_df(write_export(tmp_path, '.csv'))) == 3
+
+
+def test_export_df_cached(tmp_path, monkeypatch):
+    '''
+    A second run on the same export loads the same cases from the cache without reading the
+    export, still writes them to the summary, and a new FINAL_VERSION rebuilds them from the
+    cached raw frame.
+    '''
+    monkeypatch.chdir(tmp_path)
+    path = write_export(tmp_path, '.csv')
+    first = IMM('TEST LAB', '', '', '', '').export_df(path)
+    assert IMM('TEST LAB', '', '', '', '').export_cache.enabled
+    os.remove('ELR_Validation_Search_Summary.xlsx')
+
+    def read_export(path):
+        raise AssertionError('the export was read again')
+    monkeypatch.setattr(imm_module, 'read_export', read_export)
+    cached = IMM('TEST LAB', '', '', '', '').export_df(path)
+    pd.testing.assert_frame_equal(first, cached)
+    # the summary shared by every lab is written for the cached cases too
+    summary = pd.read_excel('ELR_Validation_Search_Summary.xlsx', index_col=0)
+    assert list(summary['DILR_AccessionNumber'].astype(str)) == list(first['DILR_AccessionNumber'].astype(str))
+
+    monkeypatch.setattr(Export_cache, 'FINAL_VERSION', Export_cache.FINAL_VERSION + 1)
+    rebuilt = IMM('TEST LAB', '', '', '', '').export_df(path)
+    pd.testing.assert_frame_equal(first, rebuilt)
+
+
+def test_unused_files_evicted(tmp_path):
+    '''
+    Cache files not written or loaded for max_age are deleted when the cache is opened.
+    '''
+    folder = tmp_path / 'export_cache'
+    cache = Export_Cache(str(folder))
+    cache.store('old', 'raw', pd.DataFrame({'a': ['1']}))
+    cache.store('used', 'raw', pd.DataFrame({'a': ['2']}))
+    (folder / 'partial.parquet.1234.tmp').write_bytes(b'')
+    long_ago = time.time() - 3600
+    for name in os.listdir(folder):
+        os.utime(folder / name, (long_ago, long_ago))
+    assert cache.load('used', 'raw') is not None
+
+    Export_Cache(str(folder), max_age=60)
+    assert sorted(os.listdir(folder)) == [os.path.basename(cache.path('used', 'raw'))]
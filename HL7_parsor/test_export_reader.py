@@ -0,0 +1,85 @@
+import pandas as pd
+import pytest
+
+from IMM import IMM
+from Export_reader import read_export, EXPORT_COLUMNS
+
+
+def export_frame():
+    return pd.DataFrame({
+        'DILR_ID': [1, 2, 3, 4],
+        'DILR_ImportStatus': ['Imported', 'Imported', 'Not Imported', 'Imported'],
+        'DILR_ResultedTest': ['SARS-CoV-2 RNA', 'SARS-CoV-2 RNA', 'HIV-1 RNA', 'HIV-1 RNA'],
+        'DILR_Comments': ['long', 'free', 'text', 'notes'],
+        'DILR_IncidentID': [1234, 1234, 5678, 5678],
+        'DILR_AccessionNumber': ['ACC1', 'ACC2', 'ACC3', 'ACC4'],
+        'DILR_ResultValue': ['Detected', '', '1200', '5.20'],
+    })
+
+
+def write_export(folder, suffix):
+    path = str(folder / f'IMM_Export{suffix}')
+    frame = export_frame()
+    if suffix == '.csv':
+        frame.to_csv(path, index=False)
+    elif suffix == '.xlsx':
+        frame.to_excel(path, index=False)
+    else:
+        rows = ''.join('<Table>' + ''.join(f'<{column}>{value}</{column}>' for column, value in row.items()) + '</Table>'
+                       for row in frame.astype(str).to_dict('records'))
+        with open(path, 'w') as output:
+            output.write(f'<?xml version="1.0"?><NewDataSet>{rows}</NewDataSet>')
+    return path
+
+
+@pytest.mark.parametrize('suffix', ['.csv', '.xlsx', '.xml'])
+def test_read_export(tmp_path, suffix):
+    '''
+    Every format gives only the used columns, as text, with NaN for empty cells.
+    '''
+    df = read_export(write_export(tmp_path, suffix))
+    assert list(df.columns) == EXPORT_COLUMNS
+    assert list(df['DILR_IncidentID']) == ['1234', '1234', '5678', '5678']
+    assert list(df['DILR_ResultValue'][[0, 2, 3]]) == ['Detected', '1200', '5.20']
+    assert pd.isna(df['DILR_ResultValue'][1])
+
+
+def test_read_excel_sparse_rows(tmp_path):
+    '''
+    Workbook rows that leave empty cells out are read by cell reference, and blank rows are skipped.
+    '''
+    openpyxl = pytest.importorskip('openpyxl')
+    workbook = openpyxl.Workbook()
+    sheet = workbook.active
+    sheet.append(['DILR_ImportStatus', 'DILR_ID'] + EXPORT_COLUMNS[1:])
+    sheet.append(['Imported', None, 'HIV-1 RNA', 5678.0, 'ACC1', 5.2])
+    sheet.append([None] * 6)
+    sheet.append(['Imported', 7, None, 1234, 'ACC2', 'Detected'])
+    path = str(tmp_path / 'IMM_Export.xlsx')
+    workbook.save(path)
+    df = read_export(path)
+    assert list(df['DILR_IncidentID']) == ['5678', '1234']
+    assert list(df['DILR_ResultValue']) == ['5.2', 'Detected']
+    assert pd.isna(df['DILR_ResultedTest'][1])
+
+
+def test_read_export_missing_column(tmp_path):
+    '''
+    An export without a used column is reported, not read as empty.
+    '''
+    path = str(tmp_path / 'IMM_Export.csv')
+    export_frame().drop(columns='DILR_ResultValue').to_csv(path, index=False)
+    with pytest.raises(ValueError):
+        read_export(path)
+
+
+def test_export_df_reads_csv(tmp_path, monkeypatch):
+    '''
+    export_df works the same on a CSV export as on the workbook.
+    '''
+    monkeypatch.chdir(tmp_path)
+    imm = IMM('TEST LAB', '', '', '', '')
+    csv_df = imm.export_df(write_export(tmp_path, '.csv'))
+    excel_df = imm.export_df(write_export(tmp_path, '.xlsx'))
+    assert csv_df.equals(excel_df)
+    assert set(csv_df['DILR_AccessionNumber']) == {'ACC1', 'ACC2', 'ACC4'}
@@ -0,0 +1,21 @@
+from HL7_archive import HL7_Archive
+from test_hl7_parser import SAMPLE
+
+
+def test_archive_random_access(tmp_path):
+    '''
+    The archive reader should index MSH offsets and only decode the message whose
+    accession or resulted test is looked up.
+    '''
+    messages = [SAMPLE.replace('ACC123', f'ACC{i}') for i in range(50)]
+    archive_path = tmp_path / 'archive.hl7'
+    archive_path.write_bytes(('FHS|^~\\&\rBHS|^~\\&\r' + '\r'.join(messages) + '\rBTS|50\rFTS|1\r').encode())
+
+    with HL7_Archive(str(archive_path)) as archive:
+        assert len(archive) == 50
+        found = archive.find_accession('ACC42')
+        assert [msg['SPM-2'] for msg in found] == ['ACC42&LAB']
+        # the last message must not carry the batch trailer segments
+        assert 'BTS' not in archive[49]
+        assert len(archive.find_test('sars-cov-2 rna [presence]')) == 50
+        assert archive.find_accession('missing') == []
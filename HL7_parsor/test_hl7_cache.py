@@ -0,0 +1,68 @@
+
+import time
+
+from HL7_cache import HL7_Cache
+from test_hl7_parser import SAMPLE
+
+
+def test_cache_lookup_by_accession_and_test(tmp_path):
+    '''
+    A cached message should be found for its own test and for any other test it carries,
+    but not for a test it does not have or once it is older than the TTL.
+    '''
+    cache = HL7_Cache(str(tmp_path / 'hl7_cache.sqlite'), ttl=60)
+    cache.put('ACC123', 'SARS-CoV-2 RNA [Presence]', SAMPLE)
+
+    assert cache.get('ACC123', 'sars-cov-2 rna')['MSH-10'] == 'MSG0001'
+    assert cache.get('ACC123', '94500-6') is not None
+    assert cache.get('ACC123', 'Hepatitis B core, IgM') is None
+    assert cache.get('ACC999', 'SARS-CoV-2 RNA') is None
+
+    cache.ttl = 0
+    time.sleep(0.01)
+    assert cache.get('ACC123', 'SARS-CoV-2 RNA') is None
+    # expired entries are deleted on the next store
+    cache.put('ACC456', 'SARS-CoV-2 RNA', SAMPLE)
+    assert len(cache) == 1
+    time.sleep(0.01)
+    assert len(HL7_Cache(str(tmp_path / 'hl7_cache.sqlite'), ttl=0)) == 0
+
+
+def test_cache_evicts_least_recently_used(tmp_path):
+    cache = HL7_Cache(str(tmp_path / 'hl7_cache.sqlite'), max_entries=2)
+    cache.put('ACC1', 'SARS-CoV-2 RNA', SAMPLE)
+    time.sleep(0.01)
+    cache.put('ACC2', 'SARS-CoV-2 RNA', SAMPLE)
+    time.sleep(0.01)
+    # touching ACC1 makes ACC2 the least recently used entry
+    assert cache.get('ACC1', 'SARS-CoV-2 RNA') is not None
+    time.sleep(0.01)
+    cache.put('ACC3', 'SARS-CoV-2 RNA', SAMPLE)
+
+    assert len(cache) == 2
+    assert cache.get('ACC2', 'SARS-CoV-2 RNA') is None
+    assert cache.get('ACC1', 'SARS-CoV-2 RNA') is not None
+
+
+def test_cache_hit_skips_imm_navigation(tmp_path, monkeypatch):
+    '''
+    A cached message is extracted without searching the IMM or going home afterwards; a
+    message that had to be searched still returns home.
+    '''
+    from HL7 import HL7_extraction
+    from HL7_parser import HL7_Message
+
+    monkeypatch.chdir(tmp_path)
+    report = HL7_extraction(LabName='TEST LAB', username='user', paswrd='password', FromDate='01/01/2023', ToDate='01/31/2023')
+    report._hl7_cache = HL7_Cache(str(tmp_path / 'hl7_cache.sqlite'))
+    report._hl7_cache.put('ACC123', 'SARS-CoV-2 RNA', SAMPLE)
+    visits = []
+    report.go_home = lambda driver: visits.append('home')
+    report.hl7_search = lambda driver, resultTest, acc_num: visits.append('imm') or HL7_Message(SAMPLE)
+
+    cached_values, labels = report.data_wrangling('driver', 'SARS-CoV-2 RNA', 'ACC123')
+    assert visits == []
+
+    searched_values, _ = report.data_wrangling('driver', 'SARS-CoV-2 RNA', 'ACC999')
+    assert visits == ['imm', 'home']
+    assert cached_values == searched_values
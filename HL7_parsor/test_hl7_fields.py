@@ -0,0 +1,187 @@
+
+import os
+import pickle
+
+import pytest
+
+from concurrent.futures import Future
+from concurrent.futures.process import BrokenProcessPool
+import HL7_fields
+from HL7_fields import HL7_Fields, HL7_SECTION_LABELS, extract_messages
+from test_hl7_parser import SAMPLE
+
+
+def test_ingest_batch_file(tmp_path):
+    '''
+    A FHS/BHS wrapped batch file should be streamed message by message, giving one
+    record per OBX with the same labels that data_wrangling produces.
+    '''
+    second = SAMPLE.replace('MSG0001', 'MSG0002').replace('ACC123', 'ACC456')
+    batch = tmp_path / 'lab_feed.hl7'
+    batch.write_text('\n'.join([
+        'FHS|^~\\&|LAB',
+        'BHS|^~\\&|LAB',
+        SAMPLE.replace('\r', '\n'),
+        second,
+        'BTS|2',
+        'FTS|1',
+    ]))
+
+    records = list(HL7_Fields().hl7_ingest(str(batch)))
+
+    assert [record[0] for record in records] == ['ACC123', 'ACC456']
+    accession, resulted_test, hl7_values, hl7_section_label = records[0]
+    assert resulted_test == '94500-6^SARS-CoV-2 RNA [Presence]^LN'
+    assert len(hl7_values) == len(hl7_section_label) == 26
+    assert hl7_values[hl7_section_label.index('PID-5')] == 'DOE^JANE'
+    assert hl7_values[hl7_section_label.index('SPM-17, OBR-7, OBX-14')] == '20230210'
+
+
+def test_extract_columns_matches_per_message_extraction():
+    '''
+    The columnar extraction should agree with extract_fields for every message and label,
+    including a message that declares its own separators in MSH-1/MSH-2.
+    '''
+    from HL7_parser import HL7_Message
+
+    fields = HL7_Fields()
+    custom = SAMPLE.replace('|', '#').replace('^', '*')
+    texts = [
+        SAMPLE,
+        SAMPLE.replace('|20230211', '|20230212').replace('OBR|1|||94500-6^SARS-CoV-2 RNA^LN|||20230210',
+                                                        'OBR|1|||94500-6^SARS-CoV-2 RNA^LN|||20230209'),
+        'MSH|^~\\&|LAB\rPID|1||999||ROE^RICHARD\rOBX|1|ST|1234-5^Short^LN||POS',
+        custom,
+    ]
+    table = fields.extract_columns(texts)
+
+    assert list(table.columns) == list(HL7_SECTION_LABELS)
+    assert len(table) == len(texts)
+    for row, text in enumerate(texts):
+        msg = HL7_Message(text)
+        values, labels = fields.extract_fields(msg, msg.indices('OBX')[0])
+        assert list(table.loc[row]) == values
+    assert [str(value).replace('*', '^') for value in table.loc[3]] == list(table.loc[0])
+    assert table.loc[3, 'PID-5'] != ''
+
+
+def test_unmatched_resulted_test_is_skipped():
+    '''
+    A resulted test matching no OBX (match_obx gives 0) is not extracted from the first order
+    group: extract_fields raises, extract_columns leaves the row empty and the case is skipped.
+    '''
+    from HL7 import HL7_extraction
+    from HL7_parser import HL7_Message
+
+    fields = HL7_Fields()
+    msg = HL7_Message(SAMPLE)
+    assert fields.match_obx('Hepatitis Z Antigen', msg, 3) == 0
+    with pytest.raises(ValueError):
+        fields.extract_fields(msg, 0)
+
+    table = fields.extract_columns([SAMPLE, SAMPLE], ['Hepatitis Z Antigen', 'SARS-CoV-2 RNA'])
+    assert table.loc[0].isna().all()
+    assert table.loc[1, 'PID-5'] == 'DOE^JANE'
+
+    class Cache:
+        get = staticmethod(lambda acc_num, resultTest: msg)
+
+    report = HL7_extraction(LabName='TEST LAB', username='user', paswrd='password', FromDate='01/01/2023', ToDate='01/31/2023')
+    report._hl7_cache = Cache()
+    visits = []
+    report.go_home = lambda driver: visits.append('home')
+    report.webTST_scrape = lambda *args: pytest.fail('an unmatched case should not be scraped')
+    assert report.process_case('driver', ('ACC123', 'Hepatitis Z Antigen', 1)) is None
+    # the message came from the cache, so the browser never left for the IMM
+    assert visits == []
+
+
+def test_field_plan_components():
+    '''
+    A field map with component paths should compile once and extract only those components.
+    '''
+    from HL7_fields import Field_Plan
+    from HL7_parser import HL7_Message
+
+    plan = Field_Plan([
+        {'label': 'Last name', 'path': 'PID-5.1'},
+        {'label': 'Accession', 'path': 'SPM-2.1.1'},
+        {'label': 'Test code', 'path': 'OBX-3.1'},
+        {'label': 'Collected', 'reconcile': ['SPM-17', 'OBX-14', 'OBR-7']},
+        {'label': 'Note', 'value': 'n/a'},
+    ])
+    msg = HL7_Message(SAMPLE)
+    fields = HL7_Fields()
+
+    values = plan.extract(msg, msg.select(fields.result_segments(msg, 4)).chosen)
+
+    assert plan.labels == ['Last name', 'Accession', 'Test code', 'Collected', 'Note']
+    assert values == ['DOE', 'ACC123', '94500-6', '20230210', 'n/a']
+    assert msg['PID-5.2'] == 'JANE'
+
+
+def test_extract_parallel_keeps_order(monkeypatch):
+    '''
+    Fanning extraction out to worker processes should give the same records, in the same
+    order, as the in-process fallback.
+    '''
+    monkeypatch.setattr(os, 'cpu_count', lambda: 2)
+    texts = [SAMPLE.replace('ACC123', f'ACC{i}') for i in range(30)]
+    fields = HL7_Fields()
+
+    in_process = list(fields.extract_parallel(texts, workers=1, chunksize=7))
+    pooled = list(fields.extract_parallel(texts, workers=2, chunksize=7))
+
+    assert [record[0] for record in in_process] == [f'ACC{i}' for i in range(30)]
+    assert pooled == in_process
+
+
+class Failing_Pool:
+    'Process pool whose workers fail with the given error after the first chunk'
+
+    def __init__(self, error, max_workers):
+        self.error = error
+        self.max_workers = max_workers
+        self.submitted = 0
+
+    def submit(self, fn, *args):
+        future = Future()
+        if self.submitted:
+            future.set_exception(self.error)
+        else:
+            future.set_result(fn(*args))
+        self.submitted += 1
+        return future
+
+    def shutdown(self, wait=True, cancel_futures=False):
+        pass
+
+
+@pytest.mark.parametrize('error', [BrokenProcessPool('worker killed'), pickle.PicklingError('cannot pickle')])
+def test_extract_parallel_falls_back_in_process(monkeypatch, error):
+    '''
+    When the pool breaks or a chunk cannot be pickled, the unfinished chunks are extracted
+    in-process and no record is lost; workers are capped at the CPU count and 61.
+    '''
+    pools = []
+
+    def pool(max_workers):
+        pools.append(Failing_Pool(error, max_workers))
+        return pools[-1]
+
+    monkeypatch.setattr(HL7_fields, 'ProcessPoolExecutor', pool)
+    monkeypatch.setattr(os, 'cpu_count', lambda: 128)
+    texts = [SAMPLE.replace('ACC123', f'ACC{i}') for i in range(30)]
+
+    records = list(HL7_Fields().extract_parallel(texts, workers=100, chunksize=7))
+
+    assert [record[0] for record in records] == [f'ACC{i}' for i in range(30)]
+    assert pools[0].max_workers == 61
+
+
+def test_extract_messages_normalizes_result_test():
+    '''
+    The resulted test filter ignores case, spacing and bracketed text, as match_obx does.
+    '''
+    assert len(extract_messages([SAMPLE], 'SARS-CoV-2  rna [Presence]')) == 1
+    assert extract_messages([SAMPLE], 'Hepatitis Z Antigen') == []
@@ -0,0 +1,84 @@
+
+from HL7_parser import HL7_Message
+
+SAMPLE = '\r'.join([
+    'MSH|^~\\&|LAB|FACILITY|TST|CDPH|20230213||ORU^R01^ORU_R01|MSG0001|P|2.5.1',
+    'PID|1||12345^^^MRN||DOE^JANE||19800101|F|||1 MAIN ST^^SAN DIEGO^CA^92101||^^PH^^^619^5551234',
+    'ORC|RE|||||||||||1234^SMITH^JOHN',
+    'OBR|1|||94500-6^SARS-CoV-2 RNA^LN|||20230210',
+    'OBX|1|CWE|94500-6^SARS-CoV-2 RNA [Presence]^LN||260373001^Detected^SCT|||A|||F|||20230210',
+    'SPM|1|ACC123&LAB|||||||||||||||20230210|20230211',
+])
+
+
+def test_message_field_access():
+    '''
+    Parsing a message once should give direct access to fields by path, with MSH
+    field numbers lined up with MSH-1 being the field separator.
+    '''
+    msg = HL7_Message(SAMPLE)
+
+    assert msg['MSH-1'] == '|'
+    assert msg['MSH-2'] == '^~\\&'
+    assert msg['MSH-10'] == 'MSG0001'
+    assert msg['PID-5'] == 'DOE^JANE'
+    assert msg['OBX-3'] == '94500-6^SARS-CoV-2 RNA [Presence]^LN'
+    assert msg['SPM-17'] == '20230210'
+    # missing fields and segments come back empty instead of raising
+    assert msg['PID-40'] == ''
+    assert msg['NTE-3'] == ''
+    assert msg.indices('OBX') == [4]
+    assert msg.segment_text(1).startswith('PID|1|')
+
+
+def test_message_custom_delimiters_and_newlines():
+    '''
+    Encoding characters come from MSH-1/MSH-2 and segments may be split by newlines,
+    which is how the IMM page renders divContentsArea.
+    '''
+    msg = HL7_Message('MSH#*~\\&#LAB\nPID#1##12345##DOE*JANE\n')
+
+    assert msg.field_sep == '#'
+    assert msg.component_sep == '*'
+    assert msg['PID-5'] == 'DOE*JANE'
+    assert msg.select(msg.indices('PID'))['PID-3'] == '12345'
+
+
+def test_order_groups_for_panel_message():
+    '''
+    OBX and SPM segments should be attached to the order they follow even when the
+    number of OBR, OBX and SPM segments does not line up.
+    '''
+    panel = '\r'.join([
+        'MSH|^~\\&|LAB|FACILITY|TST|CDPH|20230213||ORU^R01^ORU_R01|MSG0002|P|2.5.1',
+        'PID|1||12345^^^MRN||DOE^JANE',
+        'ORC|RE',
+        'OBR|1|||24356-8^Urinalysis panel^LN',
+        'OBX|1|NM|5811-5^Specific gravity^LN||1.020',
+        'OBX|2|CWE|5803-2^pH^LN||6.0',
+        'SPM|1|URINE1&LAB',
+        'OBR|2|||600-7^Blood culture^LN',
+        'OBX|1|CWE|600-7^Bacteria identified^LN||Staph aureus',
+        'SPM|1|BLOOD1&LAB',
+    ])
+    msg = HL7_Message(panel)
+
+    assert len(msg.groups) == 2
+    first, second = msg.groups
+    assert (first.orc, first.obr, first.observations, first.specimen) == (2, 3, [4, 5], 6)
+    assert (second.orc, second.obr, second.observations, second.specimen) == (None, 7, [8], 9)
+    assert msg.group_of[5] is first
+    assert msg.group_of[8] is second
+
+
+def test_find_obx_normalized_lookup():
+    '''
+    Resulted tests from the IMM export should find their OBX regardless of case,
+    spacing or bracketed qualifiers.
+    '''
+    msg = HL7_Message(SAMPLE)
+
+    assert msg.find_obx('SARS-CoV-2 RNA [Presence]') == 4
+    assert msg.find_obx('sars-cov-2   rna') == 4
+    assert msg.find_obx('94500-6') == 4
+    assert msg.find_obx('Hepatitis B core, IgM') == 0
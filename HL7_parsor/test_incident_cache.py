@@ -0,0 +1,88 @@
+import os
+
+from DI_Incident import DI_Search, LAB_FIELDS, TEST_NOT_IN_LAB_GRID, lab_grid_fields, lab_grid_rows, lab_row
+from DI_snapshot import Field_Extractor, save_snapshot
+from Incident_cache import Incident_Cache
+
+# Synthetic WebCMR pages, hand-written to the ids and postback fields the scrapers use (not recorded)
+FIXTURES = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'fixtures', 'webcmr')
+
+
+def fixture(name):
+    with open(os.path.join(FIXTURES, name), encoding='utf-8') as page:
+        return page.read()
+
+
+def two_row_lab_page():
+    'The synthetic lab tab fixture with a second row of the lab grid for another test'
+    page = fixture('di_lab.html')
+    first = page[page.index('<tr><td>'):page.index('</td></tr>') + len('</td></tr>')]
+    second = (first.replace('ctl02', 'ctl03').replace('ACC123', 'ACC456')
+              .replace('SARS-CoV-2 RNA [Presence]', 'Influenza A RNA').replace('Detected', 'Not Detected'))
+    return page.replace(first, first + '\n' + second)
+
+
+def scrape(last_name='DOE'):
+    return {'demographics': {'last_name': last_name}, 'lab': [{'acc_num': 'ACC123', 'resulted_test': 'HIV-1 RNA'}]}
+
+
+def test_incident_cache_expiry(tmp_path):
+    '''
+    Scrapes are kept by incident id, across runs when persisted, until they expire.
+    '''
+    now = [1000.0]
+    path = str(tmp_path / 'incident_cache.sqlite')
+    cache = Incident_Cache(path, ttl=60, clock=lambda: now[0])
+    cache.put(1234, scrape())
+    assert cache.get(1234) == scrape()
+    assert Incident_Cache(path, ttl=60, clock=lambda: now[0]).get('1234') == scrape()
+    assert cache.get(5678) is None
+    now[0] += 61
+    assert cache.get(1234) is None
+    cache.put(5678, scrape('ROE'))
+    assert len(cache) == 1
+    assert len(Incident_Cache()) == 0
+
+
+def test_lab_grid_rows():
+    '''
+    Every row of the lab grid is read, and each resulted test gets its own row.
+    '''
+    rows = lab_grid_rows(Field_Extractor(lab_grid_fields(2)).extract(two_row_lab_page()), 2)
+    assert [row['acc_num'] for row in rows] == ['ACC123', 'ACC456']
+    assert set(rows[1]) == {field['key'] for field in LAB_FIELDS}
+    assert lab_row(rows, 'influenza a rna')['result'] == 'Not Detected'
+    assert lab_row(rows, 'SARS-CoV-2 RNA')['result'] == 'Detected'
+    assert lab_row(rows, 'Hepatitis C') is None
+    assert lab_row(rows)['acc_num'] == 'ACC123'
+
+
+def test_incident_scraped_once(tmp_path, monkeypatch):
+    '''
+    All tests of an incident are served by one visit, with the lab row of each test.
+    '''
+    monkeypatch.chdir(tmp_path)
+    report = DI_Search('TEST LAB', 'user', 'password', '01/01/2023', '01/31/2023')
+    folder = report.snapshot_folder()
+    save_snapshot(folder, 1234, 'demographics', fixture('di_demographics.html'))
+    save_snapshot(folder, 1234, 'lab', two_row_lab_page())
+    visits = []
+
+    def scrape_incident(driver, di_num):
+        visits.append(di_num)
+        return {
+            'demographics': {'last_name': 'DOE', 'first_name': 'JANE'},
+            'lab': lab_grid_rows(Field_Extractor(lab_grid_fields(2)).extract(two_row_lab_page()), 2)
+        }
+    monkeypatch.setattr(report, 'scrape_incident', scrape_incident)
+    flu = dict(zip(*reversed(report.webTST_scrape(None, [1234], 0, 'Influenza A RNA'))))
+    covid = dict(zip(*reversed(report.webTST_scrape(None, [1234.0], 0, 'SARS-CoV-2 RNA [Presence]'))))
+    assert visits == [1234]
+    assert flu['Accession Number'] == 'ACC456' and flu['Result'] == 'Not Detected'
+    assert covid['Accession Number'] == 'ACC123' and covid['Name'] == 'JANE DOE'
+    assert dict(zip(*reversed(report.scrape_snapshot(1234, resultTest='Influenza A RNA'))))['Result'] == 'Not Detected'
+
+    missing = dict(zip(*reversed(report.webTST_scrape(None, [1234], 0, 'Hepatitis C'))))
+    assert missing['Name'] == 'JANE DOE'
+    assert missing['Accession Number'] == '' and missing['Result'] == ''
+    assert missing['Resulted Test'] == TEST_NOT_IN_LAB_GRID
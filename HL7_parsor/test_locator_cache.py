@@ -0,0 +1,166 @@
+import time
+
+import pytest
+
+from selenium.common.exceptions import NoSuchElementException
+from selenium.webdriver.common.by import By
+from IMM import IMM
+from Locator_cache import Locator_Cache, ABSENT, environment
+
+
+class Fake_Driver:
+    'Page whose elements are only found by the locators given, counting every lookup'
+
+    def __init__(self, present):
+        self.present = present
+        self.lookups = []
+
+    def find_element(self, by, value):
+        self.lookups.append((by, value))
+        if (by, value) in self.present:
+            return self.present[(by, value)]
+        raise NoSuchElementException(value)
+
+    def find_elements(self, by, value):
+        self.lookups.append((by, value))
+        return [self.present[(by, value)]] if (by, value) in self.present else []
+
+
+def imm(tmp_path):
+    imm = IMM('Test Lab', 'user', 'password', '01/01/2024', '01/31/2024',
+              url='https://test-sdcounty.atlasph.com/TSTWebCMR/pages/login/login.aspx')
+    imm.locator_cache_path = str(tmp_path / 'locators.sqlite')
+    return imm
+
+
+def test_environment():
+    '''
+    Environments are keyed by host and application folder.
+    '''
+    assert environment('https://test-sdcounty.atlasph.com/TSTWebCMR/pages/login/login.aspx') == 'test-sdcounty.atlasph.com/tstwebcmr'
+
+
+def test_winning_strategy_first(tmp_path):
+    '''
+    The strategy that found a field is tried first on the next lookup, also after reopening.
+    '''
+    report = imm(tmp_path)
+    driver = Fake_Driver({(By.XPATH, '//*[@id="CRELab_txtAccNum"]'): 'element'})
+    assert report.locate(driver, 'txtAccNum', field_name='//*[@id="CRELab_txtAccNum"]') == 'element'
+
+    report = imm(tmp_path)
+    driver.lookups = []
+    start = time.time()
+    assert report.locate(driver, 'txtAccNum', field_name='//*[@id="CRELab_txtAccNum"]') == 'element'
+    assert driver.lookups == [(By.XPATH, '//*[@id="CRELab_txtAccNum"]')]
+    assert time.time() - start < 0.5
+
+
+def test_absent_fields_skip_waiting(tmp_path):
+    '''
+    Fields no strategy found are only checked without waiting, and found again once they appear.
+    '''
+    report = imm(tmp_path)
+    driver = Fake_Driver({})
+    assert report.locate(driver, 'txtUnits', skip_absent=True) is None
+    assert report.locator_cache.strategy(environment(report.url), 'txtUnits') == ABSENT
+
+    start = time.time()
+    assert report.locate(driver, 'txtUnits', skip_absent=True) is None
+    assert time.time() - start < 0.5
+
+    driver.present[(By.ID, 'txtUnits')] = 'element'
+    assert report.locate(driver, 'txtUnits', skip_absent=True) == 'element'
+    assert report.locator_cache.strategy(environment(report.url), 'txtUnits') == 'id'
+
+
+def test_miss_with_learned_timeout_is_not_absent(tmp_path):
+    '''
+    A field missed with a learned timeout shorter than the default is not remembered as absent,
+    and multiFind does not wait for fields that are.
+    '''
+    report = imm(tmp_path)
+    driver = Fake_Driver({})
+    for _ in range(report.wait_timer.min_samples):
+        report.wait_timer.record('element:txtUnits:id', 0.01)
+    assert report.locate(driver, 'txtUnits') is None
+    assert report.locator_cache.strategy(environment(report.url), 'txtUnits') is None
+
+    report.locator_cache.missing(environment(report.url), 'txtUnits')
+    start = time.time()
+    with pytest.raises(NoSuchElementException):
+        report.multiFind(driver, 'txtUnits')
+    assert time.time() - start < 0.5
+
+
+def test_absent_entries_expire(tmp_path):
+    '''
+    Absent entries older than the TTL are forgotten.
+    '''
+    cache = Locator_Cache(str(tmp_path / 'locators.sqlite'), absent_ttl=0)
+    cache.missing('env', 'txtUnits')
+    time.sleep(0.01)
+    assert cache.strategy('env', 'txtUnits') is None
+    assert cache.order('env', 'txtUnits', ['id', 'xpath']) == ['id', 'xpath']
+
+
+class Fake_Browser(Fake_Driver):
+    'Fake_Driver that also opens urls; pages are element dicts keyed by url'
+
+    def __init__(self, pages, current_url=''):
+        super().__init__({})
+        self.pages = pages
+        self.current_url = current_url
+        self.opened = []
+
+    def get(self, url):
+        self.opened.append(url)
+        self.current_url = url
+        self.present = self.pages.get(url, {})
+
+
+def test_deep_link_learned_by_incident(tmp_path):
+    '''
+    A Disease Incident url is learned as a template and re-used for other incidents.
+    '''
+    report = imm(tmp_path)
+    detail = 'https://test-sdcounty.atlasph.com/TSTWebCMR/pages/DisInc.aspx?id={}'
+    driver = Fake_Browser({detail.format(5678): {(By.ID, 'txtLastName'): 'element'}}, detail.format(1234))
+    report.accept_alert = lambda driver: None
+
+    assert not report.deep_link(driver, 'disease_incident', 'txtLastName', incident=5678)
+    report.learn_url(driver, 'disease_incident', incident=1234)
+    assert report.deep_link(driver, 'disease_incident', 'txtLastName', incident=5678)
+    assert driver.opened == [detail.format(5678)]
+
+
+def test_deep_link_falls_back(tmp_path):
+    '''
+    Pages that are not addressed by their url, or whose deep link does not land, go through the menus.
+    '''
+    report = imm(tmp_path)
+    report.accept_alert = lambda driver: None
+    driver = Fake_Browser({}, 'https://test-sdcounty.atlasph.com/TSTWebCMR/pages/Main.aspx')
+    report.learn_url(driver, 'disease_incident', incident=1234)
+    assert not report.deep_link(driver, 'disease_incident', 'txtLastName', incident=1234)
+    assert driver.opened == []
+
+    report.learn_url(driver, 'imm')
+    assert not report.deep_link(driver, 'imm', 'txtAccession')
+    assert driver.opened == ['https://test-sdcounty.atlasph.com/TSTWebCMR/pages/Main.aspx']
+    assert report.locator_cache.page_url(environment(report.url), 'imm') == ABSENT
+
+
+def test_missing_strategy_does_not_grow_waits(tmp_path):
+    '''
+    Without a locator cache, an id that always misses keeps the default wait and does not push
+    up the timeout of the xpath that finds the field.
+    '''
+    report = imm(tmp_path)
+    report.locator_cache_path = None
+    report.wait_timer.poll_frequency = 0.01
+    driver = Fake_Driver({(By.XPATH, '//*[@id="CRELab_txtAccNum"]'): 'element'})
+    for _ in range(report.wait_timer.min_samples + 1):
+        assert report.locate(driver, 'txtAccNum', field_name='//*[@id="CRELab_txtAccNum"]') == 'element'
+    assert report.wait_timer.timeout('element:txtAccNum:id', 1) == 1
+    assert report.wait_timer.timeout('element:txtAccNum:field_name', 1) == report.wait_timer.element_lower
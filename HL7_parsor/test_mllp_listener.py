@@ -0,0 +1,67 @@
+
+import asyncio
+
+from MLLP_listener import MLLP_Listener, csv_writer, send_mllp
+from test_hl7_parser import SAMPLE
+
+
+def test_listener_acks_and_extracts():
+    '''
+    Messages sent over MLLP on localhost should be ACKed with their control id and
+    come out of the extraction as one record per OBX.
+    '''
+    records = []
+
+    async def run():
+        listener = MLLP_Listener(host='127.0.0.1', port=0, on_record=lambda *record: records.append(record))
+        consumer = await listener.start()
+        messages = [SAMPLE, SAMPLE.replace('MSG0001', 'MSG0002').replace('ACC123', 'ACC456')]
+        acks = await send_mllp('127.0.0.1', listener.port, messages)
+        await listener.stop()
+        consumer.cancel()
+        return acks
+
+    acks = asyncio.run(run())
+
+    assert [ack.split('\r')[1] for ack in acks] == ['MSA|AA|MSG0001', 'MSA|AA|MSG0002']
+    assert [record[0] for record in records] == ['ACC123', 'ACC456']
+    assert len(records[0][2]) == len(records[0][3])
+
+
+def test_listener_rejects_oversized_frame_and_keeps_reading():
+    '''
+    A frame over the listener's limit gets an AR NAK and is skipped, and the next message on
+    the same connection is still accepted.
+    '''
+    records = []
+
+    async def run():
+        listener = MLLP_Listener(host='127.0.0.1', port=0, frame_limit=1024,
+                                 on_record=lambda *record: records.append(record))
+        consumer = await listener.start()
+        oversized = SAMPLE.replace('MSG0001', 'MSG0003') + '\rNTE|1||' + 'X' * 5000
+        acks = await send_mllp('127.0.0.1', listener.port, [oversized, SAMPLE])
+        await listener.stop()
+        consumer.cancel()
+        return acks
+
+    acks = asyncio.run(run())
+
+    assert [ack.split('\r')[1].split('|')[1] for ack in acks] == ['AR', 'AA']
+    assert [record[0] for record in records] == ['ACC123']
+
+
+def test_csv_writer_closes(tmp_path):
+    '''
+    The CSV callback writes the header once and closes its file when used as a context manager.
+    '''
+    path = tmp_path / 'records.csv'
+    with csv_writer(str(path)) as write:
+        write('ACC123', 'SARS', ['a', 'b'], ['x', 'y'])
+    assert write.output.closed
+    with csv_writer(str(path)) as write:
+        write('ACC456', 'SARS', ['c', 'd'], ['x', 'y'])
+
+    lines = path.read_text().splitlines()
+    assert lines[0].startswith('Accession,Resulted Test,')
+    assert lines[1:] == ['ACC123,SARS,a,b', 'ACC456,SARS,c,d']
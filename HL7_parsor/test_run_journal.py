@@ -0,0 +1,140 @@
+import pandas as pd
+import pytest
+
+from HL7 import HL7_extraction
+from Run_journal import Run_Journal
+
+CASES = [('ACC1', 'TEST A', 1), ('ACC2', 'TEST B', 2), ('ACC3', 'TEST C', 3)]
+
+
+def summary(acc_num):
+    return pd.DataFrame({'TSTWebCMR Data': [acc_num], 'HL7 Data': ['20230210']}, index=['Accession Number'])
+
+
+def test_journal_round_trip(tmp_path):
+    '''
+    Cases are stored once per run, and recorded summaries come back in export order. Skipped
+    cases are not retried, cases that were never recorded keep the run open.
+    '''
+    journal = Run_Journal(str(tmp_path / 'run_journal.sqlite'))
+    run_id = journal.open_run('TEST LAB', '01/01/2023', '01/31/2023')
+    assert journal.open_run('TEST LAB', '01/01/2023', '01/31/2023') == run_id
+    assert journal.open_run('TEST LAB', '02/01/2023', '02/28/2023') != run_id
+
+    assert journal.add_cases(run_id, CASES) == run_id
+    assert journal.add_cases(run_id, CASES) == run_id
+    journal.record(run_id, 0, summary('ACC1'))
+    journal.record(run_id, 1, None)
+    # the case that was not recorded (its processing raised) keeps the run open
+    assert journal.pending(run_id) == [(2, CASES[2])]
+    assert not journal.finish(run_id)
+    assert journal.open_run('TEST LAB', '01/01/2023', '01/31/2023') == run_id
+
+    journal.record(run_id, 2, summary('ACC3'))
+    results = journal.results(run_id)
+    assert results[0].loc['Accession Number', 'TSTWebCMR Data'] == 'ACC1'
+    assert results[0].loc['Accession Number', 'HL7 Data'] == '20230210'
+    assert results[1] is None
+    assert journal.pending(run_id) == []
+    assert journal.finish(run_id)
+    assert journal.open_run('TEST LAB', '01/01/2023', '01/31/2023') != run_id
+
+
+def test_changed_cases_start_a_new_run(tmp_path):
+    '''
+    A run only resumes the case list it was started with; different cases start a new run
+    that keeps the export of the old one.
+    '''
+    journal = Run_Journal(str(tmp_path / 'run_journal.sqlite'))
+    run_id = journal.open_run('TEST LAB', '01/01/2023', '01/31/2023')
+    journal.set_export(run_id, 'IMM_Export.xlsx')
+    journal.add_cases(run_id, CASES)
+    journal.record(run_id, 0, summary('ACC1'))
+
+    changed = [CASES[1], CASES[0], ('ACC4', 'TEST D', 4)]
+    new_run = journal.add_cases(run_id, changed)
+
+    assert new_run != run_id
+    assert journal.open_run('TEST LAB', '01/01/2023', '01/31/2023') == new_run
+    assert journal.export_path(new_run) == 'IMM_Export.xlsx'
+    assert journal.pending(new_run) == list(enumerate(changed))
+    assert journal.add_cases(new_run, changed) == new_run
+
+
+def test_hl7_copy_resumes(tmp_path, monkeypatch):
+    '''
+    A run that stopped part way is resumed with its saved export, skipping the cases that are done.
+    '''
+    monkeypatch.chdir(tmp_path)
+    export = tmp_path / 'IMM_Export.xlsx'
+    export.write_bytes(b'')
+    calls = {'export': 0, 'login': 0, 'cases': []}
+
+    def imm_export():
+        calls['export'] += 1
+        report.export_path = str(export)
+        return 'driver'
+
+    def login():
+        calls['login'] += 1
+        return 'driver'
+
+    def process_case(driver, case):
+        calls['cases'].append(case[0])
+        if case[0] == 'ACC2' and crash:
+            raise RuntimeError('chrome crashed')
+        return summary(case[0])
+
+    report = HL7_extraction(LabName='TEST LAB', username='user', paswrd='password', FromDate='01/01/2023', ToDate='01/31/2023')
+    report.imm_export = imm_export
+    report.login = login
+    report.nav2IMM = lambda driver: None
+    report.export_df = lambda: pd.DataFrame({
+        'DILR_AccessionNumber': [case[0] for case in CASES],
+        'DILR_ResultedTest': [case[1] for case in CASES],
+        'DILR_IncidentID': [case[2] for case in CASES],
+    })
+    report.process_case = process_case
+
+    crash = True
+    with pytest.raises(RuntimeError):
+        report.hl7_copy()
+    assert calls == {'export': 1, 'login': 0, 'cases': ['ACC1', 'ACC2']}
+
+    crash = False
+    results = report.hl7_copy()
+    assert calls == {'export': 1, 'login': 1, 'cases': ['ACC1', 'ACC2', 'ACC2', 'ACC3']}
+    assert [df.loc['Accession Number', 'TSTWebCMR Data'] for df in results] == ['ACC1', 'ACC2', 'ACC3']
+
+
+def test_pool_threads_share_caches_created_up_front(tmp_path, monkeypatch):
+    '''
+    The lazily created caches exist before the Session_Pool threads start, so no two threads
+    each create their own.
+    '''
+    monkeypatch.chdir(tmp_path)
+    created = {}
+
+    class Pool:
+
+        def __init__(self, login, sessions, drivers):
+            self.driver = drivers[0]
+
+        def run(self, items, work):
+            created.update({name: name in vars(report) for name in ('_hl7_cache', '_incident_cache', '_wait_timer')})
+            return [work(self.driver, item) for item in items]
+
+    monkeypatch.setattr('HL7.Session_Pool', Pool)
+    report = HL7_extraction(LabName='TEST LAB', username='user', paswrd='password', FromDate='01/01/2023', ToDate='01/31/2023')
+    report.imm_export = lambda: setattr(report, 'export_path', str(tmp_path / 'IMM_Export.xlsx')) or 'driver'
+    report.nav2IMM = lambda driver: None
+    report.export_df = lambda: pd.DataFrame({
+        'DILR_AccessionNumber': [case[0] for case in CASES],
+        'DILR_ResultedTest': [case[1] for case in CASES],
+        'DILR_IncidentID': [case[2] for case in CASES],
+    })
+    report.process_case = lambda driver, case: summary(case[0])
+
+    results = report.hl7_copy(sessions=2)
+    assert created == {'_hl7_cache': True, '_incident_cache': True, '_wait_timer': True}
+    assert len(results) == len(CASES)
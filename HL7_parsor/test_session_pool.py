@@ -0,0 +1,165 @@
+
+import time
+import pytest
+import requests
+import threading
+import urllib.request
+
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from selenium.common.exceptions import WebDriverException
+from Session_pool import Session_Pool
+from WebCMR_http import WebCMR_Error
+
+
+class Stand_In(BaseHTTPRequestHandler):
+    'Local stand-in for WebCMR: every case page echoes its case number'
+
+    def do_GET(self):
+        body = self.path.rsplit('/', 1)[-1].encode()
+        self.send_response(200)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+class Fake_Session:
+
+    def __init__(self, url):
+        self.url = url
+        self.quit_called = False
+
+    def get(self, path):
+        with urllib.request.urlopen(self.url + path) as response:
+            return response.read().decode()
+
+    def quit(self):
+        self.quit_called = True
+
+
+def test_pool_shards_cases_and_keeps_order():
+    '''
+    Cases should be shared out over every session and come back in the original order,
+    with a failing case logged as None instead of stopping the run.
+    '''
+    server = ThreadingHTTPServer(('127.0.0.1', 0), Stand_In)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    url = f'http://127.0.0.1:{server.server_address[1]}'
+    existing = Fake_Session(url)
+    opened = []
+
+    def login():
+        session = Fake_Session(url)
+        opened.append(session)
+        return session
+
+    used = set()
+
+    def work(session, case):
+        used.add(id(session))
+        time.sleep(0.01)
+        if case == 13:
+            raise RuntimeError('browser crashed')
+        return int(session.get(f'/case/{case}'))
+
+    try:
+        results = Session_Pool(login, 3, drivers=[existing]).run(list(range(40)), work)
+    finally:
+        server.shutdown()
+
+    assert results == [None if case == 13 else case for case in range(40)]
+    assert len(opened) == 2 and len(used) == 3
+    assert all(session.quit_called for session in opened)
+    assert not existing.quit_called
+
+
+class Broken_Session:
+    'A browser that crashed: every call fails'
+
+    def __init__(self):
+        self.calls = 0
+        self.quit_called = False
+
+    def get(self, path):
+        self.calls += 1
+        raise WebDriverException('chrome not reachable')
+
+    def quit(self):
+        self.quit_called = True
+
+
+class Fake_Echo:
+    'A healthy browser that answers every case with the case'
+
+    def get(self, case):
+        return case
+
+    def quit(self):
+        pass
+
+
+def test_broken_session_hands_cases_over():
+    '''
+    A session whose browser fails for good puts its case back for the healthy sessions and
+    stops instead of failing every case after it.
+    '''
+    broken = Broken_Session()
+    healthy = []
+
+    def login():
+        session = Fake_Echo()
+        healthy.append(session)
+        return session
+
+    results = Session_Pool(login, 2, drivers=[broken], relogins=0).run(list(range(20)), lambda session, case: session.get(case))
+    assert results == list(range(20))
+    assert broken.calls == 1 and len(healthy) == 1
+
+
+def test_broken_session_logs_in_again_and_retries_are_capped():
+    '''
+    A failed session logs in again; a case that breaks every browser is given up after
+    max_attempts instead of being retried forever.
+    '''
+    logins = []
+
+    def login():
+        session = Fake_Echo() if logins else Broken_Session()
+        logins.append(session)
+        return session
+
+    def work(session, case):
+        if case == 3:
+            raise WebDriverException('tab crashed')
+        return session.get(case)
+
+    results = Session_Pool(login, 1, max_attempts=2, relogins=5).run(list(range(6)), work)
+    assert results == [0, 1, 2, None, 4, 5]
+    assert isinstance(logins[0], Broken_Session) and logins[0].quit_called
+
+
+@pytest.mark.parametrize('error', [
+    WebCMR_Error('Login failed, the login page came back'),
+    requests.ConnectionError('Connection reset by peer'),
+])
+def test_http_session_errors_hand_cases_over(error):
+    '''
+    A WebCMR_Error or requests exception of the HTTP backend fails the session like a browser
+    error: the case is retried on a new login instead of being logged as failed.
+    '''
+    logins = []
+
+    def login():
+        logins.append(Fake_Echo())
+        return logins[-1]
+
+    def work(session, case):
+        if session is logins[0] and case == 2:
+            raise error
+        return session.get(case)
+
+    results = Session_Pool(login, 1, relogins=1).run(list(range(5)), work)
+    assert results == list(range(5))
+    assert len(logins) == 2
@@ -0,0 +1,26 @@
+import pytest
+
+from SetUp import SetUp, chrome_options, LEAN_ARGUMENTS
+
+
+def test_full_profile_is_default():
+    '''
+    Without a launch profile Chrome starts as before: headed, normal page loads.
+    '''
+    assert SetUp('user', 'password', '01/01/2023', '01/31/2023').launch_profile == 'full'
+    options = chrome_options()
+    assert '--headless=new' not in options.arguments
+    assert options.page_load_strategy == 'normal'
+
+
+def test_lean_profile():
+    '''
+    The lean profile is headless, eager and does not load images.
+    '''
+    options = chrome_options('lean')
+    assert set(LEAN_ARGUMENTS) <= set(options.arguments)
+    assert '--window-size=1366,900' in options.arguments
+    assert options.page_load_strategy == 'eager'
+    assert options.experimental_options['prefs']['profile.managed_default_content_settings.images'] == 2
+    with pytest.raises(ValueError):
+        chrome_options('fast')
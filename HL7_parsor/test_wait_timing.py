@@ -0,0 +1,69 @@
+import time
+
+import pytest
+
+from selenium.common.exceptions import TimeoutException
+from Wait_timing import Wait_Timer
+
+
+def ready_after(seconds):
+    'A wait condition that is met once the given time has passed'
+    start = time.monotonic()
+    return lambda driver: time.monotonic() - start >= seconds
+
+
+def test_default_until_learned():
+    '''
+    Keys without enough latencies use the default timeout of the wait.
+    '''
+    timer = Wait_Timer(min_samples=3)
+    for seconds in (0.1, 0.2):
+        timer.record('page:imm', seconds)
+    assert timer.timeout('page:imm', 8) == 8
+    timer.record('page:imm', 0.3)
+    assert timer.timeout('page:imm', 8) == pytest.approx(0.45)
+
+
+def test_bounds_and_percentile():
+    '''
+    The timeout is the p99 latency with margin, kept within the bounds.
+    '''
+    timer = Wait_Timer(lower=0.5, upper=5, min_samples=1)
+    for _ in range(99):
+        timer.record('element:txtAccession', 0.01)
+    assert timer.timeout('element:txtAccession', 1) == 0.5
+    timer.record('element:txtAccession', 100)
+    assert timer.percentile('element:txtAccession') == 0.01
+    timer.record('element:txtAccession', 100)
+    assert timer.timeout('element:txtAccession', 1) == 5
+
+
+def test_until_records_latency():
+    '''
+    Waits record how long they took. A timeout is only recorded when the wait used a learned
+    timeout shorter than the default, so misses cannot grow it past default * margin.
+    '''
+    timer = Wait_Timer(lower=0.1, min_samples=1)
+    assert timer.until(None, 'page:imm', ready_after(0.1), default=2)
+    assert 0.1 <= timer.percentile('page:imm') < 0.5
+
+    with pytest.raises(TimeoutException):
+        timer.until(None, 'page:missing', ready_after(10), default=0.2)
+    assert not timer.learned('page:missing')
+
+    timer.record('page:slow', 0.1)
+    for _ in range(5):
+        with pytest.raises(TimeoutException):
+            timer.until(None, 'page:slow', ready_after(10), default=0.2)
+    assert timer.timeout('page:slow', 0.2) == pytest.approx(0.225)
+
+
+def test_element_floor():
+    '''
+    Element waits never get a learned timeout below element_lower, page waits go down to lower.
+    '''
+    timer = Wait_Timer(lower=0.25, element_lower=0.5, min_samples=1)
+    timer.record('page:imm', 0.01)
+    timer.record('element:txtUnits', 0.01)
+    assert timer.timeout('page:imm', 8) == 0.25
+    assert timer.timeout('element:txtUnits', 1) == 0.5
@@ -0,0 +1,198 @@
+import io
+import os
+import threading
+import urllib.parse
+
+import pandas as pd
+import pytest
+
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from HL7 import HL7_extraction
+from HL7_parser import HL7_Message
+from WebCMR_http import WebCMR_Session, WebCMR_Error
+
+# Synthetic WebCMR pages, hand-written to the ids and postback fields the scrapers use (not recorded)
+FIXTURES = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'fixtures', 'webcmr')
+PAGES = '/TSTWebCMR/pages'
+
+
+def fixture(name):
+    with open(os.path.join(FIXTURES, name), 'rb') as page:
+        return page.read()
+
+
+def export_workbook():
+    output = io.BytesIO()
+    pd.DataFrame({
+        'DILR_ImportStatus': ['Imported'],
+        'DILR_ResultedTest': ['SARS-CoV-2 RNA [Presence]'],
+        'DILR_IncidentID': [1234],
+        'DILR_AccessionNumber': ['ACC123'],
+        'DILR_ResultValue': ['Detected'],
+    }).to_excel(output, index=False)
+    return output.getvalue()
+
+
+class WebCMR_Stand_In(BaseHTTPRequestHandler):
+    '''
+    Local WebCMR stand-in serving the synthetic fixture pages. Postbacks are only answered
+    when they carry the __VIEWSTATE of the page they were posted from, as ASP.NET requires.
+    The pages are hand-written, not recorded, so these tests check the postback protocol the
+    session follows rather than the markup of the live site.
+    '''
+    protocol_version = 'HTTP/1.1'
+    connections = set()
+    requests = []
+
+    def do_GET(self):
+        self.track()
+        path = urllib.parse.urlsplit(self.path).path
+        pages = {
+            f'{PAGES}/login/login.aspx': 'login.html',
+            f'{PAGES}/Main.aspx': 'main.html',
+            f'{PAGES}/DisInc.aspx': 'di_demographics.html',
+            f'{PAGES}/imm/IMM.aspx': 'imm.html',
+            f'{PAGES}/imm/ExportOptions.aspx': 'export_options.html',
+        }
+        if path not in pages:
+            return self.reply(404, b'not found')
+        self.reply(200, fixture(pages[path]))
+
+    def do_POST(self):
+        self.track()
+        path = urllib.parse.urlsplit(self.path).path
+        length = int(self.headers.get('Content-Length', 0))
+        form = dict(urllib.parse.parse_qsl(self.rfile.read(length).decode(), keep_blank_values=True))
+        state = form.get('__VIEWSTATE')
+
+        if path == f'{PAGES}/login/login.aspx' and state == 'vs-login' and 'btnLogin' in form:
+            if form.get('txtUsername') == 'user' and form.get('txtPassword') == 'password':
+                return self.redirect(f'{PAGES}/Main.aspx')
+            return self.reply(200, fixture('login.html'))
+        if path == f'{PAGES}/Main.aspx' and state == 'vs-main' and form.get('FragTop1$txtFindDisInc') == '1234':
+            return self.reply(200, fixture('main_results.html'))
+        if path == f'{PAGES}/Main.aspx' and state == 'vs-main-results' and form.get('__EVENTTARGET') == 'dgResults$ctl02$lnkIncident':
+            return self.redirect(f'{PAGES}/DisInc.aspx?id=1234')
+        if path == f'{PAGES}/DisInc.aspx' and state == 'vs-di' and 'ctl37$btnSupplementalTabSYS' in form:
+            return self.reply(200, fixture('di_lab.html'))
+        if path == f'{PAGES}/imm/IMM.aspx' and state == 'vs-imm' and 'ibtnSearch.x' in form:
+            if form.get('txtAccession') == 'ACC123':
+                return self.reply(200, fixture('imm_message.html'))
+            if form.get('ddlLaboratory') == '17' and form.get('txtFromDate') == '01/01/2023':
+                return self.reply(200, fixture('imm_results.html'))
+        if path == f'{PAGES}/imm/IMM.aspx' and state == 'vs-imm-results' and 'btnExport$btnExport' in form:
+            return self.reply(200, fixture('imm_export.html'))
+        if (path == f'{PAGES}/imm/ExportOptions.aspx' and state == 'vs-export-options'
+                and form.get('optFormat') == 'XLS' and form.get('clstAll$0') == 'All'):
+            return self.reply(200, export_workbook(), {
+                'Content-Type': 'application/vnd.ms-excel',
+                'Content-Disposition': 'attachment; filename="IMM_Export.xlsx"'
+            })
+        if (path == f'{PAGES}/imm/ExportOptions.aspx' and state == 'vs-export-options'
+                and form.get('optFormat') == 'CSV' and form.get('clstAll$0') == 'All'):
+            return self.reply(200, b'DILR_ImportStatus,DILR_AccessionNumber\r\nImported,ACC123\r\n', {
+                'Content-Type': 'text/csv',
+                'Content-Disposition': 'attachment; filename="IMM_Export.csv"'
+            })
+        self.reply(500, b'invalid postback')
+
+    def track(self):
+        self.connections.add(self.client_address)
+        self.requests.append(self.path)
+
+    def redirect(self, location):
+        self.reply(302, b'', {'Location': location})
+
+    def reply(self, status, body, headers=None):
+        self.send_response(status)
+        for key, value in (headers or {}).items():
+            self.send_header(key, value)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+@pytest.fixture
+def webcmr():
+    WebCMR_Stand_In.connections = set()
+    WebCMR_Stand_In.requests = []
+    server = ThreadingHTTPServer(('127.0.0.1', 0), WebCMR_Stand_In)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield f'http://127.0.0.1:{server.server_address[1]}'
+    server.shutdown()
+    server.server_close()
+
+
+def session(url):
+    return WebCMR_Session(f'{url}{PAGES}/login/login.aspx', 'user', 'password', imm_url=f'{url}{PAGES}/imm/IMM.aspx')
+
+
+def test_login_and_keep_alive(webcmr):
+    '''
+    Logging in replays the login form state, and requests share keep-alive connections.
+    '''
+    client = session(webcmr).login()
+    assert client.home_url.endswith('/Main.aspx')
+    client.hl7_text('ACC123', 'SARS-CoV-2 RNA')
+    assert len(WebCMR_Stand_In.requests) == 5
+    assert len(WebCMR_Stand_In.connections) == 1
+
+    with pytest.raises(WebCMR_Error):
+        WebCMR_Session(f'{webcmr}{PAGES}/login/login.aspx', 'user', 'wrong').login()
+
+
+def test_hl7_text(webcmr):
+    '''
+    The HL7 text of divContentsArea comes back one segment per line.
+    '''
+    msg = HL7_Message(session(webcmr).login().hl7_text('ACC123', 'SARS-CoV-2 RNA'))
+    assert msg['MSH-10'] == 'MSG0001'
+    assert msg['SPM-2'] == 'ACC123&LAB'
+    assert msg.find_obx('SARS-CoV-2 RNA [Presence]')
+
+
+def test_export(webcmr, tmp_path):
+    '''
+    The export dialog is posted with all columns and the Excel format.
+    '''
+    client = session(webcmr).login()
+    client.imm_search('TEST LAB', '01/01/2023', '01/31/2023')
+    path = client.export(str(tmp_path))
+    assert os.path.basename(path) == 'IMM_Export.xlsx'
+    assert list(pd.read_excel(path)['DILR_AccessionNumber']) == ['ACC123']
+
+
+def test_export_csv(webcmr, tmp_path):
+    '''
+    Other export formats are picked by their radio button in the export dialog.
+    '''
+    client = session(webcmr).login()
+    client.imm_search('TEST LAB', '01/01/2023', '01/31/2023')
+    path = client.export(str(tmp_path), 'csv')
+    assert os.path.basename(path) == 'IMM_Export.csv'
+    assert list(pd.read_csv(path)['DILR_AccessionNumber']) == ['ACC123']
+
+
+def test_disease_incident_scrape(webcmr, tmp_path):
+    '''
+    webTST_scrape over HTTP finds the incident through the home page search and reads both tabs.
+    '''
+    report = HL7_extraction(
+        LabName='TEST LAB', username='user', paswrd='password', FromDate='01/01/2023', ToDate='01/31/2023',
+        url=f'{webcmr}{PAGES}/login/login.aspx'
+    )
+    report.locator_cache_path = str(tmp_path / 'locators.sqlite')
+    values, indicies = report.webTST_scrape(session(webcmr).login(), [1234], 0)
+    record = dict(zip(indicies, values))
+    assert record['Name'] == 'JANE DOE'
+    assert record['Ethnicity'] == 'Not Hispanic'
+    assert record['Gender'] == 'Female'
+    assert record['Demographic Address'] == '1 MAIN ST, SAN DIEGO, CA 92101'
+    assert record['Accession Number'] == 'ACC123'
+    assert record['Resulted Test'] == 'SARS-CoV-2 RNA [Presence]'
+    assert record['Abnormal Flag'] == 'Abnormal'
+    assert record['Facility Name'] == 'TEST LAB'